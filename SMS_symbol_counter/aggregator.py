@@ -1,7 +1,19 @@
+import argparse
 import csv
-import re
+import heapq
 import logging
 from collections import defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+import clustering
+import profiling
+import report_store
+import rule_engine
+import xlsx_io
+# Те же правила «супер-обобщения», что и в generaliser.py (rules/generalize_rules.json)
+from io_utils import open_output, open_text
+from pattern_utils import super_generalize
 
 # Настройка логирования
 logging.basicConfig(
@@ -17,120 +29,109 @@ SEP = '\t'
 MSG_COL = "message"
 TIME_COL = "submission_date"
 PHONE_COL = "phone"
+OUTPUT_LIMIT = None        # сколько самых частых паттернов писать (None — все)
+PARALLEL_MIN_PATTERNS = 20_000  # меньше уникальных паттернов — обобщаем в одном процессе
+CLUSTER_THRESHOLD = None   # похожесть (Жаккар по шинглам) для склейки почти одинаковых паттернов; None — не склеивать
+CLUSTERS_OUTPUT = "patterns_clusters.csv"
+
+def load_merged_records(path: str) -> list:
+    """
+    Склеивает сырые сообщения с одинаковыми временем и телефоном.
+    Раньше выполнялось при импорте модуля, теперь — только по вызову.
+    """
+    raw = defaultdict(list)
+    with open_text(path) as f:
+        rdr = csv.DictReader(f, delimiter=SEP, quoting=csv.QUOTE_NONE)
+        for row in rdr:
+            t = row.get(TIME_COL, "").strip()
+            p = row.get(PHONE_COL, "").strip()
+            m = row.get(MSG_COL, "").strip()
+            if not t or not p or len(m) < 1:
+                continue
+            raw[(t, p)].append((row, m))
+
+    # 2) склеиваем по ключу
+    merged_records = []
+    for (t, p), lst in raw.items():
+        if len(lst) > 1:
+            # сортируем по порядку, если нужно – по индексу
+            combined = "".join(m for (_, m) in lst)
+            # возьмём остальные поля из первой записи, но с объединённым текстом
+            first_row = lst[0][0].copy()
+            first_row[MSG_COL] = combined
+            merged_records.append(first_row)
+        else:
+            merged_records.append(lst[0][0])
+    return merged_records
+
 
-raw = defaultdict(list)
-with open(INPUT_FILE, encoding="utf-8") as f:
-    rdr = csv.DictReader(f, delimiter=SEP, quoting=csv.QUOTE_NONE)
-    for row in rdr:
-        t = row.get(TIME_COL, "").strip()
-        p = row.get(PHONE_COL, "").strip()
-        m = row.get(MSG_COL, "").strip()
-        if not t or not p or len(m) < 1:
-            continue
-        raw[(t, p)].append((row, m))
-
-# 2) склеиваем по ключу
-merged_records = []
-for (t, p), lst in raw.items():
-    if len(lst) > 1:
-        # сортируем по порядку, если нужно – по индексу
-        combined = "".join(m for (_, m) in lst)
-        # возьмём остальные поля из первой записи, но с объединённым текстом
-        first_row = lst[0][0].copy()
-        first_row[MSG_COL] = combined
-        merged_records.append(first_row)
+@contextmanager
+def open_report(report_file: str):
+    """Строки отчёта generaliser: CSV (в том числе сжатый), .xlsx или бинарный .smsr."""
+    if xlsx_io.is_xlsx(report_file):
+        yield xlsx_io.dict_rows(report_file)
+    elif report_store.is_binary_report(report_file):
+        with report_store.ReportFile(report_file) as report:
+            yield report.rows()
     else:
-        merged_records.append(lst[0][0])
-
-SPECIALS = {
-    # kh: {NUM} {NUM},{NUM} KZT… → {MONEY}
-    r"kh: \{NUM\} \{NUM\},\{NUM\} KZT\.Karta:\{NUM\}\*\*\{NUM\}\.Qaldyq/ostatok:\{NUM\},\{NUM\} KZT":
-        "kh: {MONEY} KZT. Karta: {NUM}**{NUM}. Qaldyq/ostatok: {MONEY} KZT",
-
-    # k: {NUM} {NUM}.{NUM} KZT → k: {MONEY} KZT
-    r"k: \{NUM\} \{NUM\}\.\{NUM\} KZT":
-        "k: {MONEY} KZT",
-
-    # KODTY…(KZT)…Kod:{NUM} → ({MONEY}).Kod:{NUM}
-    r"KODTY ESHKIMGE AITPANYZ/NIKOMU NE GOVORITE KOD\.Audarym/Perevod: \(\{NUM\} \{NUM\}\.\{NUM\} KZT\)\.Kod:\{NUM\}":
-        "KODTY ESHKIMGE AITPANYZ/NIKOMU NE GOVORITE KOD.Audarym/Perevod: ({MONEY}).Kod:{NUM}",
-
-    # Sizge…Salemdeme kody {CODE}…Vam postupila posylka {CODE}
-    r"Sizge \{CODE\} salemdemesi keldi\.Salemdeme kody \{CODE\} Saqtau merzimi \{NUM\} kun\..*?Vam postupila posylka \{CODE\}":
-        "Sizge {CODE} salemdemesi keldi. Salemdeme kody {CODE} Saqtau merzimi {NUM} kun. Vam postupila posylka {CODE}",
-
-    # {CODE}.Kod posylki X-{NUM}-{NUM}… → {CODE}.Kod posylki {CODE}…
-    r"\{CODE\}\.Kod posylki [A-Za-z0-9]+-\{NUM\}-\{NUM\}\. Srok hranenia \{NUM\} dney\. Uznat dopolnitelnuyu informaciu mozhete na post\.kz\.":
-        "{CODE}.Kod posylki {CODE}. Srok hranenia {NUM} dney. Uznat dopolnitelnuyu informaciu mozhete na post.kz.",
-
-    # обрезанные хвосты «…Vam postupila posylka»
-    r"Sizge \{CODE\} salemdemesi keldi\.Salemdeme kody \{CODE\} Saqtau merzimi \{NUM\} kun\. Qosymsha aqparatty post\.kz - ten bile alasyz\.Vam postupila posylka(?: [A-Za-z0-9]*)?":
-        "Sizge {CODE} salemdemesi keldi. Salemdeme kody {CODE} Saqtau merzimi {NUM} kun. Qosymsha aqparatty post.kz - ten bile alasyz. Vam postupila posylka {CODE}",
-
-    # sourcet URL → {TRACK_URL}
-    r"Sizge salemdeme keldi\. Saqtau merzimi \{NUM\} kun\. / Vam prishla posylka\. Srok hranenia \{NUM\} dney\. Tolygyraq/Detali:? ?\{TRACK_URL\}":
-        "Sizge salemdeme keldi. Saqtau merzimi {NUM} kun. / Vam prishla posylka. Srok hranenia {NUM} dney. Tolygyraq/Detali: {TRACK_URL}",
-
-    # транзакционные «qolma-qol … snyatie»
-    r"\{TIME\} qolma-qol aqshany sheship aly(?:ndy| oryndalmady)/ otmena snyatiya nalichnykh: \{(?:NUM|MONEY)\}(?: \{NUM\})*(?:\.\{NUM\})? (?:KZT|UZS|USD)\. Karta:\{NUM\}\*\*\{NUM\}\. Qaldyq/ostatok: \{(?:NUM|MONEY)\}(?: \{NUM\})*(?:\.\{NUM\})? (?:KZT|UZS|USD)":
-        "{TIME} qolma-qol aqsha sheship alyndy/otmena snyatiya nalichnykh: {MONEY} {CURR}. Karta:{NUM}**{NUM}. Qaldyq/ostatok: {MONEY} {CURR}",
-
-    # *{NUM} shotqa … Ostatok {NUM} KZT
-    r"\*\{NUM\} shott?a \{NUM\} KZT soma alyndy\.(.*?)Ostatok \{NUM\} KZT":
-        "*{NUM} shotqa {NUM} KZT soma alyndy. Qaldygy {NUM} KZT/ Postuplenie na schet *{NUM} Summa {NUM} KZT. Ostatok {NUM} KZT",
-
-    # telefon nomiri…USD/EUR/KZT
-    r"\{TIME\} telefon nomiri arqyly audarym kelip tusti/ postupil perevod po nomeru telefona: \{(?:NUM|MONEY)\}(?:\.\{NUM\})? (?:KZT|USD|EUR|UZS)\. K\*\*\{NUM\}\. Qaldyq/ostatok: \{(?:NUM|MONEY)\}(?:\.\{NUM\})? (?:KZT|USD|EUR|UZS)":
-        "{TIME} telefon nomiri arqyly audarym kelip tusti/ postupil perevod po nomeru telefona: {MONEY} {CURR}. K**{NUM}. Qaldyq/ostatok: {MONEY} {CURR}",
-
-    # хвостовые «12345KZ.Kod posylki -{NUM}…»
-    r"\d+[A-Z]{2}\.Kod posylki -\{NUM\}\. Srok hranenia \{NUM\} dney\. Uznat dopolnitelnuyu informaciu mozhete na post\.kz\.":
-        "{CODE}.Kod posylki -{NUM}. Srok hranenia {NUM} dney. Uznat dopolnitelnuyu informaciu mozhete na post.kz.",
-}
-
-# Регулярка для удаления подряд {NUM} {MONEY}
-NUM_MONEY_RX = re.compile(r"\{NUM\}[\u00A0\s]+\{MONEY\}")
-
-
-def super_generalize(pattern: str) -> str:
-    """Обобщаем паттерн: сначала SPECIALS, затем общие правила, включая свёртку {NUM} {MONEY}."""
-    # 1) специальные случаи
-    for rx, repl in SPECIALS.items():
-        if re.fullmatch(rx, pattern):
-            logging.debug(f"SPECIALS matched: {pattern} -> {repl}")
-            return repl
-
-    p = pattern
-    # 2) пример общего обобщения (как в temp3)
-    # убираем всё перед ".Kod posylki"
-    p = re.sub(r"^.*?\\.Kod posylki", "{CODE}.Kod posylki", p)
-    # даты-время
-    p = re.sub(r"\{NUM\}-\{NUM\}-\{NUM\} \{TIME\}", "{DATETIME}", p)
-    # суммы с валютой
-    p = re.sub(
-        r"\{NUM\}(?:[ ,]\{NUM\})*(?:[.,]\{NUM\})? [A-Z]{3}\b",
-        "{MONEY} {CURR}",
-        p
-    )
-    # ссылки и треки
-    p = re.sub(r"/t/\{\d+_TRACK\}", "{TRACK_URL}", p)
-    p = re.sub(r"\{URL\}", "{TRACK_URL}", p)
-    # любые коды вида {N_CODE} → {CODE}
-    p = re.sub(r"\{\d+_CODE\}", "{CODE}", p)
-    # сглаживаем подряд несколько {NUM}
-    p = re.sub(r"(?:\{NUM\}){2,}", "{NUM}", p)
-
-    # 3) СВЁРТКА {NUM} {MONEY} → {MONEY} (учитывая NBSP)
-    before = p
-    p = NUM_MONEY_RX.sub("{MONEY}", p)
-    if p != before:
-        logging.debug(f"Num-money collapse: {before} -> {p}")
-
-    return p
-
-
-def aggregate_patterns(report_file: str) -> dict:
-    """Читаем patterns_report_full.csv и собираем агрегированные данные."""
+        with open_text(report_file) as f:
+            yield csv.DictReader(f)
+
+
+def report_patterns(report_file: str) -> dict:
+    """Уникальные паттерны отчёта (первый проход перед параллельным обобщением)."""
+    if report_store.is_binary_report(report_file):
+        with report_store.ReportFile(report_file) as report:
+            return dict.fromkeys(report.strings("Pattern"))
+    with open_report(report_file) as rows:
+        return dict.fromkeys(row["Pattern"] for row in rows)
+
+
+def aggregate_patterns(report_file: str, workers: int = 1) -> dict:
+    """
+    Читаем отчёт generaliser (CSV — в том числе сжатый, .xlsx или бинарный .smsr) и собираем агрегированные данные.
+    Для нескольких процессов отчёт читается дважды: сначала только паттерны, потом строки потоком.
+    """
+    patterns = None
+    if workers > 1:
+        with profiling.stage("read_patterns") as st:
+            patterns = report_patterns(report_file)
+            st.rows_out = len(patterns)
+    with open_report(report_file) as rows:
+        return aggregate_rows(rows, workers, patterns)
+
+
+def generalize_all(patterns, workers: int = 1) -> dict:
+    """
+    Обобщает каждый уникальный паттерн один раз: {исходный паттерн → обобщённый}.
+    Для больших отчётов — в нескольких процессах.
+    """
+    patterns = list(dict.fromkeys(patterns))
+    if workers > 1 and len(patterns) >= PARALLEL_MIN_PATTERNS:
+        chunksize = max(1, len(patterns) // (workers * 8))
+        # файл правил передаётся явно: при spawn воркер не видит set_rules_file родителя
+        with ProcessPoolExecutor(max_workers=workers, initializer=rule_engine.set_rules_file,
+                                 initargs=(rule_engine.RULES_FILE,)) as pool:
+            return dict(zip(patterns, pool.map(super_generalize, patterns, chunksize=chunksize)))
+    return {pat: super_generalize(pat) for pat in patterns}
+
+
+def aggregate_rows(rows, workers: int = 1, patterns=None) -> dict:
+    """
+    Собираем агрегированные данные из строк отчёта generaliser.py (файл или память).
+    Строки читаются потоком — в памяти только агрегаты и словарь {паттерн →
+    обобщённый}: паттерн встречается по строке на каждый тип трафика, а
+    обобщается один раз. Параллельному обобщению нужны все паттерны заранее —
+    patterns (уникальные значения Pattern); без них паттерны обобщаются по ходу
+    чтения в одном процессе.
+    """
+    generalized = {}
+    if patterns is not None:
+        with profiling.stage("generalize") as st:
+            generalized = generalize_all(patterns, workers)
+            st.rows_in = len(generalized)
+            st.rows_out = len(set(generalized.values()))
+
     agg = defaultdict(lambda: {
         "sum_count": 0,
         "example_msg": None,
@@ -139,20 +140,16 @@ def aggregate_patterns(report_file: str) -> dict:
         "example_segs": 0
     })
 
-    with open(report_file, encoding="utf-8", newline="") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            raw_pat    = row["Pattern"]
-            traffic    = row["Traffic Type"]
-            count      = int(row["Total Count"])
-            length     = int(row["Length"])
-            segs       = int(row["SMS Segments"])
+    with profiling.stage("merge") as st:
+        for row in st.count_in(rows):
+            raw_pat = row["Pattern"]
+            gen = generalized.get(raw_pat)
+            if gen is None:
+                gen = generalized[raw_pat] = super_generalize(raw_pat)
+            count, segs = int(row["Total Count"]), int(row["SMS Segments"])
             # используем исходный пример сообщения из колонки Example
             example_msg = row.get("Example", "")
-
-            gen_pat = super_generalize(raw_pat)
-            key = (gen_pat, traffic)
-            rec = agg[key]
+            rec = agg[(gen, row["Traffic Type"])]
 
             # суммируем
             rec["sum_count"] += count
@@ -164,36 +161,141 @@ def aggregate_patterns(report_file: str) -> dict:
                     "example_len": len(example_msg),
                     "example_segs": segs
                 })
+        st.rows_out = len(agg)
     return agg
 
 
-def write_output(agg: dict, output_file: str):
-    """Записываем агрегированные результаты в CSV."""
-    with open(output_file, "w", encoding="utf-8", newline="") as f:
+def cluster_aggregated(agg: dict, threshold: float):
+    """
+    Склеивает почти одинаковые обобщённые паттерны одного типа трафика
+    (clustering.find_clusters). Кластер записывается под самым частым
+    паттерном, счётчики суммируются, пример — самый длинный из примеров.
+    Возвращает (новый agg, кластеры для отчёта).
+    """
+    keys = list(agg)
+    found = clustering.find_clusters([pat for pat, _ in keys], [traffic for _, traffic in keys], threshold)
+    merged = dict(agg)
+    clusters = []
+    for members in found:
+        members = sorted((keys[i] for i in members), key=lambda k: (-agg[k]["sum_count"], k))
+        head = members[0]
+        rec = dict(agg[head])
+        for key in members[1:]:
+            other = merged.pop(key)
+            rec["sum_count"] += other["sum_count"]
+            if other["example_len"] > rec["example_len"]:
+                rec.update({name: other[name] for name in
+                            ("example_msg", "example_count", "example_len", "example_segs")})
+        merged[head] = rec
+        head_shingles = clustering.shingles(head[0])
+        clusters.append({
+            "pattern": head[0],
+            "traffic": head[1],
+            "sum_count": rec["sum_count"],
+            "members": [(pat, agg[(pat, traffic)]["sum_count"],
+                         clustering.jaccard(head_shingles, clustering.shingles(pat)))
+                        for pat, traffic in members],
+        })
+    clusters.sort(key=lambda c: (-c["sum_count"], c["pattern"], c["traffic"]))
+    return merged, clusters
+
+
+def write_clusters(clusters, output_file):
+    """Состав кластеров: по строке на паттерн — материал для новых правил в rules/generalize_rules.json."""
+    with open_output(output_file) as f:
         writer = csv.writer(f)
-        writer.writerow([
-            "Generalized Pattern",
-            "Traffic Type",
-            "Sum Total Count",
-            "Example Message",
-            "Example Total Count",
-            "Example Length",
-            "Example SMS Segments",
-        ])
-        for (gen, traffic), rec in sorted(agg.items(), key=lambda x: x[1]["sum_count"], reverse=True):
-            writer.writerow([
-                gen,
-                traffic,
-                rec["sum_count"],
-                rec["example_msg"],
-                rec["example_count"],
-                rec["example_len"],
-                rec["example_segs"],
-            ])
-    logging.info(f"Готово — {len(agg)} обобщённых паттернов записано в {output_file}")
+        writer.writerow(["Cluster", "Traffic Type", "Cluster Pattern", "Cluster Total Count",
+                         "Member Pattern", "Member Total Count", "Similarity"])
+        for n, cluster in enumerate(clusters, start=1):
+            for pat, count, similarity in cluster["members"]:
+                writer.writerow([n, cluster["traffic"], cluster["pattern"], cluster["sum_count"],
+                                 pat, count, f"{similarity:.3f}"])
+    logging.info(f"Состав {len(clusters)} кластеров записан в {output_file}")
+
+
+def cluster_stage(agg: dict, threshold: float, clusters_file=None) -> dict:
+    """cluster_aggregated с записью состава кластеров; возвращает склеенный agg."""
+    with profiling.stage("cluster") as st:
+        merged, clusters = cluster_aggregated(agg, threshold)
+        st.rows_in, st.rows_out = len(agg), len(merged)
+    logging.info(f"Кластеризация (порог {threshold}): {len(agg)} → {len(merged)} паттернов, кластеров {len(clusters)}")
+    if clusters_file:
+        write_clusters(clusters, clusters_file)
+    return merged
+
+
+def _sum_count(item):
+    return item[1]["sum_count"]
+
+
+def top_entries(agg: dict, limit=None):
+    """
+    Записи по убыванию суммарного количества; с limit — только первые limit
+    через кучу, без сортировки всего словаря. Порядок равных как у sorted().
+    """
+    if limit is None:
+        return sorted(agg.items(), key=_sum_count, reverse=True)
+    return heapq.nlargest(limit, agg.items(), key=_sum_count)
+
+
+OUTPUT_COLUMNS = [
+    "Generalized Pattern",
+    "Traffic Type",
+    "Sum Total Count",
+    "Example Message",
+    "Example Total Count",
+    "Example Length",
+    "Example SMS Segments",
+]
+
+
+def output_rows(entries):
+    for (gen, traffic), rec in entries:
+        yield [
+            gen,
+            traffic,
+            rec["sum_count"],
+            rec["example_msg"],
+            rec["example_count"],
+            rec["example_len"],
+            rec["example_segs"],
+        ]
+
+
+def write_output(agg: dict, output_file: str, limit=None):
+    """Записываем агрегированные результаты (или limit самых частых) в CSV или .xlsx."""
+    limit = OUTPUT_LIMIT if limit is None else limit
+    with profiling.stage("sort") as st:
+        entries = top_entries(agg, limit)
+        st.rows_in, st.rows_out = len(agg), len(entries)
+    with profiling.stage("write_output") as st:
+        st.rows_in = st.rows_out = len(entries)
+        if xlsx_io.is_xlsx(output_file):
+            with xlsx_io.XlsxWriter(output_file, OUTPUT_COLUMNS) as writer:
+                writer.writerows(output_rows(entries))
+        else:
+            with open_output(output_file) as f:
+                writer = csv.writer(f)
+                writer.writerow(OUTPUT_COLUMNS)
+                writer.writerows(output_rows(entries))
+    logging.info(f"Готово — {len(entries)} из {len(agg)} обобщённых паттернов записано в {output_file}")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Агрегация отчёта generaliser")
+    parser.add_argument("--workers", type=int, default=1, help="число процессов для обобщения")
+    parser.add_argument("--limit", type=int, help="записать только N самых частых паттернов")
+    parser.add_argument("--cluster", type=float, metavar="THRESHOLD",
+                        help="склеить почти одинаковые паттерны с похожестью от THRESHOLD (0–1)")
+    parser.add_argument("--clusters-report", default=CLUSTERS_OUTPUT, help="куда записать состав кластеров")
+    parser.add_argument("--profile", help="записать JSON-отчёт инструментовки (стадии и правила)")
+    parser.add_argument("--pstats", help="записать дамп cProfile")
+    args = parser.parse_args()
+
     logging.info("Начинаем агрегацию паттернов...")
-    aggregated = aggregate_patterns(INPUT)
-    write_output(aggregated, OUTPUT)
+    with profiling.session(args.profile, args.pstats, "aggregator"):
+        aggregated = aggregate_patterns(INPUT, args.workers)
+        threshold = CLUSTER_THRESHOLD if args.cluster is None else args.cluster
+        if threshold is not None:
+            aggregated = cluster_stage(aggregated, threshold, args.clusters_report)
+        write_output(aggregated, OUTPUT, args.limit)
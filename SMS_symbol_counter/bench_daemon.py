@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import pattern_daemon
+from bench_suite import sample_messages
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+# --- Нагрузка на pattern_daemon.py с localhost ---
+BATCHES = 2_000
+BATCH_SIZE = 100
+DEPTH = 8          # запросов «в полёте» на одно соединение
+CONNECTIONS = 4
+DISTINCT = 20_000  # разных сообщений в пуле, из которого собираются пачки
+SEED = 7
+
+
+async def _connect(args):
+    limit = pattern_daemon.MAX_REQUEST_BYTES
+    if args.port is not None:
+        return await asyncio.open_connection(pattern_daemon.HOST, args.port, limit=limit)
+    return await asyncio.open_unix_connection(args.socket or pattern_daemon.SOCKET_PATH, limit=limit)
+
+
+async def _request(args, payload):
+    reader, writer = await _connect(args)
+    writer.write(json.dumps(payload).encode("utf-8") + b"\n")
+    response = json.loads(await reader.readline())
+    writer.close()
+    return response
+
+
+async def _client(args, batches, latencies):
+    """Одно соединение: держит до args.depth запросов без ответа, ответы приходят по порядку."""
+    reader, writer = await _connect(args)
+    sent = asyncio.Queue(maxsize=args.depth)
+
+    async def send():
+        for request_id, batch in batches:
+            await sent.put(time.perf_counter())
+            writer.write(json.dumps({"id": request_id, "messages": batch}, ensure_ascii=False).encode("utf-8") + b"\n")
+            await writer.drain()
+
+    async def receive():
+        for _ in batches:
+            response = json.loads(await reader.readline())
+            if "error" in response:
+                raise Exception(f"Ошибка сервера: {response['error']}")
+            latencies.append(time.perf_counter() - sent.get_nowait())
+
+    await asyncio.gather(send(), receive())
+    writer.close()
+
+
+async def run_load(args):
+    pool = sample_messages(DISTINCT, args.seed)
+    batches = [(i, [pool[(i * args.batch_size + j) % len(pool)] for j in range(args.batch_size)])
+               for i in range(args.batches)]
+    per_conn = [batches[c::args.connections] for c in range(args.connections)]
+
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(args, part, latencies) for part in per_conn))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    n = len(latencies)
+    total = args.batches * args.batch_size
+    print(f"Пачек {n} × {args.batch_size}, соединений {args.connections}, глубина {args.depth}")
+    print(f"Пропускная способность: {total / elapsed:,.0f} сообщений/с ({n / elapsed:,.0f} пачек/с)")
+    print(f"Задержка пачки (клиент): p50 {1000 * latencies[n // 2]:.2f} мс, "
+          f"p99 {1000 * latencies[min(n - 1, int(0.99 * n))]:.2f} мс")
+    stats = (await _request(args, {"op": "stats"}))["stats"]
+    print(f"Сервер: p50 {stats['batch_ms_p50']} мс, p99 {stats['batch_ms_p99']} мс на обработку пачки, "
+          f"hit-rate кэша шаблонов {stats['cache_template']['hit_rate']:.1%}")
+
+
+def spawn_daemon(args):
+    """Запускает pattern_daemon.py рядом и ждёт, пока он ответит на ping."""
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "pattern_daemon.py")]
+    cmd += ["--port", str(args.port)] if args.port is not None else ["--socket", args.socket or pattern_daemon.SOCKET_PATH]
+    proc = subprocess.Popen(cmd)
+    for _ in range(100):
+        try:
+            asyncio.run(_request(args, {"op": "ping"}))
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise Exception("pattern_daemon.py не ответил за 10 секунд")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный клиент для pattern_daemon.py")
+    parser.add_argument("--socket", help=f"Unix-сокет сервера (по умолчанию {pattern_daemon.SOCKET_PATH})")
+    parser.add_argument("--port", type=int, help=f"TCP-порт сервера на {pattern_daemon.HOST}")
+    parser.add_argument("--spawn", action="store_true", help="запустить сервер самому и остановить после замера")
+    parser.add_argument("--batches", type=int, default=BATCHES)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--depth", type=int, default=DEPTH, help="запросов без ответа на соединение")
+    parser.add_argument("--connections", type=int, default=CONNECTIONS)
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    proc = spawn_daemon(args) if args.spawn else None
+    try:
+        asyncio.run(run_load(args))
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
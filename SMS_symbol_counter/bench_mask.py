@@ -0,0 +1,128 @@
+import re
+import random
+import time
+import logging
+
+from pattern_utils import dynamic_mask
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+N_MESSAGES = 200_000
+N_FUZZ = 200_000
+SEED = 42
+
+SAMPLES = [
+    "2025-05-01 Sizdin belsendiru kody / Vash kod aktivatsii:{otp}",
+    "Tekseru kody/Kod proverki:{otp}",
+    "{track}.Kod posylki {track}-{n}-{n}. Srok hranenia 14 dney. Uznat dopolnitelnuyu informaciu mozhete na post.kz.",
+    "Sizge {track} salemdemesi keldi.Salemdeme kody {otp} Saqtau merzimi 14 kun. Qosymsha aqparatty post.kz - ten bile alasyz.Vam postupila posylka {track}",
+    "Sizge salemdeme keldi. Saqtau merzimi 14 kun. / Vam prishla posylka. Srok hranenia 14 dney. Tolygyraq/Detali: https://post.kz/t/{code}",
+    "{time} qolma-qol aqshany sheship alyndy/ otmena snyatiya nalichnykh: {n} {n}.{n} KZT. Karta:{n}**{n}. Qaldyq/ostatok: {n} {n}.{n} KZT",
+    "{time} telefon nomiri arqyly audarym kelip tusti/ postupil perevod po nomeru telefona: {n}.{n} KZT. K**{n}. Qaldyq/ostatok: {n}.{n} KZT",
+    "*{n} shotqa {n} KZT soma alyndy. Qaldygy {n} KZT/ Postuplenie na schet *{n} Summa {n} KZT. Ostatok {n} KZT",
+    "KODTY ESHKIMGE AITPANYZ/NIKOMU NE GOVORITE KOD.Audarym/Perevod: ({n} {n}.{n} KZT).Kod:{otp}",
+    "Ваш код подтверждения: {otp}. Никому не сообщайте. Трек /t/{code}",
+    "01.05.2025 {time} Zakaz №{n} oformlen, {code}",
+]
+
+# Алфавит для случайных строк — специально «ломает» границы между токенами
+FUZZ_PIECES = [
+    "https://", "http://", "a.kz/", "/t/", "12:34:56", "1", "23", "2025-05-01 ",
+    "01.05.25 ", "Salemdeme kody", "SALEMDEME KODY", "Saqtau merzimi", "saqtau MERZIMI",
+    "ABCDEFGHIJ", "abc123", "1234567890", " ", "  ", ".", ":", "_", "ж", "Ж", "٣",
+    "\n", "{", "}", "-", "x", "KZ", "€", " ",
+    "١٢:٣٤:٥٦", "٣٣", "１２:３４:５６", "०९", "٣٣:",
+]
+
+# Случаи, на которых однопроходная маскировка уже расходилась с эталоном
+# или легко может разойтись: цифры не ASCII, границы слов, ſ в IGNORECASE
+EDGE_CASES = [
+    "٣٣:٣٣:٣٣ ok",
+    "time ١٢:٣٤:٥٦",
+    "١٢:٣٤:٥٦https://a.kz/x",
+    "１２:３４:５６ и 12:34:56",
+    "Код ٤٥٦٧٨٩, сумма ١٢٣ KZT",
+    "०९:१५:३० देवनागरी",
+    "12:34:567 12:34:56_ a12:34:56",
+    "/t/12:34:56 /t/ABC123https://x",
+    "ſalemdeme kody 1 Saqtau merzimi",
+    "SALEMDEME KODY /t/AB12 https://t Saqtau merzimi",
+    "2025-05-01 ١٢:٣٤:٥٦ 01.05.25",
+    "ABCDEFGH١٢ ABCDEFGH12 abc١٢٣٤٥٦٧٨٩٠",
+]
+
+
+def reference_dynamic_mask(msg: str) -> str:
+    """Прежняя реализация dynamic_mask (цепочка re.sub) — эталон для сравнения."""
+    msg = re.sub(r'^(?:\d{2}[.-]\d{2}[.-]\d{2,4}|\d{4}-\d{2}-\d{2})\s*', '', msg)
+    msg = re.sub(r'https?://\S+', '{URL}', msg)
+    msg = re.sub(r'\b\d{2}:\d{2}:\d{2}\b', '{TIME}', msg)
+    msg = re.sub(r'/t/[A-Za-z0-9]{1,13}', '/t/{TRACK}', msg)
+    msg = re.sub(
+        r'(Salemdeme kody)(.*?)(Saqtau merzimi)',
+        r'\1 {CODE} \3',
+        msg,
+        flags=re.IGNORECASE
+    )
+
+    def _code(m):
+        w = m.group(0)
+        if re.search(r'[A-Za-z]', w) and re.search(r'\d', w):
+            return '{CODE}'
+        return w
+    msg = re.sub(r'\b[A-Za-z0-9]{10,}\b', _code, msg)
+    msg = re.sub(r'\b\d+\b', '{NUM}', msg)
+    return msg
+
+
+def make_corpus(n, rnd):
+    alnum = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+    out = []
+    for _ in range(n):
+        tpl = rnd.choice(SAMPLES)
+        out.append(tpl.format(
+            otp=f"{rnd.randrange(10**6):06d}",
+            n=rnd.randrange(10**rnd.randint(1, 7)),
+            track="".join(rnd.choices(alnum, k=rnd.randint(8, 16))),
+            code="".join(rnd.choices(alnum, k=rnd.randint(5, 18))),
+            time=f"{rnd.randrange(24):02d}:{rnd.randrange(60):02d}:{rnd.randrange(60):02d}",
+        ))
+    return out
+
+
+def make_fuzz(n, rnd):
+    return ["".join(rnd.choices(FUZZ_PIECES, k=rnd.randint(1, 12))) for _ in range(n)]
+
+
+def check_equivalence(messages):
+    """Сравнивает новую маскировку с эталонной, возвращает список расхождений."""
+    return [(m, reference_dynamic_mask(m), dynamic_mask(m))
+            for m in messages if reference_dynamic_mask(m) != dynamic_mask(m)]
+
+
+def measure(fn, messages):
+    start = time.perf_counter()
+    for m in messages:
+        fn(m)
+    return len(messages) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    rnd = random.Random(SEED)
+    corpus = make_corpus(N_MESSAGES, rnd)
+
+    checked = EDGE_CASES + corpus + make_fuzz(N_FUZZ, rnd)
+    diffs = check_equivalence(checked)
+    for msg, expected, got in diffs[:10]:
+        logging.error(f"Расхождение: {msg!r}\n  ожидалось: {expected!r}\n  получено:  {got!r}")
+    if diffs:
+        raise SystemExit(f"Найдено расхождений: {len(diffs)}")
+    logging.info(f"Эквивалентность подтверждена на {len(checked)} сообщениях")
+
+    before = measure(reference_dynamic_mask, corpus)
+    after = measure(dynamic_mask, corpus)
+    print(f"До:    {before:,.0f} сообщений/с")
+    print(f"После: {after:,.0f} сообщений/с (x{after / before:.2f})")
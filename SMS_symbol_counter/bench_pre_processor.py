@@ -0,0 +1,158 @@
+import random
+import time
+import logging
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timedelta
+
+from pre_processor import (DATE_COL, MSG_COL, PHONE_COL, TIME_WINDOW, ends_complete,
+                           extract_tokens, find_components, merge_component, stream_merge)
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+N_RECORDS = 20_000
+N_PHONES = 2_000
+ZIPF_S = 1.2     # перекос: несколько «коротких номеров» шлют большую часть трафика
+SPAN_HOURS = 24
+SEED = 7
+BURST_SIZES = [2_000, 4_000, 8_000, 16_000, 64_000]  # один короткий номер, всё в одном окне
+BURST_CHECK = 2_000  # до какого размера пачки сверяться с перебором всех пар
+
+FRAGMENTS = [
+    "Sizge {track} salemdemesi keldi.Salemdeme kody {otp}",
+    "Saqtau merzimi 14 kun. Qosymsha aqparatty post.kz - ten bile alasyz.",
+    "{track}.Kod posylki {track}. Srok hranenia 14 dney.",
+    "Tekseru kody/Kod proverki:{otp}.",
+    "Vam postupila posylka {track}",
+    "Karta *{otp} popolnena na 5 000 KZT",
+]
+
+
+def reference_build_graph(nodes):
+    """Прежний build_graph с перебором всех пар — эталон для сравнения."""
+    graph = defaultdict(list)
+    by_phone = defaultdict(list)
+    for i, n in enumerate(nodes):
+        by_phone[n["phone"]].append(i)
+    for phone, idxs in by_phone.items():
+        for i in idxs:
+            ti, mi, tok_i = nodes[i]["date"], nodes[i]["msg"], extract_tokens(nodes[i]["msg"])
+            for j in idxs:
+                if j <= i: continue
+                tj, mj = nodes[j]["date"], nodes[j]["msg"]
+                if abs((tj - ti).total_seconds()) > TIME_WINDOW:
+                    continue
+                tok_j = extract_tokens(mj)
+                if len(tok_i & tok_j) >= 2:
+                    graph[i].append(j)
+                    graph[j].append(i)
+                    continue
+                if not ends_complete(mi) or not ends_complete(mj):
+                    graph[i].append(j)
+                    graph[j].append(i)
+    return graph
+
+
+def reference_components(graph, n):
+    """Компоненты обходом графа в ширину, как в прежнем find_components."""
+    seen = [False] * n
+    comps = []
+    for i in range(n):
+        if seen[i]:
+            continue
+        q, comp = deque([i]), []
+        seen[i] = True
+        while q:
+            u = q.popleft()
+            comp.append(u)
+            for v in graph[u]:
+                if not seen[v]:
+                    seen[v] = True
+                    q.append(v)
+        comps.append(sorted(comp))
+    return comps
+
+
+def make_records(n, rnd):
+    weights = [1 / (k ** ZIPF_S) for k in range(1, N_PHONES + 1)]
+    phones = [f"7700{k:07d}" for k in range(N_PHONES)]
+    start = datetime(2025, 5, 1)
+    recs = []
+    for _ in range(n):
+        phone = rnd.choices(phones, weights)[0]
+        date = start + timedelta(seconds=rnd.uniform(0, SPAN_HOURS * 3600))
+        msg = rnd.choice(FRAGMENTS).format(
+            track=f"CN{rnd.randrange(10**9):09d}KZ",
+            otp=f"{rnd.randrange(10**6):06d}",
+        )
+        recs.append({"phone": phone, "date": date, "msg": msg, "row": {}})
+    return recs
+
+
+def make_burst(n, rnd, fragments=False):
+    """
+    Один отправитель шлёт n сообщений за TIME_WINDOW секунд — все в одном окне.
+    fragments=False — только завершённые сообщения без общих токенов (склеивать
+    нечего), иначе — вперемешку с незавершёнными фрагментами.
+    """
+    start = datetime(2025, 5, 1)
+    recs = []
+    for k in range(n):
+        date = start + timedelta(seconds=rnd.uniform(0, TIME_WINDOW))
+        if fragments and rnd.random() < 0.05:
+            msg = rnd.choice(FRAGMENTS).format(track=f"CN{rnd.randrange(10**9):09d}KZ",
+                                               otp=f"{rnd.randrange(10**6):06d}")
+        else:
+            msg = f"Vash kod {k}."
+        recs.append({"phone": "1414", "date": date, "msg": msg, "row": {}})
+    recs.sort(key=lambda r: r["date"])
+    return recs
+
+
+def measure(fn, recs):
+    start = time.perf_counter()
+    result = fn(recs)
+    return result, time.perf_counter() - start
+
+
+def reference(recs):
+    return reference_components(reference_build_graph(recs), len(recs))
+
+
+def streamed(recs):
+    """Склеенные сообщения потокового режима — должны совпасть со склейкой компонент."""
+    rows = ({PHONE_COL: r["phone"], DATE_COL: r["date"].isoformat(), MSG_COL: r["msg"]} for r in recs)
+    return sorted(out[MSG_COL] for out in stream_merge(rows))
+
+
+def check(name, recs, with_reference=True):
+    comps, after = measure(find_components, recs)
+    if with_reference:
+        expected, before = measure(reference, recs)
+        if sorted(expected) != sorted(comps):
+            raise SystemExit(f"{name}: компоненты не совпадают с эталоном")
+    merged, stream_time = measure(streamed, recs)
+    if merged != sorted(merge_component(recs, comp)[MSG_COL] for comp in comps):
+        raise SystemExit(f"{name}: stream_merge склеил не так, как find_components")
+    line = f"{name}: {len(recs)} записей, компонент {len(comps)}; find_components {after:.2f} с, stream_merge {stream_time:.2f} с"
+    if with_reference:
+        line += f", перебор пар {before:.2f} с (x{before / after:.1f})"
+    print(line)
+
+
+if __name__ == "__main__":
+    rnd = random.Random(SEED)
+    recs = make_records(N_RECORDS, rnd)
+    recs.sort(key=lambda r: r["date"])
+    top = Counter(r["phone"] for r in recs).most_common(1)[0][1]
+    logging.info(f"{N_RECORDS} записей, {N_PHONES} телефонов, у самого активного {top}")
+    check("Zipf по телефонам", recs)
+
+    # Один короткий номер, всё в одном окне: время должно расти почти линейно
+    for n in BURST_SIZES:
+        check("Пачка без склеек", make_burst(n, rnd), n <= BURST_CHECK)
+    for n in BURST_SIZES:
+        check("Пачка с фрагментами", make_burst(n, rnd, fragments=True), n <= BURST_CHECK)
+    logging.info("Компоненты совпадают с эталоном и с потоковым режимом")
@@ -0,0 +1,408 @@
+import argparse
+import bisect
+import csv
+import heapq
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+# --- Параметры синтетического трафика ---
+SEED = 2025
+SPAN_DAYS = 30                # период, на который растягиваются сообщения
+START = datetime(2025, 5, 1)
+PHONES_PER_ROWS = 20          # один получатель на столько строк
+PHONE_ZIPF_S = 1.1            # перекос по получателям
+FRAGMENTED_SHARE = 0.5        # доля длинных сообщений, пришедших отдельными частями
+SWAPPED_SHARE = 0.1           # доля составных, у которых части пришли не по порядку
+PART_GAP = (0.3, 6.0)         # задержка между частями, сек (внутри TIME_WINDOW)
+GRAPH_MAX_ROWS = 200_000      # find_components держит все записи в памяти — ограничиваем выборку
+
+HISTORY_FILE = "bench_history.json"
+DATA_DIR = os.path.join(tempfile.gettempdir(), "sms_bench")
+REGRESSION_PCT = 20           # падение rows/s сильнее этого — регрессия
+
+# (отправитель, тип трафика, вес отправителя, шаблоны)
+SENDERS = [
+    ("Kaspi", "OTP", 40, [
+        "Sizdin belsendiru kody / Vash kod aktivatsii:{otp}",
+        "Tekseru kody/Kod proverki:{otp}",
+        "KODTY ESHKIMGE AITPANYZ/NIKOMU NE GOVORITE KOD.Audarym/Perevod: ({amount} KZT).Kod:{otp}",
+    ]),
+    ("post.kz", "SERVICE", 25, [
+        "{track}.Kod posylki {code}. Srok hranenia 14 dney. Uznat dopolnitelnuyu informaciu mozhete na post.kz.",
+        "Sizge salemdeme keldi. Saqtau merzimi 14 kun. / Vam prishla posylka. Srok hranenia 14 dney. Tolygyraq/Detali: https://post.kz/t/{short}",
+        "Sizge {track} salemdemesi keldi.Salemdeme kody {otp} Saqtau merzimi 14 kun. Qosymsha aqparatty post.kz - ten bile alasyz.Vam postupila posylka {track}",
+    ]),
+    ("Halyk", "TRANSACTIONAL", 15, [
+        "{time} qolma-qol aqshany sheship alyndy/ otmena snyatiya nalichnykh: {amount} KZT. Karta:{n4}**{n4}. Qaldyq/ostatok: {amount} KZT",
+        "{time} telefon nomiri arqyly audarym kelip tusti/ postupil perevod po nomeru telefona: {amount} KZT. K**{n4}. Qaldyq/ostatok: {amount} KZT",
+        "*{n4} shotqa {amount} KZT soma alyndy. Qaldygy {amount} KZT/ Postuplenie na schet *{n4} Summa {amount} KZT. Ostatok {amount} KZT",
+    ]),
+    ("eGov", "OTP", 8, [
+        "Ваш код подтверждения: {otp}. Никому не сообщайте этот код.",
+        "Растау коды: {otp}. Кодты ешкімге айтпаңыз.",
+    ]),
+    ("Magnum", "PROMO", 5, [
+        "Скидка {pct}% на всё до {day}.05! Подробнее: https://magnum.kz/{short}",
+        "Jenildik {pct}% barlyq tauarlarga {day}.05 deiin! Tolygyraq: https://magnum.kz/{short}",
+    ]),
+    ("Beeline", "SERVICE", 7, [
+        "Balansynyz {amount} tg. Tolyqtyru: *{n4}# / Vash balans {amount} tg.",
+        "Остаток интернета {n2} ГБ. Продлить пакет: *{n4}#",
+    ]),
+]
+
+_ALNUM = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+_UPPER = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+# ----------------------------------------------------------------------------
+# Генератор трафика
+def _fill(template, rnd):
+    def amount():
+        units = rnd.randrange(10 ** rnd.randint(2, 7))
+        return f"{units:,}".replace(",", " ") + f".{rnd.randrange(100):02d}"
+    return template.format(
+        otp=f"{rnd.randrange(10**6):06d}",
+        amount=amount(),
+        track=f"{rnd.choice(_UPPER)}{rnd.choice(_UPPER)}{rnd.randrange(10**9):09d}KZ",
+        code="".join(rnd.choices(_ALNUM, k=rnd.randint(8, 14))),
+        short="".join(rnd.choices(_ALNUM, k=rnd.randint(5, 10))),
+        time=f"{rnd.randrange(24):02d}:{rnd.randrange(60):02d}:{rnd.randrange(60):02d}",
+        n4=rnd.randrange(1000, 10000),
+        n2=rnd.randrange(1, 100),
+        pct=rnd.choice((5, 10, 15, 20, 30, 50)),
+        day=rnd.randrange(1, 32),
+    )
+
+
+def sample_messages(n, seed=SEED):
+    """n случайных сообщений по шаблонам SENDERS — для нагрузочных проверок без файла."""
+    rnd = random.Random(seed)
+    sender_cum = _cumulative(w for _, _, w, _ in SENDERS)
+    out = []
+    for _ in range(n):
+        templates = SENDERS[bisect.bisect_left(sender_cum, rnd.random() * sender_cum[-1])][3]
+        out.append(_fill(rnd.choice(templates), rnd))
+    return out
+
+
+def _split_parts(text):
+    """Части составного SMS: 153 символа для латиницы, 67 — если есть кириллица."""
+    size = 153 if text.isascii() else 67
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _cumulative(weights):
+    total, out = 0.0, []
+    for w in weights:
+        total += w
+        out.append(total)
+    return out
+
+
+def generate_traffic(path, rows, seed=SEED):
+    """
+    Пишет CSV (phone, send_date, message, traffic_type, sender) из rows строк,
+    отсортированный по send_date. Получатели распределены по Zipf, длинные
+    сообщения частью приходят отдельными фрагментами с задержкой в секунды.
+    Память не зависит от rows: строки будущих фрагментов ждут в небольшой куче.
+    """
+    rnd = random.Random(seed)
+    n_phones = max(1000, rows // PHONES_PER_ROWS)
+    phone_cum = _cumulative(1 / (k ** PHONE_ZIPF_S) for k in range(1, n_phones + 1))
+    sender_cum = _cumulative(w for _, _, w, _ in SENDERS)
+    step = SPAN_DAYS * 86400 / rows  # средний интервал между сообщениями
+
+    pending, written, seq, t = [], 0, 0, 0.0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f, delimiter='\t', quoting=csv.QUOTE_NONE, escapechar='\\')
+        w.writerow(["phone", "send_date", "message", "traffic_type", "sender"])
+
+        def emit(until):
+            nonlocal written
+            while pending and pending[0][0] <= until and written < rows:
+                at, _, row = heapq.heappop(pending)
+                w.writerow([row[0], (START + timedelta(seconds=at)).isoformat(sep=" ", timespec="seconds"), *row[1:]])
+                written += 1
+
+        while written + len(pending) < rows:
+            t += rnd.expovariate(1 / step)
+            emit(t)
+            phone = f"77{bisect.bisect_left(phone_cum, rnd.random() * phone_cum[-1]):09d}"
+            sender, traffic, _, templates = SENDERS[bisect.bisect_left(sender_cum, rnd.random() * sender_cum[-1])]
+            text = _fill(rnd.choice(templates), rnd)
+
+            parts = _split_parts(text)
+            if len(parts) == 1 or rnd.random() >= FRAGMENTED_SHARE:
+                parts = [text]
+            elif rnd.random() < SWAPPED_SHARE:
+                parts[0], parts[1] = parts[1], parts[0]
+            at = t
+            for part in parts:
+                heapq.heappush(pending, (at, seq, (phone, part, traffic, sender)))
+                seq += 1
+                at += rnd.uniform(*PART_GAP)
+        emit(float("inf"))
+    return written
+
+
+def traffic_file(rows, seed, data_dir=DATA_DIR):
+    """Путь к сгенерированному файлу; файл создаётся один раз и переиспользуется."""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"traffic_{rows}_{seed}.csv")
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        generate_traffic(path + ".tmp", rows, seed)
+        os.replace(path + ".tmp", path)
+        logging.info(f"Сгенерирован {path} за {time.perf_counter() - start:.1f} с")
+    return path
+
+
+# ----------------------------------------------------------------------------
+# Стадии. Каждая возвращает (строк на входе, мощность результата, секунд);
+# подготовка (чтение нужных данных) в измеренное время не входит, если
+# стадия не про чтение.
+def _messages(path):
+    with open(path, encoding="utf-8") as f:
+        for row in csv.DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+            yield row["message"]
+
+
+def stage_read(path):
+    start = time.perf_counter()
+    n = sum(1 for _ in _messages(path))
+    return n, n, time.perf_counter() - start
+
+
+def stage_count(path):
+    from counter import count_rows_fast
+    start = time.perf_counter()
+    n = count_rows_fast(path)
+    return n, n, time.perf_counter() - start
+
+
+def stage_mask(path):
+    """dynamic_mask по всем сообщениям (вместе с чтением — сравнивайте со стадией read)."""
+    from pattern_utils import dynamic_mask
+    start = time.perf_counter()
+    n, patterns = 0, set()
+    for msg in _messages(path):
+        patterns.add(dynamic_mask(msg))
+        n += 1
+    return n, len(patterns), time.perf_counter() - start
+
+
+def stage_super_generalize(path):
+    """super_generalize по уникальным маскированным паттернам."""
+    from pattern_utils import dynamic_mask, super_generalize
+    patterns = {dynamic_mask(msg) for msg in _messages(path)}
+    start = time.perf_counter()
+    out = {super_generalize(p) for p in patterns}
+    return len(patterns), len(out), time.perf_counter() - start
+
+
+def stage_segments(path):
+    """compute_segments по всем сообщениям; мощность — сумма сегментов."""
+    from pattern_utils import compute_segments
+    messages = list(_messages(path))
+    start = time.perf_counter()
+    total = sum(compute_segments(m)[1] for m in messages)
+    return len(messages), total, time.perf_counter() - start
+
+
+def stage_build_graph(path):
+    """Связи и компоненты (find_components) на первых GRAPH_MAX_ROWS записях; имя стадии — прежнее, ради истории."""
+    import pre_processor
+    pre_processor.DATE_COL = "send_date"
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for row in csv.DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+            records.append(pre_processor.make_record(row))
+            if len(records) >= GRAPH_MAX_ROWS:
+                break
+    start = time.perf_counter()
+    comps = pre_processor.find_components(records)
+    return len(records), len(comps), time.perf_counter() - start
+
+
+def stage_stream_merge(path):
+    """Потоковая склейка pre_processor.stream_merge по всему файлу."""
+    import pre_processor
+    pre_processor.DATE_COL = "send_date"
+    start = time.perf_counter()
+    with open(path, encoding="utf-8") as f:
+        reader = csv.DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE)
+        out = sum(1 for _ in pre_processor.stream_merge(reader))
+    return reader.line_num - 1, out, time.perf_counter() - start
+
+
+def stage_generalise(path):
+    import generaliser
+    start = time.perf_counter()
+    stats = generaliser.collect_serial(path)
+    return sum(d.count for d in stats.values()), len(stats), time.perf_counter() - start
+
+
+def stage_aggregate(path):
+    import aggregator
+    import generaliser
+    rows = list(generaliser.report_rows(generaliser.collect_serial(path)))
+    start = time.perf_counter()
+    agg = aggregator.aggregate_rows(rows)
+    aggregator.top_entries(agg)
+    return len(rows), len(agg), time.perf_counter() - start
+
+
+def stage_cluster(path):
+    """MinHash/LSH-склейка агрегированных паттернов (порог 0.8)."""
+    import aggregator
+    import generaliser
+    agg = aggregator.aggregate_rows(generaliser.report_rows(generaliser.collect_serial(path)))
+    start = time.perf_counter()
+    merged, _ = aggregator.cluster_aggregated(agg, 0.8)
+    return len(agg), len(merged), time.perf_counter() - start
+
+
+def stage_top(path):
+    import top_msgs_counter
+    start = time.perf_counter()
+    grouped = top_msgs_counter.count_messages(path)
+    return sum(grouped.values()), len(grouped), time.perf_counter() - start
+
+
+STAGES = {
+    "read": stage_read,
+    "count": stage_count,
+    "mask": stage_mask,
+    "super_generalize": stage_super_generalize,
+    "segments": stage_segments,
+    "build_graph": stage_build_graph,
+    "stream_merge": stage_stream_merge,
+    "generalise": stage_generalise,
+    "aggregate": stage_aggregate,
+    "cluster": stage_cluster,
+    "top": stage_top,
+}
+
+
+def _run_stage(name, path):
+    rows, cardinality, seconds = STAGES[name](path)
+    # ru_maxrss в Linux — в килобайтах
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows_per_s": round(rows / seconds, 1) if seconds else None,
+        "peak_rss_mb": round(peak_mb, 1),
+        "cardinality": cardinality,
+    }
+
+
+def run_stage(name, path):
+    """Стадия в отдельном (spawn) процессе — чтобы пик RSS был только её."""
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(_run_stage, (name, path))
+
+
+# ----------------------------------------------------------------------------
+# История и поиск регрессий
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def find_regressions(history, run, threshold=REGRESSION_PCT):
+    """Стадии, где rows/s упал больше чем на threshold % к прошлому запуску с теми же rows и seed."""
+    previous = next((h for h in reversed(history)
+                     if h["rows"] == run["rows"] and h["seed"] == run["seed"]), None)
+    if previous is None:
+        return []
+    found = []
+    for name, cur in run["stages"].items():
+        old = previous["stages"].get(name)
+        if not old or not old.get("rows_per_s") or not cur.get("rows_per_s"):
+            continue
+        change = 100 * (cur["rows_per_s"] / old["rows_per_s"] - 1)
+        if change < -threshold:
+            found.append((name, old["rows_per_s"], cur["rows_per_s"], change))
+    return found
+
+
+def parse_rows(value: str) -> int:
+    """10k, 1M, 50M → число строк."""
+    value = value.strip().lower().replace("_", "")
+    mult = {"k": 1_000, "m": 1_000_000}.get(value[-1:], 1)
+    return int(float(value.rstrip("km")) * mult)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер скорости стадий на синтетическом трафике")
+    parser.add_argument("--rows", nargs="+", default=["10k", "100k"], help="размеры: 10k 1M 50M …")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--data-dir", default=DATA_DIR, help="где хранить сгенерированные файлы")
+    parser.add_argument("--history", default=HISTORY_FILE, help="JSON-файл истории замеров")
+    parser.add_argument("--label", help="подпись запуска в истории")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help=f"код возврата 1, если rows/s упал больше чем на {REGRESSION_PCT}%%")
+    args = parser.parse_args()
+
+    history = load_history(args.history)
+    regressions = []
+    for rows in map(parse_rows, args.rows):
+        path = traffic_file(rows, args.seed, args.data_dir)
+        run = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "label": args.label,
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "rows": rows,
+            "seed": args.seed,
+            "stages": {},
+        }
+        print(f"\n=== {rows:,} строк ===")
+        print(f"{'стадия':<18}{'сек':>10}{'строк/с':>14}{'пик RSS, МБ':>14}{'мощность':>12}")
+        for name in args.stages:
+            res = run_stage(name, path)
+            run["stages"][name] = res
+            print(f"{name:<18}{res['seconds']:>10.3f}{res['rows_per_s'] or 0:>14,.0f}"
+                  f"{res['peak_rss_mb']:>14.1f}{res['cardinality']:>12,}")
+        for name, old, new, change in find_regressions(history, run):
+            logging.warning(f"Регрессия {name} на {rows:,} строк: {old:,.0f} → {new:,.0f} строк/с ({change:+.0f}%)")
+            regressions.append(name)
+        history.append(run)
+
+    with open(args.history, "w", encoding="utf-8") as f:
+        json.dump(history, f, ensure_ascii=False, indent=1)
+    logging.info(f"Замеры добавлены в {args.history}")
+    if regressions and args.fail_on_regression:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import random
+import zlib
+from collections import defaultdict
+
+try:
+    import numpy as np
+except ImportError:  # подписи считаются в чистом Python — медленнее, результат тот же
+    np = None
+
+# --- Поиск почти одинаковых шаблонов: MinHash + LSH ---
+# Каждый шаблон превращается в множество символьных k-грамм (шинглов),
+# множество — в MinHash-подпись из NUM_PERM чисел. Подпись режется на полосы;
+# шаблоны, у которых совпала хотя бы одна полоса, становятся кандидатами.
+# Так пары сравниваются только внутри корзин LSH, а не все со всеми.
+SHINGLE_SIZE = 5    # длина шингла в символах
+NUM_PERM = 64       # длина MinHash-подписи
+MINHASH_SEED = 1    # зерно хэш-функций: одинаковые подписи от запуска к запуску
+LSH_MARGIN = 0.1    # насколько ниже порога ставить «середину» S-кривой LSH, чтобы не терять пары
+
+# Хэш-функции вида (a*x + b) mod P над 32-битными хэшами шинглов; P — простое больше 2**32,
+# a*x + b < 2**64, поэтому numpy (uint64) и Python считают одинаково
+_PRIME = 4294967311
+_MAX32 = (1 << 32) - 1
+
+
+def shingles(text: str, k: int = SHINGLE_SIZE) -> set:
+    """32-битные хэши символьных k-грамм текста (пробелы схлопнуты)."""
+    text = " ".join(text.split())
+    data = text.encode("utf-8")
+    if len(text) <= k:
+        return {zlib.crc32(data)}
+    return {zlib.crc32(text[i:i + k].encode("utf-8")) for i in range(len(text) - k + 1)}
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def lsh_params(threshold: float, num_perm: int = NUM_PERM, margin: float = LSH_MARGIN):
+    """
+    (полос, строк в полосе): пара с похожестью s становится кандидатом с
+    вероятностью 1 - (1 - s**r)**b; «середина» (1/b)**(1/r) ставится чуть
+    ниже порога — лишние кандидаты потом отсеиваются, а пропущенные не вернуть.
+    """
+    best = (1, num_perm)
+    best_mid = 0.0
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        mid = (1 / bands) ** (1 / rows)
+        if mid <= threshold - margin and mid > best_mid:
+            best, best_mid = (bands, rows), mid
+    return best
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = MINHASH_SEED):
+        rnd = random.Random(seed)
+        self.num_perm = num_perm
+        self.a = [rnd.randrange(1, _MAX32) for _ in range(num_perm)]
+        self.b = [rnd.randrange(0, _MAX32) for _ in range(num_perm)]
+        if np is not None:
+            self._a = np.array(self.a, dtype=np.uint64)[:, None]
+            self._b = np.array(self.b, dtype=np.uint64)[:, None]
+
+    def signature(self, hashes) -> tuple:
+        if np is not None:
+            x = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+            return tuple(((self._a * x + self._b) % _PRIME).min(axis=1).tolist())
+        return tuple(min((a * x + b) % _PRIME for x in hashes) for a, b in zip(self.a, self.b))
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def find_clusters(texts, groups=None, threshold: float = 0.8, num_perm: int = NUM_PERM):
+    """
+    Кластеры почти одинаковых текстов: списки индексов (от двух элементов),
+    внутри кластера — по возрастанию индекса. Тексты из разных групп (groups[i],
+    например тип трафика) в один кластер не попадают.
+
+    Кандидаты из одной корзины LSH сравниваются с первым текстом корзины
+    (а не попарно), похожесть оценивается по совпадающим позициям подписей;
+    пары не ниже threshold склеиваются транзитивно.
+    """
+    n = len(texts)
+    groups = groups if groups is not None else [None] * n
+    hasher = MinHasher(num_perm)
+    signatures = [hasher.signature(shingles(t)) for t in texts]
+    bands, rows = lsh_params(threshold, num_perm)
+
+    parent = list(range(n))
+    for band in range(bands):
+        lo = band * rows
+        buckets = {}
+        for i, sig in enumerate(signatures):
+            key = (groups[i], sig[lo:lo + rows])
+            anchor = buckets.setdefault(key, i)
+            if anchor == i:
+                continue
+            ra, ri = _find(parent, anchor), _find(parent, i)
+            if ra == ri:
+                continue
+            same = sum(x == y for x, y in zip(signatures[anchor], sig))
+            if same >= threshold * num_perm:
+                parent[max(ra, ri)] = min(ra, ri)
+
+    clusters = defaultdict(list)
+    for i in range(n):
+        clusters[_find(parent, i)].append(i)
+    return [members for members in clusters.values() if len(members) > 1]
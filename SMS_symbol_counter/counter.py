@@ -1,13 +1,75 @@
+import argparse
 import csv
+from collections import Counter
+
+from io_utils import open_binary, open_text
 
 csv.field_size_limit(10**7)
 
 FILENAME = "merged_contextual.csv"
 SEP = '\t'  # Или ',' если CSV с запятыми
+TYPE_COL = "traffic_type"
+BLOCK_SIZE = 16 * 1024 * 1024  # байт за одно чтение при быстром подсчёте
+
+
+def count_rows(path, sep=SEP):
+    """Количество строк данных в файле (без заголовка) через csv.reader — учитывает кавычки."""
+    with open_text(path) as f:
+        reader = csv.reader(f, delimiter=sep)
+        next(reader)  # Пропустить заголовок
+        return sum(1 for _ in reader)
+
+
+def count_rows_fast(path):
+    """
+    Количество строк данных (без заголовка) подсчётом символов перевода
+    строки в больших блоках байт, без разбора полей. Подходит для файлов
+    без кавычек (QUOTE_NONE), где одна запись — одна строка. Сжатый файл
+    считается по распакованным блокам.
+    """
+    buf = bytearray(BLOCK_SIZE)
+    lines, last = 0, b"\n"
+    with open_binary(path, buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            lines += buf.count(b"\n", 0, n)
+            last = buf[n - 1:n]
+    if last != b"\n":  # последняя строка без перевода строки
+        lines += 1
+    return max(lines - 1, 0)
+
+
+def count_by_type(path, sep=SEP, type_col=TYPE_COL):
+    """
+    Количество строк по типу трафика. Строки читаются как байты, и из
+    каждой вырезается только нужная колонка.
+    """
+    sep_b = sep.encode("utf-8")
+    counts = Counter()
+    with open_binary(path) as f:
+        header = f.readline().rstrip(b"\r\n").decode("utf-8").split(sep)
+        try:
+            idx = header.index(type_col)
+        except ValueError:
+            raise Exception(f"Файл должен содержать колонку '{type_col}'")
+        for line in f:
+            parts = line.split(sep_b, idx + 1)
+            value = parts[idx] if len(parts) > idx else b""
+            counts[value.rstrip(b"\r\n")] += 1
+    return {k.decode("utf-8", errors="replace"): v for k, v in counts.items()}
+
 
-with open(FILENAME, encoding="utf-8") as f:
-    reader = csv.reader(f, delimiter=SEP)
-    next(reader)  # Пропустить заголовок
-    count = sum(1 for _ in reader)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Подсчёт строк в файле данных")
+    parser.add_argument("--quoted", action="store_true",
+                        help="в файле есть поля в кавычках с переводами строк — считать через csv")
+    parser.add_argument("--by-type", action="store_true", help=f"разбивка по колонке {TYPE_COL}")
+    args = parser.parse_args()
 
-print(f"📦 Всего сообщений: {count}")
+    count = count_rows(FILENAME) if args.quoted else count_rows_fast(FILENAME)
+    print(f"📦 Всего сообщений: {count}")
+    if args.by_type:
+        for traffic, n in sorted(count_by_type(FILENAME).items(), key=lambda kv: -kv[1]):
+            print(f"  {traffic or 'Нет типа'}: {n}")
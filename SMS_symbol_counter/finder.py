@@ -1,4 +1,11 @@
-import csv
+import argparse
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from io_utils import CHUNK_BYTES, chunk_bounds, is_splittable, open_rows, read_chunk_rows, read_header
+from msg_index import open_index
+from pattern_utils import literal_prefix
 
 # Configurable parameters
 INPUT_FILE = "csv/in/2025-05-01_2025-05-31(1).csv"
@@ -6,36 +13,249 @@ MESSAGE_COLUMN = "message"
 PATTERNS = [
     "",  # Add suspicious substrings here
 ]
+PATTERNS_FILE = None  # Optional file with one pattern per line; "re:" prefix marks a regex
 
 SEP = '\t'
 SAMPLE_LIMIT = 10  # Number of sample messages to display per pattern
+IGNORE_CASE = False
+REGEX_PREFIX = "re:"
+USE_INDEX = False  # Answer queries from a trigram index stored next to the input file
+
+
+class AhoCorasick:
+    """
+    Aho–Corasick automaton over a list of words.
+    search() scans the text once and returns the indices of all words it contains.
+    """
+
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        for idx, word in enumerate(words):
+            state = 0
+            for ch in word:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                state = nxt
+            self.out[state] += (idx,)
+
+        # Breadth-first: failure links, inherited outputs and a complete
+        # transition table (only non-root targets are stored), so search()
+        # makes exactly one dict lookup per character
+        self.delta = [dict(self.goto[0])] + [None] * (len(self.goto) - 1)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] += self.out[self.fail[nxt]]
+            delta = dict(self.delta[self.fail[state]])
+            delta.update(self.goto[state])
+            self.delta[state] = delta
+
+    def search(self, text):
+        delta, out = self.delta, self.out
+        found = set()
+        state = 0
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+class PatternMatcher:
+    """
+    Single compiled matcher for all patterns: literal substrings go into one
+    Aho–Corasick automaton; a regex is only run when the automaton has seen
+    its literal prefix (regexes without one are run on every message).
+    """
+
+    def __init__(self, patterns, ignore_case=IGNORE_CASE):
+        self.patterns = list(patterns)
+        self.ignore_case = ignore_case
+        fold = str.casefold if ignore_case else (lambda s: s)
+        flags = re.IGNORECASE if ignore_case else 0
+
+        words, owners = [], []   # automaton word → pattern index
+        self.always = []         # empty literals: match every message
+        self.regexes = {}        # pattern index → compiled regex
+        self.untriggered = []    # regexes without a literal prefix
+        for idx, pat in enumerate(self.patterns):
+            if pat.startswith(REGEX_PREFIX):
+                rx = pat[len(REGEX_PREFIX):]
+                self.regexes[idx] = re.compile(rx, flags)
+                trigger = literal_prefix(rx)
+                if trigger:
+                    words.append(fold(trigger))
+                    owners.append(idx)
+                else:
+                    self.untriggered.append(idx)
+            elif pat:
+                words.append(fold(pat))
+                owners.append(idx)
+            else:
+                self.always.append(idx)
+        self.owners = owners
+        self.automaton = AhoCorasick(words)
+
+    def matches(self, msg):
+        """Sorted indices of the patterns found in msg."""
+        text = msg.casefold() if self.ignore_case else msg
+        found = set(self.always)
+        for word in self.automaton.search(text):
+            idx = self.owners[word]
+            if idx not in self.regexes or self.regexes[idx].search(msg):
+                found.add(idx)
+        for idx in self.untriggered:
+            if self.regexes[idx].search(msg):
+                found.add(idx)
+        return sorted(found)
+
+
+def load_patterns(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.rstrip("\r\n") for line in f if line.strip()]
+
+
+def scan_rows(rows, matcher):
+    """Per-pattern counts and the first SAMPLE_LIMIT samples, in row order."""
+    return scan_messages((row.get(MESSAGE_COLUMN, "") for row in rows), matcher)
+
+
+def scan_messages(messages, matcher):
+    counts = [0] * len(matcher.patterns)
+    samples = [[] for _ in matcher.patterns]
+    for msg in messages:
+        for idx in matcher.matches(msg):
+            counts[idx] += 1
+            if len(samples[idx]) < SAMPLE_LIMIT:
+                samples[idx].append(msg)
+    return counts, samples
+
+
+# Workers started with spawn/forkserver re-import this module and would see the
+# defaults instead of values set by sms_counter.apply_config, so pass them explicitly
+WORKER_SETTINGS = ("SEP", "MESSAGE_COLUMN", "SAMPLE_LIMIT")
+
+
+def _init_worker(settings):
+    globals().update(settings)
+
+
+def _scan_chunk(args):
+    path, start, end, fieldnames, patterns, ignore_case = args
+    rows = read_chunk_rows(path, start, end, fieldnames, SEP)
+    return scan_rows(rows, PatternMatcher(patterns, ignore_case))
+
+
+def scan_parallel(input_file, patterns, ignore_case, workers, chunk_bytes=CHUNK_BYTES):
+    fieldnames, offset = read_header(input_file, SEP)
+    tasks = [(input_file, start, end, fieldnames, patterns, ignore_case)
+             for start, end in chunk_bounds(input_file, offset, chunk_bytes)]
+    counts = [0] * len(patterns)
+    samples = [[] for _ in patterns]
+    settings = {name: globals()[name] for name in WORKER_SETTINGS}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(settings,)) as pool:
+        # chunks come back in file order, so samples match the serial scan
+        for part_counts, part_samples in pool.map(_scan_chunk, tasks):
+            for idx in range(len(patterns)):
+                counts[idx] += part_counts[idx]
+                samples[idx].extend(part_samples[idx][:SAMPLE_LIMIT - len(samples[idx])])
+    return counts, samples
+
+
+def pattern_check(pat, ignore_case):
+    """Predicate for a single pattern; used to verify index candidates."""
+    if pat.startswith(REGEX_PREFIX):
+        return re.compile(pat[len(REGEX_PREFIX):], re.IGNORECASE if ignore_case else 0).search
+    if ignore_case:
+        folded = pat.casefold()
+        return lambda msg: folded in msg.casefold()
+    return lambda msg: pat in msg
+
+
+def scan_indexed(index, patterns, ignore_case):
+    """
+    Same result as scan_rows, but only the rows the index returns for a
+    pattern's literal (or regex prefix) are read and checked. Patterns the
+    index cannot narrow (shorter than three characters) share one full pass.
+    """
+    counts = [0] * len(patterns)
+    samples = [[] for _ in patterns]
+    unindexed = []
+    for idx, pat in enumerate(patterns):
+        literal = literal_prefix(pat[len(REGEX_PREFIX):]) if pat.startswith(REGEX_PREFIX) else pat
+        rows = index.candidates(literal)
+        if rows is None:
+            unindexed.append(idx)
+            continue
+        check = pattern_check(pat, ignore_case)
+        for msg in map(index.message, rows):
+            if check(msg):
+                counts[idx] += 1
+                if len(samples[idx]) < SAMPLE_LIMIT:
+                    samples[idx].append(msg)
+
+    if unindexed:
+        matcher = PatternMatcher([patterns[i] for i in unindexed], ignore_case)
+        part_counts, part_samples = scan_messages(map(index.message, range(len(index))), matcher)
+        for j, idx in enumerate(unindexed):
+            counts[idx], samples[idx] = part_counts[j], part_samples[j]
+    return counts, samples
+
+
+def find_exact_patterns(input_file=None, patterns=None, ignore_case=None, workers=1, use_index=None):
+    input_file = input_file or INPUT_FILE
+    if patterns is None:
+        patterns = load_patterns(PATTERNS_FILE) if PATTERNS_FILE else PATTERNS
+    ignore_case = IGNORE_CASE if ignore_case is None else ignore_case
+    use_index = USE_INDEX if use_index is None else use_index
 
-def find_exact_patterns():
-    # Initialize counts and samples
-    counts = {pat: 0 for pat in PATTERNS}
-    samples = {pat: [] for pat in PATTERNS}
-
-    # Read CSV and search
-    with open(INPUT_FILE, encoding="utf-8") as f:
-        reader = csv.DictReader(f, delimiter=SEP, quoting=csv.QUOTE_NONE)
-        for row in reader:
-            msg = row.get(MESSAGE_COLUMN, "")
-            for pat in PATTERNS:
-                # Strict substring search
-                if pat in msg:
-                    counts[pat] += 1
-                    if len(samples[pat]) < SAMPLE_LIMIT:
-                        samples[pat].append(msg)
+    # Read CSV and search; compressed input can't be indexed or split into byte ranges
+    splittable = is_splittable(input_file)
+    if use_index and splittable:
+        # Built on first use and rebuilt whenever the input's size or mtime changes
+        with open_index(input_file, SEP, MESSAGE_COLUMN) as index:
+            counts, samples = scan_indexed(index, patterns, ignore_case)
+    elif workers > 1 and splittable:
+        counts, samples = scan_parallel(input_file, patterns, ignore_case, workers)
+    else:
+        matcher = PatternMatcher(patterns, ignore_case)
+        with open_rows(input_file, SEP) as reader:
+            counts, samples = scan_rows(reader, matcher)
 
     # Output results
-    for pat in PATTERNS:
+    for idx, pat in enumerate(patterns):
         print(f"Pattern: '{pat}'")
-        print(f"Exact matches found: {counts[pat]}")
-        if samples[pat]:
+        print(f"Exact matches found: {counts[idx]}")
+        if samples[idx]:
             print("Sample messages:")
-            for s in samples[pat]:
+            for s in samples[idx]:
                 print(" -", s)
         print("-" * 60)
 
 if __name__ == "__main__":
-    find_exact_patterns()
+    parser = argparse.ArgumentParser(description="Find messages containing given substrings")
+    parser.add_argument("--patterns-file", help="one pattern per line, 're:' prefix for regex")
+    parser.add_argument("--ignore-case", action="store_true")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--index", action="store_true",
+                        help="use (and build if missing or stale) the trigram index of the input file")
+    args = parser.parse_args()
+    find_exact_patterns(
+        patterns=load_patterns(args.patterns_file) if args.patterns_file else None,
+        ignore_case=args.ignore_case or None,
+        workers=args.workers,
+        use_index=args.index or None,
+    )
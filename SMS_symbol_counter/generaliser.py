@@ -1,62 +1,513 @@
+import argparse
+import bisect
 import csv
+import hashlib
+import os
+import sys
+import zlib
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import profiling
+import report_store
+import rule_engine
+import xlsx_io
 # Импортируем все необходимое из нашего нового модуля
-from pattern_utils import compute_segments, dynamic_mask, super_generalize
+from io_utils import (CHUNK_BYTES, chunk_bounds, complete_end, is_splittable, open_output, open_rows,
+                      read_chunk_rows, read_header)
+from pattern_utils import (MemoCache, compute_segments, dynamic_mask, segment_columns,
+                           segments_by_traffic_type, super_generalize)
 
 INPUT_FILE   = "entry/to/data"
 OUTPUT_FILE  = "patterns_report_full.csv"
 SEP          = '\t'
 MSG_COL      = "message"
 TYPE_COL     = "traffic_type"
+GENERALIZE_CACHE_SIZE = 100_000  # 0 — без кэша
+MASK_CACHE_SIZE       = 0        # кэш по сырому тексту, полезен для рассылок без OTP
+BILLED_SEGMENTS = False          # колонка Total Segments — сегменты всех сообщений паттерна
+EXAMPLES        = 5              # примеров на паттерн: самый длинный, самый короткий и случайные
+EXAMPLES_SEP    = "\n"           # разделитель примеров в колонке Other Examples
+SEGMENTS_BATCH  = 4096           # сообщений в одном подсчёте длин и сегментов колонкой
 
-# ----------------------------------------------------------------------------
-stats = defaultdict(lambda: {"count": 0, "example": None})
+generalize = MemoCache(super_generalize, GENERALIZE_CACHE_SIZE)
+mask       = MemoCache(dynamic_mask, MASK_CACHE_SIZE)
+
+
+def new_stats():
+    return defaultdict(PatternStats)
+
+
+def better_example(new, old) -> bool:
+    """
+    Самый длинный пример, а при равной длине — меньший по алфавиту. Правило
+    не зависит от порядка строк, поэтому слияние кусков, дневных состояний
+    и сводок в любом порядке выбирает один и тот же пример.
+    """
+    return old is None or len(new) > len(old) or (len(new) == len(old) and new < old)
+
+
+def shorter_example(new, old) -> bool:
+    """
+    Самый короткий пример, а при равной длине — больший по алфавиту: если все
+    сообщения паттерна одной длины, самый длинный и самый короткий различаются.
+    """
+    return old is None or len(new) < len(old) or (len(new) == len(old) and new > old)
+
+
+def _sample_hash(text):
+    return zlib.crc32(text.encode("utf-8"))
+
+
+class PatternStats:
+    """
+    Статистика одного ключа (паттерн, тип трафика). Объект со __slots__
+    вместо словаря: на миллионах ключей это заметно меньше памяти.
+
+    Кроме самого длинного и самого короткого примера хранится до EXAMPLES - 2
+    случайных разных сообщений — те, у которых наименьший crc32 текста. Такая
+    выборка не зависит от порядка строк и сливается между кусками файла и
+    состояниями так же, как счётчики. Пока все сообщения паттерна одинаковы,
+    samples не заводится, а пока у них одно число сегментов, segment_counts —
+    просто это число, а не словарь. Сумма сегментов (segments) добавляется
+    блоками через add_segments.
+    """
+
+    __slots__ = ("count", "segments", "length_sum", "min_length", "max_length",
+                 "longest", "shortest", "samples", "segment_counts")
+
+    def __init__(self):
+        self.count = self.segments = self.length_sum = 0
+        self.min_length = self.max_length = None
+        self.longest = self.shortest = None
+        self.samples = None         # [(crc32, текст), ...] по возрастанию crc32
+        self.segment_counts = None  # {сегментов: сообщений}; число — у всех сообщений столько сегментов
+
+    def add(self, text, length, segs):
+        """
+        Учитывает одно сообщение длиной length единиц кодировки и segs
+        сегментов (для распределения; сумму добавляет add_segments).
+        """
+        if not self.count:
+            self.longest = self.shortest = text
+            self.min_length = self.max_length = length
+            self.segment_counts = segs
+        else:
+            counts = self.segment_counts
+            if type(counts) is dict:
+                counts[segs] = counts.get(segs, 0) + 1
+            elif segs != counts:
+                self.segment_counts = {counts: self.count, segs: 1}
+            # Текст, совпавший с одним из примеров, уже предлагался в выборку
+            if text != self.longest and text != self.shortest:
+                h, samples = _sample_hash(text), self.samples
+                if samples is None or len(samples) < EXAMPLES - 2 or h <= samples[-1][0]:
+                    self._add_samples(((h, text),))
+                n = len(text)
+                if n >= len(self.longest) and better_example(text, self.longest):
+                    self.longest = text
+                if n <= len(self.shortest) and shorter_example(text, self.shortest):
+                    self.shortest = text
+            if length < self.min_length:
+                self.min_length = length
+            elif length > self.max_length:
+                self.max_length = length
+        self.count += 1
+        self.length_sum += length
+
+    def add_segments(self, total):
+        """Добавляет к сумме сегментов total — сегменты сообщений, уже учтённых через add."""
+        self.segments += total
+
+    def merge(self, other):
+        """Добавляет статистику того же ключа из другого куска или состояния."""
+        if not other.count:
+            return
+        if not self.count:
+            for name in self.__slots__:
+                setattr(self, name, getattr(other, name))
+            self.samples = other.samples and list(other.samples)
+            self.segment_counts = other.segment_distribution() if type(other.segment_counts) is dict \
+                else other.segment_counts
+            return
+        distribution = self.segment_distribution()
+        for segs, n in other.segment_distribution().items():
+            distribution[segs] = distribution.get(segs, 0) + n
+        self.segment_counts = compact_distribution(distribution)
+        self._add_samples(other.sample_pairs())
+        if better_example(other.longest, self.longest):
+            self.longest = other.longest
+        if shorter_example(other.shortest, self.shortest):
+            self.shortest = other.shortest
+        self.min_length = min(self.min_length, other.min_length)
+        self.max_length = max(self.max_length, other.max_length)
+        self.count += other.count
+        self.segments += other.segments
+        self.length_sum += other.length_sum
+
+    def _add_samples(self, pairs):
+        limit = EXAMPLES - 2
+        if limit <= 0:
+            return
+        samples = self.samples = self.sample_pairs()
+        for pair in pairs:
+            if len(samples) >= limit and pair >= samples[-1] or pair in samples:
+                continue
+            bisect.insort(samples, pair)
+            del samples[limit:]
 
-with open(INPUT_FILE, encoding="utf-8") as f:
-    reader = csv.DictReader(f, delimiter=SEP, quoting=csv.QUOTE_NONE)
-    for row in reader:
+    def segment_distribution(self) -> dict:
+        """{сегментов: сообщений} — новый словарь, его можно менять."""
+        counts = self.segment_counts
+        if type(counts) is dict:
+            return dict(counts)
+        return {counts: self.count} if self.count else {}
+
+    def sample_pairs(self) -> list:
+        if self.samples is None:
+            return [(_sample_hash(self.longest), self.longest)] if self.count and EXAMPLES > 2 else []
+        return self.samples
+
+    def examples(self) -> list:
+        """Разные примеры: самый длинный, самый короткий, затем случайные — не больше EXAMPLES."""
+        result = [self.longest]
+        for text in [self.shortest] + [text for _, text in self.sample_pairs()]:
+            if text not in result:
+                result.append(text)
+        return result[:EXAMPLES]
+
+
+def compact_distribution(distribution: dict):
+    """segment_counts для распределения: одно число сегментов — само число, иначе словарь."""
+    if len(distribution) == 1:
+        return next(iter(distribution))
+    return distribution or None
+
+
+# ----------------------------------------------------------------------------
+def update_stats(stats, rows):
+    """
+    Маскирует и обобщает сообщения из rows, накапливая счётчики в stats.
+    Длины и сегменты считаются колонкой (segment_columns) по SEGMENTS_BATCH
+    сообщений, сумма сегментов по паттернам — segments_by_traffic_type.
+    """
+    intern = sys.intern
+    keys, texts = [], []
+    for row in rows:
         text    = row.get(MSG_COL, "").strip()
         traffic = row.get(TYPE_COL, "").strip() or "Нет типа"
         if len(text) < 3: # Пропускаем слишком короткие сообщения
             continue
 
         # 1) базовая маскировка с помощью функции из pattern_utils
-        pat = dynamic_mask(text)
-        # 2) «супер-обобщение» с помощью функции из pattern_utils
-        pat = super_generalize(pat)
+        pat = mask(text)
+        # 2) «супер-обобщение» с помощью функции из pattern_utils (через кэш)
+        pat = generalize(pat)
+
+        # Тип трафика — одна строка на все ключи, а не копия в каждом
+        keys.append((pat, intern(traffic)))
+        texts.append(text)
+        if len(texts) >= SEGMENTS_BATCH:
+            add_block(stats, keys, texts)
+            keys, texts = [], []
+    if texts:
+        add_block(stats, keys, texts)
+    return stats
+
+
+def add_block(stats, keys, texts):
+    """Добавляет блок сообщений с ключами keys: длины и сегменты считаются одной колонкой."""
+    lengths, segments = segment_columns(texts)
+    for key, text, length, segs in zip(keys, texts, lengths, segments):
+        stats[key].add(text, length, segs)
+    for key, total in segments_by_traffic_type(texts, keys, segments).items():
+        stats[key].add_segments(total)
+
+
+def merge_stats(total, part):
+    """Добавляет частичную статистику к общей (куски файла, дневные состояния)."""
+    for key, data in part.items():
+        total[key].merge(data)
+    return total
+
+
+def collect_serial(path):
+    """Последовательный проход по CSV или .xlsx."""
+    stats = new_stats()
+    with open_rows(path, SEP) as reader, profiling.stage("collect") as st:
+        update_stats(stats, st.count_in(reader))
+        st.rows_out = len(stats)
+    return stats
+
+
+# ----------------------------------------------------------------------------
+# При spawn/forkserver (macOS, Windows, POSIX с Python 3.14) воркер импортирует
+# модуль заново и видит значения по умолчанию, а не выставленные
+# sms_counter.apply_config и флагами, — поэтому они передаются в initializer пула.
+WORKER_SETTINGS = ("SEP", "MSG_COL", "TYPE_COL", "BILLED_SEGMENTS", "EXAMPLES")
+
+
+def worker_config():
+    """Аргументы init_worker: настройки модуля и файл правил текущего процесса."""
+    return {name: globals()[name] for name in WORKER_SETTINGS}, rule_engine.RULES_FILE
+
+
+def init_worker(settings, rules_file):
+    globals().update(settings)
+    if rule_engine.RULES_FILE != rules_file:
+        rule_engine.set_rules_file(rules_file)
+
+
+def process_chunk(args):
+    """Воркер: обрабатывает один байтовый диапазон, возвращает частичную статистику."""
+    path, start, end, fieldnames = args
+    reader = read_chunk_rows(path, start, end, fieldnames, SEP)
+
+    before = (generalize.hits, generalize.misses, generalize.evictions)
+    stats = update_stats(new_stats(), reader)
+    after = (generalize.hits, generalize.misses, generalize.evictions)
+    return dict(stats), tuple(a - b for a, b in zip(after, before))
+
+
+def collect(path, workers=1):
+    """Параллельно для CSV; .xlsx и .gz/.bz2/.xz по байтам не разрезать, поэтому последовательно."""
+    if workers > 1 and is_splittable(path):
+        return collect_parallel(path, workers)
+    return collect_serial(path)
+
+
+def collect_parallel(path, workers, chunk_bytes=CHUNK_BYTES, start=None, end=None):
+    """Параллельный проход по файлу или его байтовому диапазону [start, end)."""
+    fieldnames, offset = read_header(path, SEP)
+    tasks = [(path, a, b, fieldnames)
+             for a, b in chunk_bounds(path, offset if start is None else start, chunk_bytes, end)]
+    stats = new_stats()
+    cache_counts = [0, 0, 0]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=worker_config()) as pool, \
+            profiling.stage("collect_parallel") as st:
+        for part, counts in pool.map(process_chunk, tasks):
+            merge_stats(stats, part)
+            cache_counts = [a + b for a, b in zip(cache_counts, counts)]
+        st.rows_out = len(stats)
+    generalize.hits, generalize.misses, generalize.evictions = cache_counts
+    return stats
 
-        key = (pat, traffic)
-        cell = stats[key]
-        cell["count"] += 1
-        # Храним самый длинный пример, чтобы он был полностью виден
-        if cell["example"] is None or len(text) > len(cell["example"]):
-            cell["example"] = text
 
 # ----------------------------------------------------------------------------
-with open(OUTPUT_FILE, "w", encoding="utf-8", newline="") as f:
-    w = csv.writer(f)
-    w.writerow([
-        "Pattern",
-        "Example",
-        "Total Count",
-        "Length",
-        "SMS Segments",
-        "Traffic Type"
-    ])
+REPORT_COLUMNS = [
+    "Pattern",
+    "Example",
+    "Total Count",
+    "Length",
+    "SMS Segments",
+    "Traffic Type",
+    "Min Length",
+    "Max Length",
+    "Mean Length",
+    "Segments Distribution",
+    "Other Examples",
+]
+
+
+def format_distribution(counts: dict) -> str:
+    """{1: 950, 2: 48} → "1:950 2:48" (по возрастанию числа сегментов)."""
+    return " ".join(f"{segs}:{n}" for segs, n in sorted(counts.items()))
+
+
+def parse_distribution(text: str) -> dict:
+    return {int(segs): int(n) for segs, n in (item.split(":") for item in text.split())}
+
+
+def report_rows(stats):
+    """
+    Строки отчёта по убыванию количества — для записи в файл или следующей стадии.
+    Равные по количеству идут по (паттерн, тип трафика), чтобы порядок не
+    зависел от того, в каком порядке сливалась статистика.
+    """
     for (pat, traffic), data in sorted(
             stats.items(),
-            key=lambda kv: kv[1]["count"],
-            reverse=True):
-        example = data["example"]
-        cnt     = data["count"]
+            key=lambda kv: (-kv[1].count, kv[0])):
+        example = data.longest
         length, segs = compute_segments(example) # Используем compute_segments из pattern_utils
-        w.writerow([
-            pat,
-            example,
-            cnt,
-            length,
-            segs,
-            traffic
-        ])
-
-print("Готово — полный отчёт с «супер-обобщением» в", OUTPUT_FILE)
\ No newline at end of file
+        row = {
+            "Pattern": pat,
+            "Example": example,
+            "Total Count": data.count,
+            "Length": length,
+            "SMS Segments": segs,
+            "Traffic Type": traffic,
+            "Min Length": data.min_length,
+            "Max Length": data.max_length,
+            "Mean Length": round(data.length_sum / data.count, 1),
+            "Segments Distribution": format_distribution(data.segment_distribution()),
+            "Other Examples": EXAMPLES_SEP.join(data.examples()[1:]),
+        }
+        if BILLED_SEGMENTS:
+            row["Total Segments"] = data.segments
+        yield row
+
+
+def write_report(stats, output_file):
+    """
+    CSV, бинарный поколоночный отчёт (имя кончается на report_store.REPORT_SUFFIX)
+    или .xlsx — с переносом на следующий лист после xlsx_io.EXCEL_MAX_ROWS строк.
+    CSV с именем на .gz/.bz2/.xz пишется сжатым.
+    """
+    columns = REPORT_COLUMNS + (["Total Segments"] if BILLED_SEGMENTS else [])
+    with profiling.stage("write_report") as st:
+        st.rows_in = st.rows_out = len(stats)
+        if output_file.endswith(report_store.REPORT_SUFFIX):
+            report_store.write_report(report_rows(stats), columns, output_file)
+            return
+        if xlsx_io.is_xlsx(output_file):
+            xlsx_io.write_dicts(report_rows(stats), columns, output_file)
+            return
+        with open_output(output_file) as f:
+            w = csv.DictWriter(f, fieldnames=columns)
+            w.writeheader()
+            w.writerows(report_rows(stats))
+
+
+# ----------------------------------------------------------------------------
+# Инкрементальный режим: статистика хранится в файле состояния (формат
+# report_store) вместе с тем, какие байты каких входных файлов уже учтены.
+STATE_COLUMNS = ["Pattern", "Traffic Type", "Total Count", "Example", "Shortest Example", "Samples",
+                 "Total Segments", "Length Sum", "Min Length", "Max Length", "Segments Distribution"]
+STATE_VERSION = 2
+SAMPLES_SEP = "\x1f"  # разделитель случайных примеров в колонке Samples
+HEAD_BYTES = 64 * 1024  # начало файла, по которому узнаём, что его не переписали
+
+
+def _head_digest(path, size):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read(min(size, HEAD_BYTES))).hexdigest()
+
+
+def load_state(path):
+    """(stats, sources) из файла состояния; пустое состояние, если файла ещё нет."""
+    stats = new_stats()
+    if not os.path.exists(path):
+        return stats, {}
+    with report_store.ReportFile(path) as state:
+        if state.extra.get("state_version") != STATE_VERSION:
+            raise Exception(f"{path} собран прежней версией generaliser — пересоберите состояние")
+        for row in state.rows():
+            data = stats[(row["Pattern"], sys.intern(row["Traffic Type"]))]
+            data.count = row["Total Count"]
+            data.segments = row["Total Segments"]
+            data.length_sum = row["Length Sum"]
+            data.min_length = row["Min Length"]
+            data.max_length = row["Max Length"]
+            data.longest = row["Example"]
+            data.shortest = row["Shortest Example"]
+            if row["Samples"]:
+                pairs = sorted((_sample_hash(text), text) for text in row["Samples"].split(SAMPLES_SEP))
+                data.samples = pairs[:EXAMPLES - 2] or None
+            data.segment_counts = compact_distribution(parse_distribution(row["Segments Distribution"]))
+        return stats, state.extra.get("sources", {})
+
+
+def save_state(stats, sources, path):
+    rows = ({"Pattern": pat, "Traffic Type": traffic, "Total Count": data.count,
+             "Example": data.longest, "Shortest Example": data.shortest,
+             "Samples": SAMPLES_SEP.join(text for _, text in data.samples or ()),
+             "Total Segments": data.segments, "Length Sum": data.length_sum,
+             "Min Length": data.min_length, "Max Length": data.max_length,
+             "Segments Distribution": format_distribution(data.segment_distribution())}
+            for (pat, traffic), data in sorted(stats.items()))
+    report_store.write_report(rows, STATE_COLUMNS, path,
+                              extra={"state_version": STATE_VERSION, "sources": sources})
+
+
+def update_state(state_path, inputs, workers=1):
+    """
+    Дообрабатывает входные файлы и сохраняет состояние. Новый файл читается
+    целиком, уже известный — только с места, где остановились в прошлый раз
+    (если в него дописали строки). Недописанная последняя строка не читается.
+    """
+    stats, sources = load_state(state_path)
+    for path in inputs:
+        if not is_splittable(path):
+            raise Exception(f"{path}: инкрементальный режим считает байты и работает только с несжатым CSV")
+        key = os.path.abspath(path)
+        end = complete_end(path)
+        seen = sources.get(key)
+        if seen is None:
+            start = read_header(path, SEP)[1]
+        else:
+            if end < seen["end"] or _head_digest(path, seen["end"]) != seen["head"]:
+                raise Exception(f"{path} изменился не дописыванием — состояние {state_path} к нему не применимо")
+            start = seen["end"]
+        if start >= end:
+            print(f"{path}: новых строк нет")
+            continue
+
+        if workers > 1:
+            part = collect_parallel(path, workers, start=start, end=end)
+        else:
+            with profiling.stage("collect") as st:
+                rows = read_chunk_rows(path, start, end, read_header(path, SEP)[0], SEP)
+                part = update_stats(new_stats(), st.count_in(rows))
+                st.rows_out = len(part)
+        merge_stats(stats, part)
+        sources[key] = {"end": end, "head": _head_digest(path, end)}
+        print(f"{path}: учтены байты {start}–{end}")
+    save_state(stats, sources, state_path)
+    return stats
+
+
+def rollup_states(state_paths, output_path):
+    """Сводит дневные состояния в недельное/месячное без чтения сырых данных."""
+    total, all_sources = new_stats(), {}
+    for path in state_paths:
+        stats, sources = load_state(path)
+        overlap = all_sources.keys() & sources.keys()
+        if overlap:
+            raise Exception(f"{path}: входные файлы уже учтены в другом состоянии: {sorted(overlap)}")
+        merge_stats(total, stats)
+        all_sources.update(sources)
+    save_state(total, all_sources, output_path)
+    return total
+
+
+def main():
+    global BILLED_SEGMENTS
+    parser = argparse.ArgumentParser(description="Обобщение SMS-сообщений в паттерны")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="число процессов (1 — последовательный режим)")
+    parser.add_argument("--billed-segments", action="store_true",
+                        help="добавить колонку Total Segments — сегменты всех сообщений паттерна")
+    parser.add_argument("--state",
+                        help="файл состояния: учитывать только новые файлы/дописанные строки")
+    parser.add_argument("--rollup", nargs="+", metavar="STATE",
+                        help="свести файлы состояний в --state без чтения сырых данных")
+    parser.add_argument("inputs", nargs="*", help=f"входные файлы (по умолчанию {INPUT_FILE})")
+    parser.add_argument("--profile", help="записать JSON-отчёт инструментовки (стадии и правила)")
+    parser.add_argument("--pstats", help="записать дамп cProfile")
+    args = parser.parse_args()
+    BILLED_SEGMENTS = BILLED_SEGMENTS or args.billed_segments
+    if args.rollup and not args.state:
+        parser.error("--rollup требует --state (куда записать сводку)")
+
+    with profiling.session(args.profile, args.pstats, "generaliser") as prof:
+        if args.rollup:
+            stats = rollup_states(args.rollup, args.state)
+        elif args.state:
+            stats = update_state(args.state, args.inputs or [INPUT_FILE], args.workers)
+        else:
+            stats = new_stats()
+            for path in args.inputs or [INPUT_FILE]:
+                merge_stats(stats, collect(path, args.workers))
+        write_report(stats, OUTPUT_FILE)
+        if prof:
+            prof.info["cache_super_generalize"] = generalize.stats()
+            prof.info["cache_dynamic_mask"] = mask.stats()
+
+    print("Готово — полный отчёт с «супер-обобщением» в", OUTPUT_FILE)
+    print(generalize.describe("Кэш super_generalize"))
+    if MASK_CACHE_SIZE:
+        print(mask.describe("Кэш dynamic_mask"))
+
+
+if __name__ == "__main__":
+    main()
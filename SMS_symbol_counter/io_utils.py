@@ -0,0 +1,222 @@
+import bz2
+import csv
+import gzip
+import io
+import json
+import lzma
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+# --- Чтение входных файлов кусками для параллельной обработки ---
+CHUNK_BYTES = 64 * 1024 * 1024  # размер куска файла для одного задания воркера
+
+
+def read_header(path, sep):
+    """Возвращает имена колонок и байтовое смещение первой строки данных."""
+    with open(path, "rb") as f:
+        line = f.readline()
+        offset = f.tell()
+    text = io.TextIOWrapper(io.BytesIO(line), encoding="utf-8")
+    fieldnames = next(csv.reader(text, delimiter=sep, quoting=csv.QUOTE_NONE), [])
+    return fieldnames, offset
+
+
+def chunk_bounds(path, start, chunk_bytes=CHUNK_BYTES, end=None):
+    """Режет файл (или его часть до end) на байтовые диапазоны [start, end), выровненные по концу строки."""
+    size = os.path.getsize(path) if end is None else end
+    bounds = []
+    with open(path, "rb") as f:
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            bounds.append((start, end))
+            start = end
+    return bounds
+
+
+def complete_end(path):
+    """Смещение конца последней полной строки: недописанный хвост дописываемого файла не читаем."""
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            step = min(end, 64 * 1024)
+            f.seek(end - step)
+            block = f.read(step)
+            pos = block.rfind(b"\n")
+            if pos >= 0:
+                return end - step + pos + 1
+            end -= step
+    return 0
+
+
+def read_chunk_rows(path, start, end, fieldnames, sep):
+    """Строки (словари) одного байтового диапазона, как их выдал бы csv.DictReader."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8")
+    return csv.DictReader(text, fieldnames=fieldnames, delimiter=sep, quoting=csv.QUOTE_NONE)
+
+
+# --- Сжатые файлы (.gz, .bz2, .xz) ---
+# Входной файл распознаётся по расширению, а если оно не подсказывает — по
+# первым байтам. Распаковка идёт в отдельном потоке и кладёт блоки в
+# ограниченную очередь: пока основной поток разбирает и маскирует один блок,
+# следующий уже распаковывается (zlib, bz2 и lzma отпускают GIL на время работы).
+COMPRESSED_SUFFIXES = {".gz": gzip, ".bz2": bz2, ".xz": lzma, ".lzma": lzma}
+MAGIC_BYTES = [(b"\x1f\x8b", gzip), (b"BZh", bz2), (b"\xfd7zXZ\x00", lzma)]
+DECOMPRESS_BLOCK = 1024 * 1024  # байт распакованных данных в одном блоке очереди
+QUEUE_BLOCKS = 8                # сколько блоков поток распаковки может опередить читателя
+
+
+def compression(path):
+    """Модуль сжатия файла (gzip, bz2 или lzma) или None для несжатого."""
+    module = COMPRESSED_SUFFIXES.get(os.path.splitext(path)[1].lower())
+    if module is not None:
+        return module
+    try:
+        with open(path, "rb") as f:
+            head = f.read(6)
+    except OSError:
+        return None
+    for magic, module in MAGIC_BYTES:
+        if head.startswith(magic):
+            return module
+    return None
+
+
+def is_splittable(path):
+    """Можно ли резать файл на байтовые диапазоны: только несжатый CSV."""
+    import xlsx_io  # локально: io_utils зависит только от стандартной библиотеки
+    return not xlsx_io.is_xlsx(path) and compression(path) is None
+
+
+class BackgroundReader(io.RawIOBase):
+    """Распакованное содержимое файла; распаковкой занят отдельный поток."""
+
+    def __init__(self, path, module, block_size=DECOMPRESS_BLOCK, depth=QUEUE_BLOCKS):
+        super().__init__()
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._block = memoryview(b"")
+        self._eof = False
+        self._thread = threading.Thread(target=self._decompress, args=(path, module, block_size),
+                                        name=f"decompress {os.path.basename(path)}", daemon=True)
+        self._thread.start()
+
+    def _decompress(self, path, module, block_size):
+        try:
+            with module.open(path, "rb") as f:
+                while not self._stop.is_set():
+                    block = f.read(block_size)
+                    self._put(block)
+                    if not block:
+                        return
+        except Exception as e:  # ошибку (битый архив) поднимет читатель
+            self._put(e)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self._block:
+            if self._eof:
+                return 0
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                self._eof = True
+                raise item
+            if not item:
+                self._eof = True
+                return 0
+            self._block = memoryview(item)
+        n = min(len(b), len(self._block))
+        b[:n] = self._block[:n]
+        self._block = self._block[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+        super().close()
+
+
+def open_binary(path, buffering=-1):
+    """Файл в двоичном режиме; сжатый — распаковывается на лету в фоновом потоке."""
+    module = compression(path)
+    if module is None:
+        return open(path, "rb", buffering=buffering)
+    raw = BackgroundReader(path, module)
+    return raw if buffering == 0 else io.BufferedReader(raw, DECOMPRESS_BLOCK)
+
+
+def open_text(path):
+    """Текстовый UTF-8 файл для csv-модуля (newline=""), сжатый или нет."""
+    if compression(path) is None:
+        return open(path, newline="", encoding="utf-8")
+    return io.TextIOWrapper(open_binary(path), encoding="utf-8", newline="")
+
+
+def open_output(path):
+    """Текстовый файл на запись; если имя кончается на .gz/.bz2/.xz — со сжатием."""
+    module = COMPRESSED_SUFFIXES.get(os.path.splitext(path)[1].lower())
+    if module is None:
+        return open(path, "w", newline="", encoding="utf-8")
+    return module.open(path, "wt", newline="", encoding="utf-8")
+
+
+@contextmanager
+def open_rows(path, sep):
+    """Строки-словари входного файла: CSV (в том числе сжатый) с разделителем sep или лист .xlsx."""
+    import xlsx_io  # локально, см. is_splittable
+    if xlsx_io.is_xlsx(path):
+        reader = xlsx_io.DictReader(path)
+        try:
+            yield reader
+        finally:
+            reader.close()
+        return
+    with open_text(path) as f:
+        yield csv.DictReader(f, delimiter=sep, quoting=csv.QUOTE_NONE)
+
+
+# --- Бинарные файлы с JSON-футером (индекс finder, бинарный отчёт generaliser) ---
+# [секции данных][JSON-метаданные][длина JSON, 8 байт][магия, 8 байт]
+def write_footer(out, meta: dict, magic: bytes):
+    data = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+    out.write(data)
+    out.write(len(data).to_bytes(8, "little"))
+    out.write(magic)
+
+
+def read_footer(path, magic: bytes):
+    """Метаданные из футера файла или None, если это не файл с такой магией."""
+    tail_len = 8 + len(magic)
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() < tail_len:
+            return None
+        f.seek(-tail_len, os.SEEK_END)
+        tail = f.read(tail_len)
+        if tail[8:] != magic:
+            return None
+        size = int.from_bytes(tail[:8], "little")
+        f.seek(-tail_len - size, os.SEEK_END)
+        return json.loads(f.read(size))
+
+
+def pad_to(out, align=8):
+    """Дописывает нули до границы align, чтобы секцию можно было привести memoryview.cast."""
+    out.write(b"\0" * (-out.tell() % align))
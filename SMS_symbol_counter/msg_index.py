@@ -0,0 +1,231 @@
+import bisect
+import heapq
+import mmap
+import os
+import pickle
+import sys
+import tempfile
+from array import array
+from collections import defaultdict
+
+from io_utils import pad_to, read_footer, write_footer
+
+# --- Триграммный индекс по колонке сообщений для повторных поисков finder.py ---
+INDEX_SUFFIX = ".trgm"        # индекс лежит рядом с исходным файлом: <файл>.trgm
+INDEX_VERSION = 1
+BUILD_BATCH_ROWS = 500_000    # строк в одном отсортированном прогоне при построении
+NARROW_ENOUGH = 64            # кандидатов достаточно мало — дальше не пересекаем
+
+_MAGIC = b"SMSTRGM1"
+
+
+def index_path(path):
+    return path + INDEX_SUFFIX
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _pack(trigram):
+    """Триграмма как целое для файла индекса: три кодовые точки по 21 биту."""
+    a, b, c = trigram
+    return (ord(a) << 42) | (ord(b) << 21) | ord(c)
+
+
+def _message(line, sep, col):
+    """Значение колонки сообщения из байтовой строки файла (как csv с QUOTE_NONE)."""
+    fields = line.decode("utf-8").rstrip("\r\n").split(sep)
+    return fields[col] if col < len(fields) else ""
+
+
+def _column_index(path, sep, msg_col):
+    with open(path, "rb") as f:
+        header = f.readline().decode("utf-8").rstrip("\r\n").split(sep)
+    try:
+        return header.index(msg_col)
+    except ValueError:
+        raise Exception(f"Файл должен содержать колонку '{msg_col}'")
+
+
+def _source_stamp(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+# ----------------------------------------------------------------------------
+def _dump_run(postings, tmpdir):
+    """Сбрасывает накопленные списки строк на диск, отсортированными по триграмме."""
+    f = tempfile.TemporaryFile(dir=tmpdir)
+    for key, trigram in sorted((_pack(t), t) for t in postings):
+        pickle.dump((key, postings[trigram]), f, pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+
+def _read_run(f, run_no):
+    while True:
+        try:
+            key, rows = pickle.load(f)
+        except EOFError:
+            return
+        yield key, run_no, rows
+
+
+def build_index(path, sep, msg_col, out_path=None):
+    """
+    Строит триграммный индекс по колонке msg_col: для каждой триграммы
+    (по тексту после casefold) — отсортированный список номеров строк.
+    Строки режутся на прогоны по BUILD_BATCH_ROWS, прогоны сливаются в один файл:
+    [смещения строк Q][списки строк I][триграммы Q][начала списков Q][JSON-футер].
+    """
+    out_path = out_path or index_path(path)
+    col = _column_index(path, sep, msg_col)
+    stamp = _source_stamp(path)
+    offsets = array("Q")
+    runs = []
+    tmpdir = os.path.dirname(os.path.abspath(out_path))
+
+    postings = defaultdict(lambda: array("I"))
+    with open(path, "rb") as f:
+        pos = len(f.readline())
+        for line in f:
+            start, pos = pos, pos + len(line)
+            if not line.strip(b"\r\n"):  # пустые строки csv.DictReader пропускает
+                continue
+            row_id = len(offsets)
+            offsets.append(start)
+            for trigram in _trigrams(_message(line, sep, col).casefold()):
+                postings[trigram].append(row_id)
+            if len(offsets) % BUILD_BATCH_ROWS == 0:
+                runs.append(_dump_run(postings, tmpdir))
+                postings.clear()
+    if postings or not runs:
+        runs.append(_dump_run(postings, tmpdir))
+        postings.clear()
+
+    keys, starts = array("Q"), array("Q", [0])
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as out:
+        offsets.tofile(out)
+        postings_at = out.tell()
+        # прогоны идут в порядке строк, поэтому списки одной триграммы склеиваются уже отсортированными
+        merged = heapq.merge(*(_read_run(f, i) for i, f in enumerate(runs)))
+        for key, _, rows in merged:
+            if not keys or keys[-1] != key:
+                keys.append(key)
+                starts.append(starts[-1])
+            rows.tofile(out)
+            starts[-1] += len(rows)
+        pad_to(out)
+        keys_at = out.tell()
+        keys.tofile(out)
+        starts_at = out.tell()
+        starts.tofile(out)
+
+        footer = dict(stamp, version=INDEX_VERSION, byteorder=sys.byteorder,
+                      sep=sep, msg_col=msg_col, rows=len(offsets), trigrams=len(keys),
+                      postings_at=postings_at, keys_at=keys_at, starts_at=starts_at)
+        write_footer(out, footer, _MAGIC)
+    for f in runs:
+        f.close()
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def is_fresh(path, sep, msg_col, idx_path=None):
+    """Индекс существует и построен по этой же версии файла (размер и mtime совпадают)."""
+    idx_path = idx_path or index_path(path)
+    if not os.path.exists(idx_path):
+        return False
+    footer = read_footer(idx_path, _MAGIC)
+    if footer is None:
+        return False
+    expected = dict(_source_stamp(path), version=INDEX_VERSION, byteorder=sys.byteorder,
+                    sep=sep, msg_col=msg_col)
+    return all(footer.get(k) == v for k, v in expected.items())
+
+
+# ----------------------------------------------------------------------------
+class MessageIndex:
+    """
+    Индекс, отображённый в память. candidates() пересекает списки строк
+    триграмм подстроки, message() читает сообщение строки прямо из исходного файла.
+    """
+
+    def __init__(self, path, idx_path=None):
+        self.path = path
+        self.footer = read_footer(idx_path or index_path(path), _MAGIC)
+        self.col = _column_index(path, self.footer["sep"], self.footer["msg_col"])
+        self._idx_file = open(idx_path or index_path(path), "rb")
+        self._idx = mmap.mmap(self._idx_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._src_file = open(path, "rb")
+        self._src = mmap.mmap(self._src_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        ft = self.footer
+        self._view = view = memoryview(self._idx)
+        self.offsets = view[:ft["postings_at"]].cast("Q")
+        self.keys = view[ft["keys_at"]:ft["starts_at"]].cast("Q")
+        self.starts = view[ft["starts_at"]:ft["starts_at"] + 8 * (ft["trigrams"] + 1)].cast("Q")
+        self.postings = view[ft["postings_at"]:ft["postings_at"] + 4 * self.starts[-1]].cast("I")
+
+    def __len__(self):
+        return self.footer["rows"]
+
+    def close(self):
+        for view in (self.offsets, self.postings, self.keys, self.starts, self._view):
+            view.release()
+        self._idx.close()
+        self._src.close()
+        self._idx_file.close()
+        self._src_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _rows(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+        return self.postings[self.starts[i]:self.starts[i + 1]]
+
+    def candidates(self, literal):
+        """
+        Отсортированные номера строк, которые могут содержать literal
+        (совпадение проверяет вызывающий). None — подстрока короче трёх
+        символов, индекс её не сужает.
+        """
+        trigrams = _trigrams(literal.casefold())
+        if not trigrams:
+            return None
+        lists = []
+        for trigram in trigrams:
+            rows = self._rows(_pack(trigram))
+            if rows is None:
+                return []
+            lists.append(rows)
+        lists.sort(key=len)
+        found = set(lists[0])
+        for rows in lists[1:]:
+            if len(found) <= NARROW_ENOUGH:
+                break
+            found.intersection_update(rows)
+        return sorted(found)
+
+    def message(self, row_id):
+        start = self.offsets[row_id]
+        end = self._src.find(b"\n", start)
+        line = self._src[start:] if end < 0 else self._src[start:end]
+        return _message(line, self.footer["sep"], self.col)
+
+
+def open_index(path, sep, msg_col, rebuild=True):
+    """Открывает индекс файла; если его нет или файл изменился — перестраивает (или None)."""
+    if not is_fresh(path, sep, msg_col):
+        if not rebuild:
+            return None
+        build_index(path, sep, msg_col)
+    return MessageIndex(path)
@@ -0,0 +1,183 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import stat
+import time
+from collections import deque
+
+import rule_engine
+from pattern_utils import MemoCache, compute_segments, dynamic_mask, super_generalize
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+# --- Резидентный классификатор сообщений ---
+# Протокол — JSON по строке (NDJSON) через Unix-сокет или TCP на localhost.
+# Запрос:  {"id": 1, "messages": ["текст", ...]}
+# Ответ:   {"id": 1, "results": [{"pattern", "template", "length", "segments"}, ...]}
+# Служебные запросы: {"op": "stats"}, {"op": "ping"}.
+# Клиент может слать запросы, не дожидаясь ответов (конвейер): ответы
+# приходят в порядке запросов одного соединения.
+SOCKET_PATH = "/tmp/sms_patterns.sock"
+HOST = "127.0.0.1"
+CACHE_SIZE = 200_000               # кэш super_generalize по маскированному паттерну
+MASK_CACHE_SIZE = 0                # кэш dynamic_mask по сырому тексту (OTP почти не повторяются)
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+LATENCY_WINDOW = 10_000            # по скольким последним пачкам считать перцентили
+
+
+class Classifier:
+    """Правила скомпилированы и кэши прогреты на всё время жизни процесса."""
+
+    def __init__(self, cache_size=CACHE_SIZE, mask_cache_size=MASK_CACHE_SIZE):
+        rule_engine.get_rules().compile_all()
+        self.generalize = MemoCache(super_generalize, cache_size)
+        self.mask = MemoCache(dynamic_mask, mask_cache_size)
+        self.started = time.time()
+        self.batches = self.messages = self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)  # секунды на пачку: разбор JSON, классификация, ответ
+
+    def classify(self, messages) -> list:
+        results = []
+        for text in messages:
+            pattern = self.mask(text)
+            length, segments = compute_segments(text)
+            results.append({
+                "pattern": pattern,
+                "template": self.generalize(pattern),
+                "length": length,
+                "segments": segments,
+            })
+        return results
+
+    def handle(self, request: dict) -> dict:
+        op = request.get("op", "classify")
+        if op == "ping":
+            return {"id": request.get("id"), "ok": True}
+        if op == "stats":
+            return {"id": request.get("id"), "stats": self.stats()}
+        if op != "classify":
+            raise ValueError(f"неизвестная операция {op!r}")
+        messages = request.get("messages")
+        if not isinstance(messages, list) or not all(isinstance(m, str) for m in messages):
+            raise ValueError("'messages' должен быть списком строк")
+        results = self.classify(messages)
+        self.batches += 1
+        self.messages += len(messages)
+        return {"id": request.get("id"), "results": results}
+
+    def stats(self) -> dict:
+        lat = sorted(self.latencies)
+        uptime = time.time() - self.started
+
+        def pct(p):
+            return round(1000 * lat[min(len(lat) - 1, int(p * len(lat)))], 3) if lat else None
+
+        return {
+            "uptime_s": round(uptime, 1),
+            "batches": self.batches,
+            "messages": self.messages,
+            "errors": self.errors,
+            "messages_per_s": round(self.messages / uptime, 1) if uptime else None,
+            "batch_ms_p50": pct(0.50),
+            "batch_ms_p99": pct(0.99),
+            "cache_template": self.generalize.stats(),
+            "cache_mask": self.mask.stats(),
+        }
+
+
+async def serve_connection(classifier: Classifier, reader, writer):
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:  # строка длиннее MAX_REQUEST_BYTES
+                classifier.errors += 1
+                writer.write(b'{"id": null, "error": "request too large"}\n')
+                break
+            if not line:
+                break
+            start = time.perf_counter()
+            request = None
+            try:
+                request = json.loads(line)
+                response = classifier.handle(request)
+            except Exception as e:
+                classifier.errors += 1
+                response = {"id": request.get("id") if isinstance(request, dict) else None, "error": str(e)}
+            writer.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+            if "results" in response:
+                classifier.latencies.append(time.perf_counter() - start)
+            # drain() ждёт, только если клиент не успевает читать ответы
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+def remove_stale_socket(path):
+    """
+    Удаляет сокет, оставшийся от прошлого запуска. Любой другой файл по этому
+    пути (например, опечатка в --socket) не трогаем — это ошибка запуска.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise Exception(f"{path} уже существует и это не сокет — укажите другой путь в --socket")
+    os.remove(path)
+
+
+async def run(socket_path=None, port=None, cache_size=CACHE_SIZE):
+    classifier = Classifier(cache_size)
+
+    def handler(reader, writer):
+        return serve_connection(classifier, reader, writer)
+
+    if port is not None:
+        server = await asyncio.start_server(handler, HOST, port, limit=MAX_REQUEST_BYTES)
+        where = f"{HOST}:{port}"
+    else:
+        socket_path = socket_path or SOCKET_PATH
+        remove_stale_socket(socket_path)
+        server = await asyncio.start_unix_server(handler, socket_path, limit=MAX_REQUEST_BYTES)
+        where = socket_path
+    logging.info(f"Классификатор слушает {where}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    async with server:
+        await stop.wait()
+    if port is None:
+        try:
+            os.remove(socket_path)
+        except FileNotFoundError:
+            pass  # сокет уже удалили снаружи
+    st = classifier.stats()
+    logging.info(f"Остановлен: пачек {st['batches']}, сообщений {st['messages']}, "
+                 f"p50 {st['batch_ms_p50']} мс, p99 {st['batch_ms_p99']} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Резидентный классификатор SMS (NDJSON через сокет)")
+    parser.add_argument("--socket", help=f"Unix-сокет (по умолчанию {SOCKET_PATH})")
+    parser.add_argument("--port", type=int, help=f"слушать TCP {HOST}:PORT вместо Unix-сокета")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE, help="размер кэша шаблонов")
+    parser.add_argument("--rules", help="JSON-файл правил обобщения")
+    args = parser.parse_args()
+    if args.rules:
+        rule_engine.set_rules_file(args.rules)
+    asyncio.run(run(args.socket, args.port, args.cache_size))
+
+
+if __name__ == "__main__":
+    main()
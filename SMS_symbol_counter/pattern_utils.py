@@ -1,5 +1,18 @@
 import re
 import math
+import time
+from collections import OrderedDict
+
+import profiling
+
+# Правила «супер-обобщения» лежат в rules/generalize_rules.json;
+# literal_prefix и SpecialsMatcher реэкспортируются для остальных модулей
+from rule_engine import SpecialsMatcher, get_rules, literal_prefix  # noqa: F401
+
+try:
+    import numpy as np
+except ImportError:  # векторный подсчёт сегментов недоступен
+    np = None
 
 # --- Константы для обработки сообщений ---
 # GSM-7 для подсчёта сегментов
@@ -8,157 +21,326 @@ GSM7 = (
     "0123456789:;<=>?¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿"
     "abcdefghijklmnopqrstuvwxyzäöñüà"
 )
+# Таблица расширения GSM 03.38: каждый символ занимает два септета (ESC + код)
+GSM7_EXT = "\f^{}\\[~]|€"
+
+_GSM7_ALL = frozenset(GSM7 + GSM7_EXT)
+_GSM7_EXT_SET = frozenset(GSM7_EXT)
+_DROP_GSM7_EXT = str.maketrans("", "", GSM7_EXT)
+
+# (лимит одного сообщения, размер части составного) в септетах / кодовых единицах UCS-2
+GSM7_LIMITS = (160, 153)
+UCS2_LIMITS = (70, 67)
+
 
 # --- Функции для подсчёта сегментов SMS ---
+def _count_parts(costs, block: int) -> int:
+    """Раскладывает символы по частям, не разрывая двухъединичные символы."""
+    segs, used = 1, 0
+    for cost in costs:
+        if used + cost > block:
+            segs += 1
+            used = 0
+        used += cost
+    return segs
+
+
 def compute_segments(text: str):
     """
     Вычисляет длину сообщения и количество SMS-сегментов.
-    Использует GSM-7 кодировку для оптимизации подсчета.
+    Длина считается в единицах кодировки: септетах GSM-7 (символы таблицы
+    расширения — по два) или кодовых единицах UCS-2 (символы вне BMP —
+    суррогатная пара, по два). Символ из двух единиц не разрывается
+    между частями составного сообщения.
     """
-    length = len(text)
-    is_gsm7 = all(ch in GSM7 for ch in text)
-    limit, block = (160, 153) if is_gsm7 else (70, 67)
-    segs = 1 if length <= limit else math.ceil(length / block)
-    return length, segs
-
-# --- Словарь «особых» обобщений ---
-# Эти паттерны будут обрабатываться в первую очередь
-SPECIALS = {
-    # kh: {NUM} {NUM},{NUM} KZT… → сводим оба в {MONEY}
-    r"kh: \{NUM\} \{NUM\},\{NUM\} KZT\.Karta:\{NUM\}\*\*\{NUM\}\.Qaldyq/ostatok:\{NUM\},\{NUM\} KZT":
-        "kh: {MONEY} KZT. Karta: {NUM}**{NUM}. Qaldyq/ostatok: {MONEY} KZT",
-
-    # k: {NUM} {NUM}.{NUM} KZT → k: {MONEY} KZT
-    r"k: \{NUM\} \{NUM\}\.\{NUM\} KZT":
-        "k: {MONEY} KZT",
-
-    # KODTY ESHKIMGE… (KZT) → ({MONEY}).Kod:{NUM}
-    r"KODTY ESHKIMGE AITPANYZ/NIKOMU NE GOVORITE KOD\.Audarym/Perevod: \(\{NUM\} \{NUM\}\.\{NUM\} KZT\)\.Kod:\{NUM\}":
-        "KODTY ESHKIMGE AITPANYZ/NIKOMU NE GOVORITE KOD.Audarym/Perevod: ({MONEY}).Kod:{NUM}",
-
-    # «Sizge {CODE}… Salemdeme kody {CODE} Saqtau merzimi {NUM}… Vam postupila posylka {CODE}»
-    r"Sizge \{CODE\} salemdemesi keldi\.Salemdeme kody \{CODE\} Saqtau merzimi \{NUM\} kun\..*?Vam postupila posylka \{CODE\}":
-        "Sizge {CODE} salemdemesi keldi. Salemdeme kody {CODE} Saqtau merzimi {NUM} kun. Vam postupila posylka {CODE}",
-
-    # {CODE}.Kod posylki X-{NUM}-{NUM}… → {CODE}.Kod posylki {CODE}…
-    r"\{CODE\}\.Kod posylki [A-Za-z0-9]+-\{NUM\}-\{NUM\}\. Srok hranenia \{NUM\} dney\. Uznat dopolnitelnuyu informaciu mozhete na post\.kz\.":
-        "{CODE}.Kod posylki {CODE}. Srok hranenia {NUM} dney. Uznat dopolnitelnuyu informaciu mozhete na post.kz.",
-
-    # «Sizge {CODE}…posylka» (частично обрезанные варианты без или с коротким хвостом)
-    r"Sizge \{CODE\} salemdemesi keldi\.Salemdeme kody \{CODE\} Saqtau merzimi \{NUM\} kun\. Qosymsha aqparatty post\.kz - ten bile alasyz\.Vam postupila posylka(?: [A-Za-z0-9]*)?":
-        "Sizge {CODE} salemdemesi keldi. Salemdeme kody {NUM} kun. Qosymsha aqparatty post.kz - ten bile alasyz. Vam postupila posylka {CODE}",
-
-    # «Sizge salemdeme keldi. Saqtau merzimi {NUM}… Tolygyraq/Detali: {TRACK_URL}»
-    r"Sizge salemdeme keldi\. Saqtau merzimi \{NUM\} kun\. / Vam prishla posylka\. Srok hranenia \{NUM\} dney\. Tolygyraq/Detali:? ?\{TRACK_URL\}":
-        "Sizge salemdeme keldi. Saqtau merzimi {NUM} kun. / Vam prishla posylka. Srok hranenia {NUM} dney. Tolygyraq/Detali: {TRACK_URL}",
-
-    # «qolma-qol … snyatie nalichnykh» (KZT/UZS/USD) → один шаблон
-    r"\{TIME\} qolma-qol aqshany sheship aly(?:ndy| oryndalmady)/ otmena snyatiya nalichnykh: \{(?:NUM|MONEY)\}(?: \{NUM\})*(?:\.\{NUM\})? (?:KZT|UZS|USD)\. Karta:\{NUM\}\*\*\{NUM\}\. Qaldyq/ostatok: \{(?:NUM|MONEY)\}(?: \{NUM\})*(?:\.\{NUM\})? (?:KZT|UZS|USD)":
-        "{TIME} qolma-qol aqsha sheship alyndy/otmena snyatiya nalichnykh: {MONEY} {CURR}. Karta:{NUM}**{NUM}. Qaldyq/ostatok: {MONEY} {CURR}",
-
-    # «*{NUM} shotqa {NUM} KZT soma alyndy…Ostatok {NUM} KZT»
-    r"\*\{NUM\} shott?a \{NUM\} KZT soma alyndy\.(.*?)Ostatok \{NUM\} KZT":
-        "*{NUM} shotqa {NUM} KZT soma alyndy. Qaldygy {NUM} KZT/ Postuplenie na schet *{NUM} Summa {NUM} KZT. Ostatok {NUM} KZT",
-
-    # «telefon nomiri … perevod … KZT»
-    r"\{TIME\} telefon nomiri arqyly audarym kelip tusti/ postupil perevod po nomeru telefona: \{(?:NUM|MONEY)\}(?:\.\{NUM\})? KZT\. K\*\*\{NUM\}\. Qaldyq/ostatok: \{(?:NUM|MONEY)\}(?:\.\{NUM\})? KZT":
-        "{TIME} telefon nomiri arqyly audarym kelip tusti/ postupil perevod po nomeru telefona: {MONEY} KZT. K**{NUM}. Qaldyq/ostatok: {MONEY} KZT",
-
-    r"\{CODE\}\.Kod posylki [-A-Za-z0-9]*\{NUM\}\. Srok hranenia \{NUM\} dney\. Uznat dopolnitelnuyu informaciu mozhete na post\.kz\.":
-    "{CODE}.Kod posylki {CODE}. Srok hranenia {NUM} dney. Uznat dopolnitelnuyu informaciu mozhete na post.kz.",
-
-    # Правила из aggregator.py, которых не было в generaliser.py (или были, но отличались)
-    # telefon nomiri…USD/EUR/KZT - расширенная валюта
-    r"\{TIME\} telefon nomiri arqyly audarym kelip tusti/ postupil perevod po nomeru telefona: \{(?:NUM|MONEY)\}(?:\.\{NUM\})? (?:KZT|USD|EUR|UZS)\. K\*\*\{NUM\}\. Qaldyq/ostatok: \{(?:NUM|MONEY)\}(?:\.\{NUM\})? (?:KZT|USD|EUR|UZS)":
-        "{TIME} telefon nomiri arqyly audarym kelip tusti/ postupil perevod po nomeru telefona: {MONEY} {CURR}. K**{NUM}. Qaldyq/ostatok: {MONEY} {CURR}",
-
-    # хвостовые «12345KZ.Kod posylki -{NUM}…»
-    r"\d+[A-Z]{2}\.Kod posylki -\{NUM\}\. Srok hranenia \{NUM\} dney\. Uznat dopolnitelnuyu informaciu mozhete na post\.kz\.":
-        "{CODE}.Kod posylki -{NUM}. Srok hranenia {NUM} dney. Uznat dopolnitelnuyu informaciu mozhete na post.kz.",
-}
+    if _GSM7_ALL.issuperset(text):
+        (limit, block), wide = GSM7_LIMITS, _GSM7_EXT_SET
+        if wide.isdisjoint(text):
+            length = len(text)
+        else:
+            length = 2 * len(text) - len(text.translate(_DROP_GSM7_EXT))
+    else:
+        (limit, block), wide = UCS2_LIMITS, None
+        length = len(text.encode("utf-16-le")) >> 1
+
+    if length <= limit:
+        return length, 1
+    if length == len(text):  # все символы по одной единице
+        return length, math.ceil(length / block)
+    if wide is not None:
+        costs = (2 if ch in wide else 1 for ch in text)
+    else:
+        costs = (2 if ch > "\uffff" else 1 for ch in text)
+    return length, _count_parts(costs, block)
+
+
+def compute_segments_batch(texts) -> list:
+    """compute_segments для целой колонки сообщений: список пар (длина, сегменты)."""
+    return list(map(compute_segments, texts))
+
+# --- Векторный подсчёт сегментов (NumPy) ---
+VECTOR_CHUNK_ROWS = 4096  # строк в одном блоке: кодовые точки блока помещаются в кэш процессора
+# Признаки символа упакованы в одно int64, чтобы суммировать их по сообщению одним reduceat:
+# биты 0–20 — символов таблицы расширения GSM-7, 21–41 — символов вне BMP, 42–62 — символов не из GSM-7
+_EXT_UNIT, _ASTRAL_UNIT, _NON_GSM_UNIT = 1, 1 << 21, 1 << 42
+_FIELD_MASK = (1 << 21) - 1
+_CODEPOINT_COSTS = None
+
+
+def _codepoint_costs():
+    """Упакованные признаки для каждой кодовой точки BMP (символы вне BMP — отдельно)."""
+    global _CODEPOINT_COSTS
+    if _CODEPOINT_COSTS is None:
+        costs = np.full(0x10000, _NON_GSM_UNIT, dtype=np.int64)
+        costs[[ord(ch) for ch in GSM7]] = 0
+        costs[[ord(ch) for ch in GSM7_EXT]] = _EXT_UNIT
+        _CODEPOINT_COSTS = costs
+    return _CODEPOINT_COSTS
+
+
+def _vectorized_chunk(chunk):
+    """Длина, признак GSM-7 и сегменты для блока строк — три массива."""
+    chars = np.fromiter(map(len, chunk), dtype=np.int64, count=len(chunk))
+    # все строки блока подряд одним массивом кодовых точек, без выравнивания
+    cps = np.frombuffer("".join(chunk).encode("utf-32-le"), dtype=np.uint32)
+    flags = _codepoint_costs()[np.minimum(cps, 0xFFFF)]
+    flags[cps > 0xFFFF] = _ASTRAL_UNIT | _NON_GSM_UNIT
+    sums = np.zeros(len(chunk), dtype=np.int64)
+    nonempty = chars > 0
+    if nonempty.any():
+        sums[nonempty] = np.add.reduceat(flags, (np.cumsum(chars) - chars)[nonempty])
+
+    gsm = (sums >> 42) == 0
+    units = chars + np.where(gsm, sums & _FIELD_MASK, (sums >> 21) & _FIELD_MASK)
+    limit = np.where(gsm, GSM7_LIMITS[0], UCS2_LIMITS[0])
+    block = np.where(gsm, GSM7_LIMITS[1], UCS2_LIMITS[1])
+    segs = np.where(units <= limit, 1, -(-units // block))
+
+    # длинные сообщения с двухъединичными символами — точный подсчёт
+    for k in np.flatnonzero((units > limit) & (units != chars)):
+        segs[k] = compute_segments(chunk[k])[1]
+    return units, gsm, segs
+
+
+def compute_segments_vectorized(messages):
+    """
+    Векторный вариант compute_segments для колонки сообщений (список,
+    pandas.Series, массив NumPy). Возвращает три массива: длина в единицах
+    кодировки, признак GSM-7 и число сегментов. Строки блоками по
+    VECTOR_CHUNK_ROWS склеиваются в один массив кодовых точек UTF-32,
+    признаки символов суммируются по сообщениям. Строки, где точный ответ
+    зависит от раскладки двухъединичных символов по частям, досчитываются
+    через compute_segments.
+    """
+    if np is None:
+        raise ImportError("Для векторного подсчёта сегментов нужен numpy")
+    messages = ["" if m is None else str(m) for m in messages]
+    lengths = np.empty(len(messages), dtype=np.int64)
+    is_gsm7 = np.empty(len(messages), dtype=bool)
+    segments = np.empty(len(messages), dtype=np.int64)
+    for lo in range(0, len(messages), VECTOR_CHUNK_ROWS):
+        chunk = messages[lo:lo + VECTOR_CHUNK_ROWS]
+        if max(map(len, chunk)) > _FIELD_MASK:  # счётчики символов не поместятся в поле
+            pairs = compute_segments_batch(chunk)
+            units = [n for n, _ in pairs]
+            gsm = [_GSM7_ALL.issuperset(text) for text in chunk]
+            segs = [s for _, s in pairs]
+        else:
+            units, gsm, segs = _vectorized_chunk(chunk)
+        hi = lo + len(chunk)
+        lengths[lo:hi], is_gsm7[lo:hi], segments[lo:hi] = units, gsm, segs
+    return lengths, is_gsm7, segments
+
+
+def segment_columns(messages):
+    """
+    Длины и сегменты колонки сообщений двумя списками: через numpy, если он
+    установлен, иначе через compute_segments — результат одинаковый.
+    """
+    if np is not None:
+        lengths, _, segments = compute_segments_vectorized(messages)
+        return lengths.tolist(), segments.tolist()
+    pairs = compute_segments_batch(messages)
+    return [n for n, _ in pairs], [s for _, s in pairs]
 
-# --- Функция для базовой маскировки сообщений ---
-def dynamic_mask(msg: str) -> str:
+
+def segments_by_traffic_type(messages, traffic_types, segments=None) -> dict:
     """
-    Выполняет первичную маскировку сырого сообщения, заменяя
-    даты, время, ссылки, коды и числа на общие токены.
+    Суммирует сегменты сообщений по типу трафика: {тип: всего сегментов}.
+    Ключом может быть любое хешируемое значение, например пара
+    (паттерн, тип трафика). segments — уже посчитанная колонка сегментов
+    (segment_columns), чтобы не считать её второй раз.
     """
-    # 0) убрать дату в начале
-    msg = re.sub(r'^(?:\d{2}[.-]\d{2}[.-]\d{2,4}|\d{4}-\d{2}-\d{2})\s*', '', msg)
+    if segments is None:
+        segments = segment_columns(messages)[1]
+    totals = {}
+    for key, n in zip(traffic_types, segments):
+        totals[key] = totals.get(key, 0) + n
+    return totals
+
+
+# --- Скомпилированные правила базовой маскировки ---
+# Дата в начале сообщения
+_DATE_PREFIX_RX = re.compile(r'^(?:\d{2}[.-]\d{2}[.-]\d{2,4}|\d{4}-\d{2}-\d{2})\s*')
+
+_URL = r'https?://\S+'
+# Время: граница справа считается и перед ссылкой (её заменит {URL})
+_TIME = r'\d{2}:\d{2}:\d{2}(?:(?!\w)|(?=https?://\S))'
+# Трек не захватывает время и начало ссылки — они маскируются раньше
+_TRACK = r'/t/(?!' + _TIME + r')(?:(?!https?://\S)[A-Za-z0-9]){1,13}'
+# «Salemdeme kody … Saqtau merzimi»: ссылки и треки внутри — неделимые куски
+_SALEM = (
+    r'(?P<salem_head>(?i:Salemdeme kody))'
+    r'(?>' + _URL + '|' + _TRACK + r'|.)*?'
+    r'(?P<salem_tail>(?i:Saqtau merzimi))'
+)
+
+# Шаги 1–4 (ссылки, время, треки, Salemdeme) за один проход;
+# опережающая проверка первого символа отсекает заведомо лишние позиции
+# (\d — любые цифры Unicode, как в самом правиле времени)
+_MASK_RX = re.compile(
+    r'(?=[h/\dSsſ])(?:'
+    r'(?P<url>' + _URL + r')'
+    r'|(?P<time>(?<!\w)' + _TIME + r')'
+    r'|(?P<track>' + _TRACK + r')'
+    r'|(?P<salem>' + _SALEM + r'))'
+)
+
+# Шаги 5–6: числа (группа 1) и длинные alnum-коды (>10, буквы и цифры)
+_WORD_RX = re.compile(
+    r'\b(?:(\d+)'
+    r'|(?=[A-Za-z0-9]{10})(?=[A-Za-z0-9]*[A-Za-z])(?=[A-Za-z0-9]*[0-9])[A-Za-z0-9]+)\b'
+)
+
+_MASK_TOKENS = {
+    "url": "{URL}",
+    "time": "{TIME}",
+    "track": "/t/{TRACK}",
+}
 
-    # 1) ссылки → {URL}
-    msg = re.sub(r'https?://\S+', '{URL}', msg)
 
-    # 2) время HH:MM:SS → {TIME}
-    msg = re.sub(r'\b\d{2}:\d{2}:\d{2}\b', '{TIME}', msg)
+def _mask_token(m):
+    kind = m.lastgroup
+    if kind == "salem":
+        return f"{m.group('salem_head')} {{CODE}} {m.group('salem_tail')}"
+    return _MASK_TOKENS[kind]
 
-    # 3) треки /t/XXXXXXXXXXXXX → /t/{TRACK}
-    msg = re.sub(r'/t/[A-Za-z0-9]{1,13}', '/t/{TRACK}', msg)
 
-    # 4) обобщить «Salemdeme kody … Saqtau merzimi»
-    msg = re.sub(
-        r'(Salemdeme kody)(.*?)(Saqtau merzimi)',
-        r'\1 {CODE} \3',
-        msg,
-        flags=re.IGNORECASE
-    )
+def _mask_word(m):
+    return '{NUM}' if m.lastindex else '{CODE}'
 
-    # 5) длинные alnum-коды (>10) → {CODE}
-    def _code(m):
-        w = m.group(0)
-        if re.search(r'[A-Za-z]', w) and re.search(r'\d', w):
-            return '{CODE}'
-        return w
-    msg = re.sub(r'\b[A-Za-z0-9]{10,}\b', _code, msg)
 
-    # 6) все остальные числа → {NUM}
-    msg = re.sub(r'\b\d+\b', '{NUM}', msg)
+# --- Функция для базовой маскировки сообщений ---
+def dynamic_mask(msg: str) -> str:
+    """
+    Выполняет первичную маскировку сырого сообщения, заменяя
+    даты, время, ссылки, коды и числа на общие токены.
+    Правила скомпилированы заранее: ссылки/время/треки/«Salemdeme kody»
+    заменяются за один проход, коды и числа — за второй.
+    """
+    if profiling.current is not None:
+        return _dynamic_mask_profiled(msg, profiling.current)
 
+    # 0) убрать дату в начале
+    m = _DATE_PREFIX_RX.match(msg)
+    if m:
+        msg = msg[m.end():]
+
+    # 1)–4) ссылки → {URL}, время → {TIME}, треки → /t/{TRACK},
+    #        «Salemdeme kody … Saqtau merzimi» → {CODE}
+    # Проход пропускается, если в тексте нет ни одного «якоря» этих правил
+    if ':' in msg or '/t/' in msg or 'alemdeme' in msg.casefold():
+        msg = _MASK_RX.sub(_mask_token, msg)
+
+    # 5)–6) длинные alnum-коды → {CODE}, все остальные числа → {NUM}
+    return _WORD_RX.sub(_mask_word, msg)
+
+
+def _dynamic_mask_profiled(msg: str, prof) -> str:
+    """dynamic_mask с замером каждого шага и подсчётом замен по видам токенов."""
+    clock = time.perf_counter
+    begin = t = clock()
+    m = _DATE_PREFIX_RX.match(msg)
+    if m:
+        msg = msg[m.end():]
+    now = clock()
+    prof.rule("dynamic_mask", "0 date_prefix", now - t, m is not None)
+
+    t = now
+    kinds = []
+    if ':' in msg or '/t/' in msg or 'alemdeme' in msg.casefold():
+        def token(m):
+            kinds.append(m.lastgroup)
+            return _mask_token(m)
+        msg = _MASK_RX.sub(token, msg)
+    now = clock()
+    prof.rule("dynamic_mask", "1-4 url/time/track/salem", now - t, bool(kinds))
+    for kind in kinds:
+        prof.count("dynamic_mask_tokens", kind)
+
+    t = now
+    msg, n = _WORD_RX.subn(_mask_word, msg)
+    now = clock()
+    prof.rule("dynamic_mask", "5-6 code/num", now - t, n > 0)
+    prof.rule("functions", "dynamic_mask", now - begin)
     return msg
 
 # --- Функция для "супер-обобщения" паттернов ---
 def super_generalize(pat: str) -> str:
     """
     Применяет правила "супер-обобщения" к уже маскированному паттерну.
-    Сначала проверяет на "особые" случаи, затем применяет общие правила.
+    Правила (особые случаи и общие) загружаются из rule_engine.RULES_FILE
+    один раз и общие для generaliser.py и aggregator.py.
     """
-    # сначала проверяем «специальные» случаи
-    for rx, replacement in SPECIALS.items():
-        if re.fullmatch(rx, pat):
-            return replacement
-
-    p = pat
-
-    # 0) Убираем всё перед ".Kod posylki" (правило из aggregator.py, применяем его здесь)
-    p = re.sub(r"^.*?\.Kod posylki", "{CODE}.Kod posylki", p)
-
-    # 1) datetime — дата и время вместе ({NUM}-{NUM}-{NUM} {TIME} → {DATETIME})
-    p = re.sub(r"\{NUM\}-\{NUM\}-\{NUM\} \{TIME\}", "{DATETIME}", p)
-
-    # 2) суммы с валютами → {MONEY} {CURR}
-    # пример: {NUM} {NUM},{NUM} USD → {MONEY} {CURR}
-    p = re.sub(
-        r"-?\{NUM\}(?:[ ,]\{NUM\})*(?:[.,]\{NUM\})? [A-Z]{3}\b",
-        lambda m: f"{'-' if m.group(0).startswith('-') else ''}{{MONEY}} {{CURR}}",
-        p
-    )
+    return get_rules().generalize(pat)
 
-    # 3) ссылки и треки
-    p = re.sub(r"/t/\{\d+_TRACK\}", "{TRACK_URL}", p)
-    p = re.sub(r"\{URL\}", "{TRACK_URL}", p)
 
-    # 4) любые коды вида {N_CODE} → {CODE}
-    p = re.sub(r"\{\d+_CODE\}", "{CODE}", p)
-
-    # 5) сжимаем подряд несколько {NUM}{NUM}… → один {NUM} (из aggregator.py)
-    # или (?:{NUM}\s*){2,} → {NUM} (из generaliser.py)
-    # Объединим их в одно: если несколько {NUM} подряд, даже с пробелами, сжимаем в один {NUM}
-    p = re.sub(r"(?:\{NUM\}\s*){2,}", "{NUM} ", p).strip()
-
-
-    # 6) нормализуем пробелы и пунктуацию (исключая минус)
-    p = re.sub(r"\s*([:/])\s*", r"\1", p)     # пробелы вокруг : и /
-    p = re.sub(r"\s{2,}", " ", p)             # множественные пробелы → один
-    p = p.strip()
+# --- Кэш результатов обобщения ---
+class MemoCache:
+    """
+    Ограниченный LRU-кэш вокруг функции одного строкового аргумента.
+    Считает попадания, промахи и вытеснения. maxsize=0 отключает кэш:
+    функция вызывается напрямую, а каждый вызов считается промахом.
+    """
 
-    return p
\ No newline at end of file
+    def __init__(self, func, maxsize: int):
+        self.func = func
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def __call__(self, key: str) -> str:
+        data = self.data
+        if key in data:
+            self.hits += 1
+            data.move_to_end(key)
+            return data[key]
+        self.misses += 1
+        value = self.func(key)
+        if self.maxsize > 0:
+            data[key] = value
+            if len(data) > self.maxsize:
+                data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        self.data.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        calls = self.hits + self.misses
+        return {
+            "size": len(self.data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / calls if calls else 0.0,
+        }
+
+    def describe(self, name: str) -> str:
+        st = self.stats()
+        return (f"{name}: попаданий {st['hits']}, промахов {st['misses']}, "
+                f"вытеснений {st['evictions']}, hit-rate {st['hit_rate']:.1%}, "
+                f"размер {st['size']}/{st['maxsize']}")
@@ -1,7 +1,12 @@
+import argparse
 import csv
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
 from collections import defaultdict, deque
+from itertools import combinations
+
+import profiling
+from io_utils import open_output, open_rows
 
 # Путь к входному и выходному CSV
 INPUT_CSV  = "csv/in/2025-05-01_2025-05-31(1).csv"
@@ -11,6 +16,7 @@ MSG_COL    = "message"
 PHONE_COL  = "phone"
 DATE_COL   = "send_date"
 TIME_WINDOW = 20  # сек
+WINDOW_DELTA = timedelta(seconds=TIME_WINDOW)
 
 # Регулярки для токенов
 TOKEN_REGEXPS = [
@@ -30,64 +36,109 @@ def extract_tokens(text):
 def ends_complete(text):
     return bool(re.search(r"[\.!?]$", text.strip()))
 
+def make_record(row):
+    return {
+        "phone": row[PHONE_COL].strip(),
+        "date":  datetime.fromisoformat(row[DATE_COL]),
+        "msg":   row[MSG_COL].strip(),
+        "row":   row
+    }
+
 def load_records(path):
     recs = []
-    with open(path, newline='', encoding='utf-8') as f:
-        rdr = csv.DictReader(f, delimiter=SEP, quoting=csv.QUOTE_NONE)
+    with open_rows(path, SEP) as rdr, profiling.stage("load_records") as st:
         for row in rdr:
-            recs.append({
-                "phone": row[PHONE_COL].strip(),
-                "date":  datetime.fromisoformat(row[DATE_COL]),
-                "msg":   row[MSG_COL].strip(),
-                "row":   row
-            })
+            recs.append(make_record(row))
+        st.rows_in = st.rows_out = len(recs)
     return recs
 
-def build_graph(nodes):
-    graph = defaultdict(list)
-    by_phone = defaultdict(list)
-    for i, n in enumerate(nodes):
-        by_phone[n["phone"]].append(i)
-
-    for phone, idxs in by_phone.items():
-        for i in idxs:
-            ti, mi, tok_i = nodes[i]["date"], nodes[i]["msg"], extract_tokens(nodes[i]["msg"])
-            for j in idxs:
-                if j <= i: continue
-                tj, mj = nodes[j]["date"], nodes[j]["msg"]
-                if abs((tj - ti).total_seconds()) > TIME_WINDOW:
-                    continue
-
-                # 1) надёжное слияние по ≥2 токенам
-                tok_j = extract_tokens(mj)
-                if len(tok_i & tok_j) >= 2:
-                    graph[i].append(j)
-                    graph[j].append(i)
-                    continue
-
-                # 2) слияние по незавершённости
-                if not ends_complete(mi) or not ends_complete(mj):
-                    graph[i].append(j)
-                    graph[j].append(i)
-
-    return graph
-
-def find_components(graph, n):
-    seen = [False]*n
-    comps = []
-    for i in range(n):
-        if seen[i]: continue
-        q, comp = deque([i]), []
-        seen[i] = True
-        while q:
-            u = q.popleft()
-            comp.append(u)
-            for v in graph[u]:
-                if not seen[v]:
-                    seen[v] = True
-                    q.append(v)
-        comps.append(comp)
-    return comps
+class PhoneWindow:
+    """
+    Записи одного телефона за последние TIME_WINDOW секунд и индексы по ним.
+    Записи приходят по возрастанию времени; link() возвращает немногих
+    «представителей» окна, объединение с которыми даёт ту же связность, что
+    и проверка всех пар окна:
+      * незавершённая запись связана со всеми записями окна — но записи до
+        предыдущей незавершённой уже связаны между собой (joined), поэтому
+        перебираются только более поздние;
+      * завершённая — со всеми незавершёнными окна, а они уже связаны
+        между собой, так что достаточно последней (last_open);
+      * ≥2 общих токена — значит, общая пара токенов; все записи окна с этой
+        парой уже связаны между собой, достаточно последней (pairs).
+    """
+
+    def __init__(self):
+        self.recent = deque()   # (время, номер записи, порядковый номер у телефона, пары токенов)
+        self.pairs = {}         # пара токенов → (время, номер) последней записи с этой парой
+        self.last_open = None   # (время, номер) последней незавершённой записи
+        self.joined = 0         # записи до этого порядкового номера уже связаны незавершёнными
+        self.count = 0
+
+    def expire(self, horizon):
+        """Убирает записи старше horizon — они уже ни с чем не свяжутся."""
+        while self.recent and self.recent[0][0] < horizon:
+            _, seq, _, pairs = self.recent.popleft()
+            for pair in pairs:
+                last = self.pairs.get(pair)
+                if last is not None and last[1] == seq:
+                    del self.pairs[pair]
+
+    def link(self, seq, t, msg) -> list:
+        """Добавляет запись seq со временем t; возвращает номера записей, с которыми её объединить."""
+        horizon = t - WINDOW_DELTA
+        self.expire(horizon)
+        links = []
+        if not ends_complete(msg):
+            for _, other, order, _ in reversed(self.recent):
+                if order < self.joined:
+                    break
+                links.append(other)
+            self.joined = self.count
+            self.last_open = (t, seq)
+        elif self.last_open is not None and self.last_open[0] >= horizon:
+            links.append(self.last_open[1])
+
+        pairs = list(combinations(sorted(extract_tokens(msg)), 2))
+        for pair in pairs:
+            last = self.pairs.get(pair)
+            if last is not None and last[0] >= horizon:
+                links.append(last[1])
+            self.pairs[pair] = (t, seq)
+        self.recent.append((t, seq, self.count, pairs))
+        self.count += 1
+        return links
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def find_components(nodes):
+    """
+    Компоненты связности фрагментов: списки индексов по возрастанию, сами
+    компоненты — в порядке первого индекса. Связаны записи одного телефона
+    не дальше TIME_WINDOW друг от друга, у которых ≥2 общих токена или хотя
+    бы одна незавершённая. Пары не перебираются: записи идут по времени через
+    PhoneWindow и объединяются (union-find) только с его представителями —
+    O(n log n) даже для одного отправителя, шлющего пачку за пачкой.
+    """
+    parent = list(range(len(nodes)))
+    windows = defaultdict(PhoneWindow)
+    # сортировка устойчивая: при равном времени — порядок файла
+    for i in sorted(range(len(nodes)), key=lambda k: nodes[k]["date"]):
+        n = nodes[i]
+        for other in windows[n["phone"]].link(i, n["date"], n["msg"]):
+            a, b = _find(parent, other), _find(parent, i)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+
+    comps = defaultdict(list)
+    for i in range(len(nodes)):
+        comps[_find(parent, i)].append(i)
+    return list(comps.values())
 
 def merge_component(nodes, comp):
     block = sorted((nodes[i] for i in comp), key=lambda r: r["date"])
@@ -98,48 +149,150 @@ def merge_component(nodes, comp):
         if not re.match(r"^(Sizge|Salemdeme|/t/)", first["msg"]) and re.match(r"^(Sizge|Salemdeme|/t/)", second["msg"]):
             block.reverse()
 
-    # склейка с учётом CODE_START_RX
+    # склейка с учётом CODE_START_RX; части собираются в список и соединяются
+    # один раз, чтобы большая компонента не склеивалась за квадратичное время
     merged_parts = []
     for rec in block:
         text = rec["msg"].strip()
-        if not merged_parts:
-            merged_parts.append(text)
-        else:
-            prev = merged_parts[-1]
-            # если следующий фрагмент — трек/код, сразу прилепляем без пробела
-            if CODE_START_RX.search(text):
-                merged_parts[-1] = prev + text
-            else:
-                # обычная склейка через пробел
-                merged_parts[-1] = prev + " " + text
+        # если следующий фрагмент — трек/код, сразу прилепляем без пробела,
+        # иначе обычная склейка через пробел
+        if merged_parts and not CODE_START_RX.search(text):
+            merged_parts.append(" ")
+        merged_parts.append(text)
 
-    merged_msg = merged_parts[0]
+    merged_msg = "".join(merged_parts)
     out = block[0]["row"].copy()
     out[MSG_COL]  = merged_msg
     out[DATE_COL] = block[-1]["date"].isoformat()
     return out
 
-def main():
-    records = load_records(INPUT_CSV)
-    graph   = build_graph(records)
-    comps   = find_components(graph, len(records))
+def stream_merge(rows):
+    """
+    Потоковое склеивание для входа, упорядоченного по DATE_COL.
+    Держит в памяти только открытые компоненты и окна PhoneWindow активных
+    телефонов: компонента закрывается и отдаётся наружу, как только её
+    последний фрагмент старше текущей записи больше чем на TIME_WINDOW —
+    новых связей у неё уже не будет. Связи те же, что в find_components;
+    внутри компоненты при равном времени сохраняется порядок файла.
+    """
+    parent  = {}                  # номер записи → родитель (union-find по записям открытых компонент)
+    comps   = {}                  # корень → {"phone", "recs", "last"}
+    windows = {}                  # телефон → PhoneWindow
+    queue   = deque()             # (время последнего фрагмента, корень) по возрастанию
+    prev    = None
+
+    def close(root, horizon=None):
+        comp = comps.pop(root)
+        recs = comp["recs"]
+        for rec in recs:
+            del parent[rec["seq"]]
+        window = windows.get(comp["phone"])
+        if horizon is not None and window is not None:
+            # окно телефона больше не нужно, когда в нём не осталось свежих записей
+            window.expire(horizon)
+            if not window.recent:
+                del windows[comp["phone"]]
+        if len(recs) == 1:
+            return recs[0]["row"]
+        recs.sort(key=lambda r: (r["date"], r["seq"]))
+        return merge_component(recs, range(len(recs)))
+
+    for seq, row in enumerate(rows):
+        rec = make_record(row)
+        t = rec["date"]
+        if prev is not None and t < prev:
+            raise ValueError(
+                f"Строка {seq + 2}: {DATE_COL} {t} раньше предыдущей ({prev}); "
+                f"для потокового режима вход должен быть отсортирован по {DATE_COL}"
+            )
+        prev = t
+
+        # 1) закрываем компоненты, до которых окно уже не дотянется
+        horizon = t - WINDOW_DELTA
+        while queue and queue[0][0] < horizon:
+            last, root = queue.popleft()
+            comp = comps.get(root)
+            if comp is not None and comp["last"] == last:
+                yield close(root, horizon)
+
+        # 2) запись — новая компонента; объединяем её с компонентами представителей окна
+        rec["seq"] = seq
+        parent[seq] = seq
+        comps[seq] = {"phone": rec["phone"], "recs": [rec], "last": t}
+        window = windows.get(rec["phone"])
+        if window is None:
+            window = windows[rec["phone"]] = PhoneWindow()
+        for other in window.link(seq, t, rec["msg"]):
+            a, b = _find(parent, other), _find(parent, seq)
+            if a == b:
+                continue
+            if len(comps[a]["recs"]) < len(comps[b]["recs"]):
+                a, b = b, a
+            parent[b] = a  # меньшая компонента вливается в большую
+            comps[a]["recs"].extend(comps.pop(b)["recs"])
+        root = _find(parent, seq)
+        comps[root]["last"] = t
+        queue.append((t, root))
+
+    for last, root in queue:
+        comp = comps.get(root)
+        if comp is not None and comp["last"] == last:
+            yield close(root)
+
+def main_streaming():
+    written = 0
+    with open_rows(INPUT_CSV, SEP) as rdr, \
+            open_output(OUTPUT_CSV) as fout:
+        writer = csv.DictWriter(fout, fieldnames=rdr.fieldnames, delimiter=SEP)
+        writer.writeheader()
+        with profiling.stage("stream_merge") as st:
+            for out in stream_merge(st.count_in(rdr)):
+                writer.writerow(out)
+                written += 1
+            st.rows_out = written
+
+    print(f"✅ Готово — {written} строк в {OUTPUT_CSV}")
+
+def merge_records(records):
+    """Склеивает фрагменты всех записей сразу: компоненты связности → строки."""
+    with profiling.stage("find_components") as st:
+        comps = find_components(records)
+        st.rows_in, st.rows_out = len(records), len(comps)
 
     output = []
-    for comp in comps:
-        if len(comp) == 1:
-            output.append(records[comp[0]]["row"])
-        else:
-            output.append(merge_component(records, comp))
+    with profiling.stage("merge_components") as st:
+        for comp in comps:
+            if len(comp) == 1:
+                output.append(records[comp[0]]["row"])
+            else:
+                output.append(merge_component(records, comp))
+        st.rows_in, st.rows_out = len(comps), len(output)
+    return output
 
-    with open(OUTPUT_CSV, 'w', newline='', encoding='utf-8') as f:
+def main():
+    records = load_records(INPUT_CSV)
+    output  = merge_records(records)
+
+    with open_output(OUTPUT_CSV) as f, profiling.stage("write") as st:
         writer = csv.DictWriter(f,
             fieldnames=records[0]["row"].keys(),
             delimiter=SEP
         )
         writer.writeheader()
         writer.writerows(output)
+        st.rows_in = st.rows_out = len(output)
 
     print(f"✅ Готово — {len(output)} строк в {OUTPUT_CSV}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Склейка многочастных SMS")
+    parser.add_argument("--stream", action="store_true",
+                        help=f"потоковый режим для входа, отсортированного по {DATE_COL}")
+    parser.add_argument("--profile", help="записать JSON-отчёт инструментовки по стадиям")
+    parser.add_argument("--pstats", help="записать дамп cProfile")
+    args = parser.parse_args()
+    with profiling.session(args.profile, args.pstats, "pre_processor"):
+        if args.stream:
+            main_streaming()
+        else:
+            main()
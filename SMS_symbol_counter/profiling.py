@@ -0,0 +1,153 @@
+import cProfile
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# --- Необязательная инструментовка стадий и правил ---
+# По умолчанию выключена: current is None, и горячие функции (dynamic_mask,
+# правила обобщения) работают без замеров. session() включает сбор:
+# время (настенное и процессорное) и строки на входе/выходе по стадиям,
+# вызовы, срабатывания и суммарное время каждого правила.
+# Замеры собираются только в текущем процессе — для разбора по правилам
+# запускайте с --workers 1.
+
+current = None
+
+
+class Stage:
+    """Одна стадия: время и число строк на входе/выходе."""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows_in = None
+        self.rows_out = None
+        self.wall = self.cpu = 0.0
+
+    def count_in(self, rows):
+        """Пропускает rows через себя, считая их в rows_in."""
+        self.rows_in = self.rows_in or 0
+        for row in rows:
+            self.rows_in += 1
+            yield row
+
+    def as_dict(self) -> dict:
+        rows = self.rows_in if self.rows_in is not None else self.rows_out
+        return {
+            "name": self.name,
+            "wall_s": round(self.wall, 6),
+            "cpu_s": round(self.cpu, 6),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "rows_per_s": round(rows / self.wall, 1) if rows and self.wall else None,
+        }
+
+
+class _NullStage(Stage):
+    """Стадия при выключенной инструментовке: ничего не считает."""
+
+    def count_in(self, rows):
+        return rows
+
+
+class Profiler:
+    def __init__(self, script=""):
+        self.script = script
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self.stages = []
+        self.rules = {}   # группа → имя правила → {"calls", "hits", "seconds"}
+        self.info = {}    # прочие сведения (кэши, параметры запуска)
+
+    @contextmanager
+    def stage(self, name):
+        st = Stage(name)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield st
+        finally:
+            st.wall = time.perf_counter() - wall
+            st.cpu = time.process_time() - cpu
+            self.stages.append(st)
+
+    def rule(self, group, name, seconds, hit=True):
+        """Один вызов правила: seconds — сколько он занял, hit — сработало ли."""
+        rec = self.rules.setdefault(group, {}).get(name)
+        if rec is None:
+            rec = self.rules[group][name] = {"calls": 0, "hits": 0, "seconds": 0.0}
+        rec["calls"] += 1
+        rec["hits"] += hit
+        rec["seconds"] += seconds
+
+    def count(self, group, name, n=1):
+        """Срабатывания без замера времени (например, ветки одной альтернации)."""
+        rec = self.rules.setdefault(group, {}).setdefault(name, {"calls": 0, "hits": 0, "seconds": 0.0})
+        rec["hits"] += n
+
+    def report(self) -> dict:
+        rules = {}
+        for group, items in self.rules.items():
+            rows = []
+            for name, rec in sorted(items.items(), key=lambda kv: -kv[1]["seconds"]):
+                calls = rec["calls"]
+                rows.append({
+                    "rule": name,
+                    "calls": calls,
+                    "hits": rec["hits"],
+                    "seconds": round(rec["seconds"], 6),
+                    "us_per_call": round(1e6 * rec["seconds"] / calls, 3) if calls else None,
+                })
+            rules[group] = rows
+        return {
+            "script": self.script,
+            "started": self.started,
+            "pid": os.getpid(),
+            "stages": [st.as_dict() for st in self.stages],
+            "rules": rules,
+            "info": self.info,
+        }
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=1)
+
+
+def stage(name):
+    """Стадия текущего профилировщика или пустая стадия, если он выключен."""
+    if current is None:
+        return _null_stage(name)
+    return current.stage(name)
+
+
+@contextmanager
+def _null_stage(name):
+    yield _NullStage(name)
+
+
+@contextmanager
+def session(report_path=None, pstats_path=None, script=""):
+    """
+    Включает инструментовку на время блока и пишет JSON-отчёт в report_path;
+    pstats_path — дополнительно дамп cProfile (смотреть через pstats/snakeviz).
+    Без обоих путей ничего не делает.
+    """
+    global current
+    if not report_path and not pstats_path:
+        yield None
+        return
+    current = Profiler(script)
+    prof = cProfile.Profile() if pstats_path else None
+    if prof:
+        prof.enable()
+    try:
+        yield current
+    finally:
+        if prof:
+            prof.disable()
+            prof.dump_stats(pstats_path)
+            logging.info(f"Дамп cProfile записан в {pstats_path}")
+        if report_path:
+            current.write(report_path)
+            logging.info(f"Отчёт инструментовки записан в {report_path}")
+        current = None
@@ -0,0 +1,191 @@
+import csv
+import mmap
+import os
+import sys
+from array import array
+
+import xlsx_io
+from io_utils import open_output, pad_to, read_footer, write_footer
+
+# --- Бинарный поколоночный формат отчёта generaliser.py ---
+# Числа хранятся типизированными массивами, Traffic Type — кодами словаря,
+# строки — одним блоком UTF-8 с массивом смещений. Файл читается через mmap:
+# числовые колонки отдаются как memoryview без копирования и без int().
+REPORT_SUFFIX = ".smsr"
+REPORT_VERSION = 1
+
+_MAGIC = b"SMSREPT1"
+
+# Тип каждой известной колонки: "str" — строки, "dict" — строки словарём,
+# остальное — код типа array/memoryview
+COLUMN_TYPES = {
+    "Pattern": "str",
+    "Example": "str",
+    "Total Count": "q",
+    "Length": "i",
+    "SMS Segments": "i",
+    "Traffic Type": "dict",
+    "Total Segments": "q",
+    "Min Length": "i",
+    "Max Length": "i",
+    "Mean Length": "d",
+    "Segments Distribution": "str",
+    "Other Examples": "str",
+    # только в файлах состояния generaliser
+    "Shortest Example": "str",
+    "Samples": "str",
+    "Length Sum": "q",
+}
+
+
+def is_binary_report(path) -> bool:
+    return read_footer(path, _MAGIC) is not None
+
+
+def write_report(rows, columns, path, extra=None):
+    """
+    Записывает строки отчёта (словари с ключами columns) поколоночно.
+    extra — произвольные JSON-метаданные, сохраняются в футере.
+    """
+    data = {}
+    for name in columns:
+        kind = COLUMN_TYPES[name]
+        if kind == "str":
+            data[name] = (array("Q", [0]), bytearray())
+        elif kind == "dict":
+            data[name] = (array("H"), {})
+        else:
+            data[name] = array(kind)
+
+    n = 0
+    for row in rows:
+        n += 1
+        for name in columns:
+            kind, value = COLUMN_TYPES[name], row[name]
+            if kind == "str":
+                offsets, blob = data[name]
+                blob += value.encode("utf-8")
+                offsets.append(len(blob))
+            elif kind == "dict":
+                codes, values = data[name]
+                codes.append(values.setdefault(value, len(values)))
+            else:
+                data[name].append(value)
+
+    meta = {"version": REPORT_VERSION, "byteorder": sys.byteorder, "rows": n, "columns": [],
+            "extra": extra or {}}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as out:
+        for name in columns:
+            kind = COLUMN_TYPES[name]
+            col = {"name": name, "type": kind}
+            pad_to(out)
+            if kind == "str":
+                offsets, blob = data[name]
+                col["offsets_at"] = out.tell()
+                offsets.tofile(out)
+                col["data_at"] = out.tell()
+                out.write(blob)
+            elif kind == "dict":
+                codes, values = data[name]
+                col["at"] = out.tell()
+                codes.tofile(out)
+                col["values"] = list(values)
+            else:
+                col["at"] = out.tell()
+                data[name].tofile(out)
+            meta["columns"].append(col)
+        write_footer(out, meta, _MAGIC)
+    os.replace(tmp_path, path)
+
+
+class ReportFile:
+    """
+    Бинарный отчёт, отображённый в память. column() — memoryview числовой
+    колонки или кодов словаря, rows() — строки как у csv.DictReader, но с
+    числами вместо строк.
+    """
+
+    def __init__(self, path):
+        self.meta = read_footer(path, _MAGIC)
+        if self.meta is None:
+            raise Exception(f"{path} — не бинарный отчёт generaliser")
+        if self.meta["version"] != REPORT_VERSION or self.meta["byteorder"] != sys.byteorder:
+            raise Exception(f"{path}: неподдерживаемая версия или порядок байт")
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mm)
+        self._views = []
+        self.columns = {col["name"]: col for col in self.meta["columns"]}
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    @property
+    def extra(self) -> dict:
+        return self.meta.get("extra", {})
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._view.release()
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _cast(self, at, fmt, count):
+        size = array(fmt).itemsize
+        view = self._view[at:at + size * count].cast(fmt)
+        self._views.append(view)
+        return view
+
+    def column(self, name):
+        col = self.columns[name]
+        if col["type"] == "str":
+            raise TypeError(f"Колонка '{name}' строковая — используйте strings()")
+        fmt = "H" if col["type"] == "dict" else col["type"]
+        return self._cast(col["at"], fmt, len(self))
+
+    def values(self, name):
+        """Словарь значений колонки типа dict: код → строка."""
+        return self.columns[name]["values"]
+
+    def strings(self, name):
+        col = self.columns[name]
+        offsets = self._cast(col["offsets_at"], "Q", len(self) + 1)
+        base, view = col["data_at"], self._view
+        for i in range(len(self)):
+            yield str(view[base + offsets[i]:base + offsets[i + 1]], "utf-8")
+
+    def rows(self):
+        names = list(self.columns)
+        iters = []
+        for name in names:
+            kind = self.columns[name]["type"]
+            if kind == "str":
+                iters.append(self.strings(name))
+            elif kind == "dict":
+                iters.append(map(self.values(name).__getitem__, self.column(name)))
+            else:
+                iters.append(iter(self.column(name)))
+        for values in zip(*iters):
+            yield dict(zip(names, values))
+
+
+def export_csv(path, output_file):
+    """Выгружает бинарный отчёт в CSV того же вида, что пишет generaliser (.gz/.bz2/.xz — сжатым)."""
+    with ReportFile(path) as report, open_output(output_file) as f:
+        w = csv.DictWriter(f, fieldnames=list(report.columns))
+        w.writeheader()
+        w.writerows(report.rows())
+
+
+def export_xlsx(path, output_file):
+    """Выгружает бинарный отчёт в .xlsx (при переполнении листа — на следующие листы)."""
+    with ReportFile(path) as report:
+        xlsx_io.write_dicts(report.rows(), list(report.columns), output_file)
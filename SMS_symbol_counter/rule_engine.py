@@ -0,0 +1,292 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+import profiling
+
+# --- Правила «супер-обобщения», загружаемые из файла ---
+# Особые правила (specials) и общие правила (general) лежат в одном JSON-файле
+# с номером версии. Проверенный и проиндексированный набор отмечается в кэше на
+# диске по хэшу файла, поэтому запуск не зависит от числа правил.
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules", "generalize_rules.json")
+RULES_VERSION = 1       # версия формата файла правил, которую понимает движок
+CACHE_FORMAT = 2        # меняется при изменении структуры кэша — старые кэши игнорируются
+SPECIALS_KEY_LEN = 12   # длина ключа префиксного индекса
+
+_REGEX_META = set('.^$*+?{}[]|()')
+_QUANTIFIERS = set('*?{')
+
+
+def _has_top_level_alternation(rx: str) -> bool:
+    """Есть ли в регулярке «|» вне групп и классов символов."""
+    depth, in_class, i = 0, False, 0
+    while i < len(rx):
+        ch = rx[i]
+        if ch == '\\':
+            i += 2
+            continue
+        if in_class:
+            in_class = ch != ']'
+        elif ch == '[':
+            in_class = True
+        elif ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif ch == '|' and depth == 0:
+            return True
+        i += 1
+    return False
+
+
+def literal_prefix(rx: str) -> str:
+    """
+    Возвращает литеральное начало регулярки: строку, с которой обязан
+    начинаться любой текст, целиком совпадающий с rx. Пустая строка —
+    если такого начала нет.
+    """
+    if _has_top_level_alternation(rx):
+        return ""
+    prefix, i = [], 0
+    while i < len(rx):
+        ch = rx[i]
+        if ch == '\\':
+            nxt = rx[i + 1:i + 2]
+            if not nxt or nxt.isalnum():  # \d, \s, \1 … — уже не литерал
+                break
+            ch, step = nxt, 2
+        elif ch in _REGEX_META:
+            break
+        else:
+            step = 1
+        quant = rx[i + step:i + step + 1]
+        # символ с квантификатором может отсутствовать — в префикс не берём
+        if quant in _QUANTIFIERS:
+            break
+        prefix.append(ch)
+        if quant == '+':
+            break
+        i += step
+    return "".join(prefix)
+
+
+class SpecialsMatcher:
+    """
+    Скомпилированный диспетчер особых правил {регулярка: замена}.
+    Правила раскладываются по литеральному началу регулярки, поэтому для
+    паттерна проверяются только те правила, чей префикс с ним совпадает
+    (плюс правила без префикса). Порядок правил сохраняется: побеждает
+    первое совпавшее. Регулярка компилируется при первой проверке.
+    """
+
+    def __init__(self, specials: dict, key_len: int = SPECIALS_KEY_LEN, index=None):
+        self.sources = list(specials)
+        self.replacements = list(specials.values())
+        self.compiled = [None] * len(self.sources)
+        if index is not None:  # готовый индекс из дискового кэша
+            self.buckets, self.unindexed = index
+        else:
+            self.buckets = {}    # ключ префикса → номера правил
+            self.unindexed = []  # правила без литерального начала
+            for idx, rx in enumerate(self.sources):
+                key = literal_prefix(rx)[:key_len]
+                if key:
+                    self.buckets.setdefault(key, []).append(idx)
+                else:
+                    self.unindexed.append(idx)
+        self.key_lengths = sorted({len(k) for k in self.buckets})
+
+    @property
+    def index(self):
+        """(ключ префикса → номера правил, номера правил без префикса) — для дискового кэша."""
+        return self.buckets, self.unindexed
+
+    def candidates(self, pat: str) -> list:
+        """Номера правил, которые в принципе могут совпасть с pat, по порядку."""
+        found = list(self.unindexed)
+        for n in self.key_lengths:
+            found.extend(self.buckets.get(pat[:n], ()))
+        if len(found) > 1:
+            found.sort()
+        return found
+
+    def regex(self, idx):
+        rx = self.compiled[idx]
+        if rx is None:
+            rx = self.compiled[idx] = re.compile(self.sources[idx])
+        return rx
+
+    def match(self, pat: str):
+        """Возвращает замену первого совпавшего правила или None."""
+        for idx in self.candidates(pat):
+            if self.regex(idx).fullmatch(pat):
+                return self.replacements[idx]
+        return None
+
+    def match_profiled(self, pat: str, prof):
+        """match с замером каждой проверенной регулярки."""
+        clock = time.perf_counter
+        for idx in self.candidates(pat):
+            rx = self.regex(idx)
+            t = clock()
+            hit = rx.fullmatch(pat) is not None
+            prof.rule("specials", self.sources[idx], clock() - t, hit)
+            if hit:
+                return self.replacements[idx]
+        return None
+
+
+class RuleSet:
+    """Особые правила (целиком заменяют паттерн) и общие правила (re.sub по порядку)."""
+
+    def __init__(self, specials: dict, general: list, digest: str = "", index=None):
+        self.specials = SpecialsMatcher(specials, index=index)
+        self.general = general    # [(регулярка-источник, замена)]
+        self.digest = digest
+        self._compiled = None
+
+    def generalize(self, pat: str) -> str:
+        """
+        Применяет правила "супер-обобщения" к уже маскированному паттерну.
+        Сначала проверяет на "особые" случаи, затем применяет общие правила.
+        """
+        if profiling.current is not None:
+            return self._generalize_profiled(pat, profiling.current)
+        replacement = self.specials.match(pat)
+        if replacement is not None:
+            return replacement
+        for rx, repl in self._general_compiled():
+            pat = rx.sub(repl, pat)
+        return pat.strip()
+
+    def compile_all(self):
+        """Компилирует все правила сразу — для долгоживущих процессов, чтобы первый запрос не ждал."""
+        for idx in range(len(self.specials.sources)):
+            self.specials.regex(idx)
+        self._general_compiled()
+
+    def _general_compiled(self):
+        if self._compiled is None:
+            self._compiled = [(re.compile(rx), repl) for rx, repl in self.general]
+        return self._compiled
+
+    def _generalize_profiled(self, pat: str, prof) -> str:
+        """generalize с замером каждого особого и общего правила."""
+        clock = time.perf_counter
+        begin = clock()
+        replacement = self.specials.match_profiled(pat, prof)
+        if replacement is None:
+            for rx, repl in self._general_compiled():
+                t = clock()
+                pat, n = rx.subn(repl, pat)
+                prof.rule("general", rx.pattern, clock() - t, n > 0)
+            replacement = pat.strip()
+        prof.rule("functions", "super_generalize", clock() - begin)
+        return replacement
+
+
+def _read_rules(data: dict):
+    """Особые и общие правила из разобранного JSON-файла: ({регулярка: замена}, [(регулярка, замена)])."""
+    version = data.get("version")
+    if version != RULES_VERSION:
+        raise Exception(f"Неподдерживаемая версия файла правил: {version} (ожидается {RULES_VERSION})")
+    specials = {rule["pattern"]: rule["replacement"] for rule in data.get("specials", [])}
+    general = [(rule["pattern"], rule["replacement"]) for rule in data.get("general", [])]
+    return specials, general
+
+
+def parse_rules(data: dict, digest: str = "") -> RuleSet:
+    specials, general = _read_rules(data)
+    # Ошибки в регулярках видны сразу при загрузке, а не на первом подходящем паттерне
+    for rx in list(specials) + [rx for rx, _ in general]:
+        try:
+            re.compile(rx)
+        except re.error as e:
+            raise Exception(f"Ошибка в правиле {rx!r}: {e}")
+    return RuleSet(specials, general, digest)
+
+
+def _cache_path(path, digest):
+    folder = os.path.join(os.path.dirname(os.path.abspath(path)), "__pycache__")
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(folder, f"{name}.{digest[:16]}.rules.json")
+
+
+def _read_cache(cache, digest, n_specials):
+    """
+    Индекс особых правил из кэша или None, если кэша нет, он от другого
+    файла или испорчен. В кэше только данные (JSON), поэтому чтение чужого
+    файла не может выполнить код; индекс проверяется на полноту.
+    """
+    try:
+        with open(cache, encoding="utf-8") as f:
+            data = json.load(f)
+        if data["format"] != CACHE_FORMAT or data["digest"] != digest:
+            return None
+        buckets, unindexed = data["buckets"], data["unindexed"]
+        numbers = list(unindexed)
+        for key, idxs in buckets.items():
+            if not key or len(key) > SPECIALS_KEY_LEN:
+                return None
+            numbers.extend(idxs)
+        # каждое правило ровно в одном месте индекса, номера идут по порядку
+        if sorted(numbers) != list(range(n_specials)) or any(
+                idxs != sorted(idxs) for idxs in [unindexed, *buckets.values()]):
+            return None
+        return buckets, unindexed
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None  # нет или повреждён — просто пересобираем
+
+
+def load_rules(path=None, use_cache=True) -> RuleSet:
+    """
+    Загружает правила из JSON-файла. Правила всегда берутся из самого файла;
+    в __pycache__ рядом с ним под хэшем содержимого сохраняется только индекс
+    особых правил (JSON): пока файл не изменился, следующий запуск не
+    проверяет и не индексирует регулярки заново.
+    """
+    path = path or RULES_FILE
+    with open(path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw + bytes([CACHE_FORMAT])).hexdigest()
+    data = json.loads(raw.decode("utf-8"))
+    cache = _cache_path(path, digest)
+    if use_cache:
+        specials, general = _read_rules(data)
+        index = _read_cache(cache, digest, len(specials))
+        if index is not None:
+            return RuleSet(specials, general, digest, index)
+
+    rules = parse_rules(data, digest)
+    if use_cache:
+        buckets, unindexed = rules.specials.index
+        try:
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+            tmp = cache + f".{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"format": CACHE_FORMAT, "digest": digest,
+                           "buckets": buckets, "unindexed": unindexed}, f, ensure_ascii=False)
+            os.replace(tmp, cache)
+        except OSError:
+            pass  # каталог только для чтения — работаем без кэша
+    return rules
+
+
+_rules = None
+
+
+def get_rules() -> RuleSet:
+    """Общий для всех модулей набор правил из RULES_FILE, загружается при первом обращении."""
+    global _rules
+    if _rules is None:
+        _rules = load_rules(RULES_FILE)
+    return _rules
+
+
+def set_rules_file(path):
+    """Переключает RULES_FILE; набор перечитается при следующем get_rules()."""
+    global RULES_FILE, _rules
+    RULES_FILE = path
+    _rules = None
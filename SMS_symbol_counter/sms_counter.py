@@ -0,0 +1,265 @@
+import argparse
+import json
+import logging
+
+import aggregator
+import counter
+import finder
+import generaliser
+import pre_processor
+import profiling
+import report_store
+import rule_engine
+import top_msgs_counter
+import xlsx_io
+from io_utils import open_rows
+
+# Значения по умолчанию; переопределяются файлом --config и параметрами командной строки
+DEFAULTS = {
+    "sep": '\t',
+    "msg_col": "message",
+    "type_col": "traffic_type",
+    "phone_col": "phone",
+    "date_col": "send_date",
+}
+
+# Какие константы модулей задаёт каждый ключ конфигурации
+CONFIG_TARGETS = {
+    "sep": [(generaliser, "SEP"), (pre_processor, "SEP"), (aggregator, "SEP"),
+            (top_msgs_counter, "SEP"), (finder, "SEP"), (counter, "SEP")],
+    "msg_col": [(generaliser, "MSG_COL"), (pre_processor, "MSG_COL"), (aggregator, "MSG_COL"),
+                (top_msgs_counter, "MSG_COL"), (finder, "MESSAGE_COLUMN")],
+    "type_col": [(generaliser, "TYPE_COL"), (top_msgs_counter, "TYPE_COL"), (counter, "TYPE_COL")],
+    "phone_col": [(pre_processor, "PHONE_COL"), (aggregator, "PHONE_COL")],
+    "date_col": [(pre_processor, "DATE_COL")],
+}
+
+
+def load_config(path) -> dict:
+    cfg = dict(DEFAULTS)
+    if path:
+        with open(path, encoding="utf-8") as f:
+            cfg.update(json.load(f))
+    return cfg
+
+
+def apply_config(cfg: dict):
+    """Проставляет разделитель и имена колонок во все модули конвейера."""
+    for key, targets in CONFIG_TARGETS.items():
+        for module, attr in targets:
+            setattr(module, attr, cfg[key])
+    if cfg.get("rules"):
+        rule_engine.set_rules_file(cfg["rules"])
+
+
+def option(args, cfg, name):
+    """
+    Параметр командной строки, а если его нет — значение из конфигурации:
+    сначала из секции команды ({"generalise": {"input": …}}), затем общее.
+    """
+    value = getattr(args, name, None)
+    if value is None:
+        value = cfg.get(args.command, {}).get(name, cfg.get(name))
+    if value is None:
+        raise SystemExit(f"Не задан параметр --{name.replace('_', '-')} (ни в командной строке, ни в конфигурации)")
+    return value
+
+
+# ----------------------------------------------------------------------------
+def cmd_pre_process(args, cfg):
+    pre_processor.INPUT_CSV = option(args, cfg, "input")
+    pre_processor.OUTPUT_CSV = option(args, cfg, "output")
+    if args.stream:
+        pre_processor.main_streaming()
+    else:
+        pre_processor.main()
+
+
+def cmd_generalise(args, cfg):
+    input_file = option(args, cfg, "input")
+    output_file = option(args, cfg, "output")
+    generaliser.BILLED_SEGMENTS = generaliser.BILLED_SEGMENTS or args.billed_segments
+    if args.state:
+        stats = generaliser.update_state(args.state, [input_file], args.workers)
+    else:
+        stats = generaliser.collect(input_file, args.workers)
+    generaliser.write_report(stats, output_file)
+    logging.info(f"Отчёт generaliser записан в {output_file}")
+    logging.info(generaliser.generalize.describe("Кэш super_generalize"))
+
+
+def cmd_rollup(args, cfg):
+    generaliser.BILLED_SEGMENTS = generaliser.BILLED_SEGMENTS or args.billed_segments
+    output_file = option(args, cfg, "output")
+    stats = generaliser.rollup_states(args.states, output_file)
+    if args.report:
+        generaliser.write_report(stats, args.report)
+    logging.info(f"Сводка {len(args.states)} состояний записана в {output_file}")
+
+
+def cmd_aggregate(args, cfg):
+    agg = aggregator.aggregate_patterns(option(args, cfg, "input"), args.workers)
+    if args.cluster is not None:
+        agg = aggregator.cluster_stage(agg, args.cluster, args.clusters_report)
+    aggregator.write_output(agg, option(args, cfg, "output"), args.limit)
+
+
+def cmd_top(args, cfg):
+    top_msgs_counter.CSV_COMPRESSION = args.compress
+    top_msgs_counter.main(option(args, cfg, "input"), option(args, cfg, "output"), args.csv_prefix,
+                          approx=args.approx or None, groups_file=args.groups)
+
+
+def cmd_export(args, cfg):
+    output_file = option(args, cfg, "output")
+    if xlsx_io.is_xlsx(output_file):
+        report_store.export_xlsx(option(args, cfg, "input"), output_file)
+    else:
+        report_store.export_csv(option(args, cfg, "input"), output_file)
+
+
+def cmd_find(args, cfg):
+    patterns = list(args.pattern or [])
+    if args.patterns_file:
+        patterns += finder.load_patterns(args.patterns_file)
+    if not patterns:
+        raise SystemExit("Не заданы искомые строки: --pattern или --patterns-file")
+    finder.find_exact_patterns(option(args, cfg, "input"), patterns,
+                               ignore_case=args.ignore_case, workers=args.workers,
+                               use_index=args.index)
+
+
+def cmd_count(args, cfg):
+    input_file = option(args, cfg, "input")
+    if args.quoted:
+        total = counter.count_rows(input_file, cfg["sep"])
+    else:
+        total = counter.count_rows_fast(input_file)
+    print(f"📦 Всего сообщений: {total}")
+    if args.by_type:
+        counts = counter.count_by_type(input_file, cfg["sep"], cfg["type_col"])
+        for traffic, n in sorted(counts.items(), key=lambda kv: -kv[1]):
+            print(f"  {traffic or 'Нет типа'}: {n}")
+
+
+def cmd_pipeline(args, cfg):
+    """
+    pre-process → generalise → aggregate за один проход по входному файлу:
+    строки передаются между стадиями в памяти, без промежуточных CSV.
+    """
+    input_file = option(args, cfg, "input")
+    output_file = option(args, cfg, "output")
+    generaliser.BILLED_SEGMENTS = generaliser.BILLED_SEGMENTS or args.billed_segments
+
+    with open_rows(input_file, cfg["sep"]) as rows:
+        if args.skip_pre_process:
+            pass
+        elif args.stream:
+            rows = pre_processor.stream_merge(rows)
+        else:
+            rows = pre_processor.merge_records([pre_processor.make_record(r) for r in rows])
+        # в потоковом режиме стадия включает чтение и склейку
+        with profiling.stage("generalise") as st:
+            stats = generaliser.update_stats(generaliser.new_stats(), st.count_in(rows))
+            st.rows_out = len(stats)
+
+    if args.report:
+        generaliser.write_report(stats, args.report)
+        logging.info(f"Промежуточный отчёт generaliser записан в {args.report}")
+    # статистика уже в памяти: паттерны для параллельного обобщения берём из её ключей
+    patterns = dict.fromkeys(pat for pat, _ in stats) if args.workers > 1 else None
+    agg = aggregator.aggregate_rows(generaliser.report_rows(stats), args.workers, patterns)
+    if args.cluster is not None:
+        agg = aggregator.cluster_stage(agg, args.cluster, args.clusters_report)
+    aggregator.write_output(agg, output_file, args.limit)
+    logging.info(generaliser.generalize.describe("Кэш super_generalize"))
+
+
+# ----------------------------------------------------------------------------
+def build_parser():
+    parser = argparse.ArgumentParser(prog="sms_counter", description="Анализ и обобщение SMS-шаблонов")
+    parser.add_argument("--config", help="JSON-файл с параметрами (sep, msg_col, type_col, input, output …)")
+    parser.add_argument("--sep", help="разделитель колонок входного файла")
+    parser.add_argument("--rules", help="JSON-файл правил обобщения (по умолчанию rules/generalize_rules.json)")
+    parser.add_argument("--profile", help="записать JSON-отчёт инструментовки (стадии, правила, кэши)")
+    parser.add_argument("--pstats", help="записать дамп cProfile")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add(name, func, help_text, output=True, input=True):
+        p = sub.add_parser(name, help=help_text)
+        if input:
+            p.add_argument("--input", help="входной файл")
+        if output:
+            p.add_argument("--output", help="выходной файл")
+        p.set_defaults(func=func)
+        return p
+
+    p = add("pre-process", cmd_pre_process, "склеить многочастные SMS")
+    p.add_argument("--stream", action="store_true", help="потоковый режим (вход отсортирован по дате)")
+
+    p = add("generalise", cmd_generalise, "обобщить сообщения в паттерны")
+    p.add_argument("--workers", type=int, default=1, help="число процессов")
+    p.add_argument("--billed-segments", action="store_true", help="колонка Total Segments")
+    p.add_argument("--state", help="файл состояния: учитывать только новые файлы/дописанные строки")
+
+    p = add("rollup", cmd_rollup, "свести файлы состояний generaliser в один", input=False)
+    p.add_argument("--states", nargs="+", required=True, help="дневные (или недельные) состояния")
+    p.add_argument("--report", help="дополнительно записать отчёт generaliser по сводке")
+    p.add_argument("--billed-segments", action="store_true", help="колонка Total Segments в --report")
+
+    p = add("aggregate", cmd_aggregate, "агрегировать отчёт generaliser")
+    p.add_argument("--workers", type=int, default=1, help="число процессов для обобщения")
+    p.add_argument("--limit", type=int, help="записать только N самых частых паттернов")
+    p.add_argument("--cluster", type=float, metavar="THRESHOLD",
+                   help="склеить почти одинаковые паттерны с похожестью от THRESHOLD (0–1)")
+    p.add_argument("--clusters-report", default=aggregator.CLUSTERS_OUTPUT, help="куда записать состав кластеров")
+
+    p = add("top", cmd_top, "топ сообщений (markdown + CSV)")
+    p.add_argument("--csv-prefix", default=top_msgs_counter.OUTPUT_CSV_PREFIX, help="префикс CSV-частей")
+    p.add_argument("--approx", action="store_true", help="приближённый топ с ограниченной памятью")
+    p.add_argument("--groups", help="JSON с правилами группировки сообщений")
+    p.add_argument("--compress", choices=["gz", "bz2", "xz"], help="сжимать CSV-части")
+
+    add("export", cmd_export, "выгрузить бинарный отчёт generaliser (.smsr) в CSV или .xlsx")
+
+    p = add("find", cmd_find, "найти сообщения по подстрокам", output=False)
+    p.add_argument("--pattern", action="append", help="искомая подстрока (можно несколько раз)")
+    p.add_argument("--patterns-file", help="файл с подстроками, по одной в строке; префикс re: — регулярное выражение")
+    p.add_argument("--ignore-case", action="store_true", help="без учёта регистра")
+    p.add_argument("--workers", type=int, default=1, help="число процессов")
+    p.add_argument("--index", action="store_true",
+                   help="искать по триграммному индексу рядом с файлом (строится при первом запуске)")
+
+    p = add("count", cmd_count, "посчитать строки", output=False)
+    p.add_argument("--quoted", action="store_true", help="поля в кавычках с переводами строк — считать через csv")
+    p.add_argument("--by-type", action="store_true", help="разбивка по типу трафика")
+
+    p = add("pipeline", cmd_pipeline, "pre-process → generalise → aggregate за один проход")
+    p.add_argument("--skip-pre-process", action="store_true", help="не склеивать фрагменты")
+    p.add_argument("--stream", action="store_true", help="потоковая склейка (вход отсортирован по дате)")
+    p.add_argument("--report", help="дополнительно записать отчёт generaliser в этот файл")
+    p.add_argument("--billed-segments", action="store_true", help="колонка Total Segments")
+    p.add_argument("--workers", type=int, default=1, help="число процессов для агрегации")
+    p.add_argument("--limit", type=int, help="записать только N самых частых паттернов")
+    p.add_argument("--cluster", type=float, metavar="THRESHOLD",
+                   help="склеить почти одинаковые паттерны с похожестью от THRESHOLD (0–1)")
+    p.add_argument("--clusters-report", default=aggregator.CLUSTERS_OUTPUT, help="куда записать состав кластеров")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    cfg = load_config(args.config)
+    if args.sep is not None:
+        cfg["sep"] = args.sep
+    if args.rules is not None:
+        cfg["rules"] = args.rules
+    apply_config(cfg)
+    with profiling.session(args.profile, args.pstats, args.command) as prof:
+        args.func(args, cfg)
+        if prof:
+            prof.info["cache_super_generalize"] = generaliser.generalize.stats()
+
+
+if __name__ == "__main__":
+    main()
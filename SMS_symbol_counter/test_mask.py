@@ -0,0 +1,32 @@
+import random
+import unittest
+
+from bench_mask import EDGE_CASES, make_corpus, make_fuzz, reference_dynamic_mask
+from pattern_utils import dynamic_mask
+
+# Выборка меньше, чем в bench_mask.py, чтобы тест шёл секунды; seed фиксирован
+SEED = 20250501
+N_CORPUS = 5_000
+N_FUZZ = 20_000
+
+
+class DynamicMaskEquivalenceTest(unittest.TestCase):
+    """Однопроходная маскировка (_MASK_RX, _WORD_RX) совпадает с прежней цепочкой re.sub."""
+
+    def assert_same(self, messages):
+        for msg in messages:
+            with self.subTest(msg=msg):
+                self.assertEqual(dynamic_mask(msg), reference_dynamic_mask(msg))
+
+    def test_edge_cases(self):
+        self.assert_same(EDGE_CASES)
+
+    def test_corpus(self):
+        self.assert_same(make_corpus(N_CORPUS, random.Random(SEED)))
+
+    def test_fuzz(self):
+        self.assert_same(make_fuzz(N_FUZZ, random.Random(SEED)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import random
+import unittest
+
+import pattern_utils
+from pattern_utils import (GSM7, GSM7_EXT, GSM7_LIMITS, UCS2_LIMITS, compute_segments, compute_segments_batch,
+                           compute_segments_vectorized, segment_columns, segments_by_traffic_type)
+
+SEED = 20250501
+N_RANDOM = 20_000
+
+# Куски, из которых собираются случайные сообщения: GSM-7, таблица расширения, кириллица, эмодзи
+ALPHABETS = [GSM7, GSM7 + GSM7_EXT, GSM7 + "жЖқҚ", GSM7 + GSM7_EXT + "😀🚀", "€{}[]~|^\\"]
+
+
+def reference_segments(text: str):
+    """Посимвольный подсчёт «в лоб»: цена каждого символа и раскладка по частям без разрыва символа."""
+    if all(ch in GSM7 or ch in GSM7_EXT for ch in text):
+        costs = [2 if ch in GSM7_EXT else 1 for ch in text]
+        limit, block = GSM7_LIMITS
+    else:
+        costs = [2 if ord(ch) > 0xFFFF else 1 for ch in text]
+        limit, block = UCS2_LIMITS
+    length = sum(costs)
+    if length <= limit:
+        return length, 1
+    segs, used = 1, 0
+    for cost in costs:
+        if used + cost > block:
+            segs, used = segs + 1, 0
+        used += cost
+    return length, segs
+
+
+def make_texts(n, rnd):
+    texts = []
+    for _ in range(n):
+        alphabet = rnd.choice(ALPHABETS)
+        # длины вокруг границ одной и нескольких частей
+        size = rnd.choice([rnd.randint(0, 400), rnd.randint(60, 80), rnd.randint(150, 170), rnd.randint(300, 310)])
+        texts.append("".join(rnd.choices(alphabet, k=size)))
+    return texts
+
+
+class ComputeSegmentsTest(unittest.TestCase):
+    def test_matches_reference(self):
+        for text in make_texts(N_RANDOM, random.Random(SEED)):
+            with self.subTest(text=text):
+                self.assertEqual(compute_segments(text), reference_segments(text))
+
+    def test_known_values(self):
+        self.assertEqual(compute_segments(""), (0, 1))
+        self.assertEqual(compute_segments("a" * 160), (160, 1))
+        self.assertEqual(compute_segments("a" * 161), (161, 2))
+        self.assertEqual(compute_segments("€" * 80), (160, 1))
+        # символ расширения не разрывается между частями: 152 септета + «€» не влезают в 153
+        self.assertEqual(compute_segments("a" * 152 + "€" + "a" * 10), (164, 2))
+        self.assertEqual(compute_segments("a" * 152 + "€" * 5), (162, 2))
+        self.assertEqual(compute_segments("ж" * 70), (70, 1))
+        self.assertEqual(compute_segments("😀" * 35), (70, 1))
+        self.assertEqual(compute_segments("ж" * 66 + "😀" * 3), (72, 2))
+
+    def test_batch(self):
+        texts = make_texts(1_000, random.Random(SEED))
+        self.assertEqual(compute_segments_batch(texts), [compute_segments(t) for t in texts])
+        self.assertEqual(compute_segments_batch(iter(texts[:10])), [compute_segments(t) for t in texts[:10]])
+        self.assertEqual(compute_segments_batch([]), [])
+
+
+class ColumnSegmentsTest(unittest.TestCase):
+    """Колоночные варианты (NumPy и без него) совпадают с compute_segments."""
+
+    def setUp(self):
+        self.texts = make_texts(N_RANDOM, random.Random(SEED + 1)) + ["", "\0", "a\0b", "😀", "€" * 200]
+
+    @unittest.skipIf(pattern_utils.np is None, "numpy не установлен")
+    def test_vectorized(self):
+        lengths, is_gsm7, segments = compute_segments_vectorized(self.texts)
+        self.assertEqual(list(zip(lengths.tolist(), segments.tolist())), compute_segments_batch(self.texts))
+        self.assertEqual(is_gsm7.tolist(), [all(ch in GSM7 or ch in GSM7_EXT for ch in t) for t in self.texts])
+
+    def test_segment_columns_without_numpy(self):
+        expected = segment_columns(self.texts)
+        np, pattern_utils.np = pattern_utils.np, None
+        try:
+            self.assertEqual(segment_columns(self.texts), expected)
+        finally:
+            pattern_utils.np = np
+        self.assertEqual(list(zip(*expected)), compute_segments_batch(self.texts))
+
+    def test_segments_by_traffic_type(self):
+        keys = [("p", "SERVICE"), ("q", "ADS")] * (len(self.texts) // 2) + [("p", "SERVICE")] * (len(self.texts) % 2)
+        expected = {}
+        for key, (_, segs) in zip(keys, compute_segments_batch(self.texts)):
+            expected[key] = expected.get(key, 0) + segs
+        self.assertEqual(segments_by_traffic_type(self.texts, keys), expected)
+        self.assertEqual(segments_by_traffic_type(self.texts, keys, segment_columns(self.texts)[1]), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
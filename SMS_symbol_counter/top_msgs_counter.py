@@ -1,8 +1,15 @@
+import argparse
 import csv
+import heapq
+import json
 import re
 import logging
 from collections import Counter
 
+import profiling
+import xlsx_io
+from io_utils import open_output, open_text
+
 # Логирование
 logging.basicConfig(
     level=logging.INFO,
@@ -15,9 +22,15 @@ INPUT_FILE = "csv/in/2025-05-01_2025-05-31(1).csv"
 OUTPUT_MD = "top_patterns.md"
 OUTPUT_CSV_PREFIX = "patterns_part"
 SEP = '\t'
+MSG_COL = "message"
+TYPE_COL = "traffic_type"
 MIN_LEN = 2
 TOP_N = 200
 MAX_ROWS_PER_FILE = 650_000
+CSV_COMPRESSION = None  # "gz", "bz2" или "xz" — писать CSV-части сжатыми
+APPROX = False       # приближённый топ (Space-Saving) с памятью O(TOP_N) вместо точного Counter
+SKETCH_FACTOR = 50   # ячеек Space-Saving на одну позицию топа
+GROUPS_FILE = None   # JSON с правилами группировки вместо PATTERNS / GROUP_TEXT
 
 # Регулярки для шаблонов
 PATTERNS = {
@@ -30,23 +43,160 @@ PATTERNS = {
 def clean_message(raw: str) -> str:
     return re.split(r"\d{4}-\d{2}-\d{2}", raw, maxsplit=1)[0].strip()
 
+# Во что сворачивается сообщение, совпавшее с шаблоном
+GROUP_TEXT = {
+    "Sizdin belsendiru kody": "Sizdin belsendiru kody / Vash kod aktivatsii:<код>",
+    "Tekseru kody": "Tekseru kody/Kod proverki:<код>",
+    "Kod posylki": "<код>KZ.Kod posylki -. Srok hranenia 14 dney. Uznat dopolnitelnuyu informaciu mozhete na post.kz.",
+}
+
+def load_groups(path):
+    """
+    Правила группировки из JSON-файла:
+    [{"label": "...", "regex": "...", "text": "...", "ignore_case": true}, ...].
+    Правила проверяются в порядке файла; "text" — во что свернуть сообщение.
+    """
+    with open(path, encoding="utf-8") as f:
+        rules = json.load(f)
+    patterns, texts = {}, {}
+    for rule in rules:
+        flags = re.IGNORECASE if rule.get("ignore_case", True) else 0
+        try:
+            patterns[rule["label"]] = re.compile(rule["regex"], flags)
+        except re.error as e:
+            raise Exception(f"Ошибка в правиле группировки «{rule['label']}» ({rule['regex']!r}): {e}")
+        texts[rule["label"]] = rule["text"]
+    return patterns, texts
+
 # Группировка
+_INLINE_FLAGS_RX = re.compile(r"\(\?[aiLmsux]+\)")  # (?i), (?s) … — допустимы только в начале всей регулярки
+_NUMBERED_REF_RX = re.compile(r"\\[1-9]|\(\?\(\d")    # \1, (?(1)…) — в альтернации номера групп сместятся
+_BRANCH_NAME_RX = re.compile(r"g\d+")                 # имена веток альтернации
+
+def separate_reason(regex):
+    """
+    Почему шаблон нельзя встроить веткой в общую альтернацию Grouper
+    (None — можно): такой шаблон проверяется отдельно своей регуляркой.
+    """
+    if regex.flags & ~(re.IGNORECASE | re.UNICODE):
+        return "флаги кроме IGNORECASE"
+    if _INLINE_FLAGS_RX.search(regex.pattern):
+        return "встроенные флаги вроде (?i)"
+    if regex.groups and _NUMBERED_REF_RX.search(regex.pattern):
+        return "ссылки на группы по номеру"
+    if any(_BRANCH_NAME_RX.fullmatch(name) for name in regex.groupindex):
+        return "имя группы совпадает с именем ветки"
+    return None
+
+class Grouper:
+    """
+    Шаблоны собраны в альтернацию с именованными группами, поэтому сообщение
+    классифицируется одной попыткой сопоставления: первая совпавшая ветка —
+    это первый по порядку шаблон, как при переборе. Шаблоны, которые нельзя
+    встроить веткой (separate_reason), проверяются отдельно на своём месте
+    в порядке — альтернация тогда делится на несколько частей.
+    counts — сколько сообщений свернул каждый шаблон (для настройки правил).
+    """
+
+    def __init__(self, patterns=None, texts=None):
+        patterns = PATTERNS if patterns is None else patterns
+        texts = GROUP_TEXT if texts is None else texts
+        self.labels = list(patterns)
+        self.texts = [texts.get(label) for label in self.labels]
+        self.steps = []   # (регулярка, номер шаблона или None — ветки альтернации)
+        branches, names = [], set()
+        for i, (label, regex) in enumerate(patterns.items()):
+            reason = separate_reason(regex)
+            # одноимённые группы двух шаблонов в одной альтернации — re.error, начинаем новую
+            if reason is not None or not names.isdisjoint(regex.groupindex):
+                self._add_alternation(branches)
+                branches, names = [], set()
+            if reason is not None:
+                logger.info(f"Шаблон «{label}» проверяется отдельно: {reason}")
+                self.steps.append((regex, i))
+                continue
+            flags = "i" if regex.flags & re.IGNORECASE else ""
+            branches.append(f"(?P<g{i}>(?{flags}:{regex.pattern}))" if flags
+                            else f"(?P<g{i}>{regex.pattern})")
+            names.update(regex.groupindex)
+        self._add_alternation(branches)
+        self.hits = [0] * len(self.labels)
+
+    def _add_alternation(self, branches):
+        if branches:
+            self.steps.append((re.compile("|".join(branches)), None))
+
+    def group(self, msg: str) -> str:
+        for regex, index in self.steps:
+            m = regex.match(msg)
+            if m is not None:
+                i = int(m.lastgroup[1:]) if index is None else index
+                self.hits[i] += 1
+                return self.texts[i] or msg
+        return msg
+
+    @property
+    def counts(self) -> dict:
+        return dict(zip(self.labels, self.hits))
+
 def group_patterns(counter: Counter) -> Counter:
+    grouper = Grouper()
     grouped = Counter()
     for (msg, traffic), count in counter.items():
-        for label, regex in PATTERNS.items():
-            if regex.match(msg):
-                if label == "Kod posylki":
-                    msg = "<код>KZ.Kod posylki -. Srok hranenia 14 dney. Uznat dopolnitelnuyu informaciu mozhete na post.kz."
-                elif label == "Sizdin belsendiru kody":
-                    msg = "Sizdin belsendiru kody / Vash kod aktivatsii:<код>"
-                elif label == "Tekseru kody":
-                    msg = "Tekseru kody/Kod proverki:<код>"
-                break
-        grouped[(msg, traffic)] += count
+        grouped[(grouper.group(msg), traffic)] += count
     return grouped
 
+
+class SpaceSaving:
+    """
+    Приближённый подсчёт самых частых ключей (алгоритм Space-Saving) в
+    capacity ячейках. Новый ключ при заполненной таблице вытесняет ключ с
+    наименьшим счётчиком и наследует его значение как ошибку. Гарантии для
+    потока из N элементов: счётчик завышен не больше чем на N / capacity,
+    и любой ключ с частотой выше N / capacity в таблице присутствует.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}   # ключ → счётчик
+        self.errors = {}   # ключ → на сколько счётчик может быть завышен
+        self._heap = []    # (счётчик на момент добавления, ключ); устаревшие записи обновляются лениво
+
+    def add(self, key, n=1):
+        self.total += n
+        counts = self.counts
+        if key in counts:
+            counts[key] += n
+            return
+        if len(counts) < self.capacity:
+            counts[key] = n
+            self.errors[key] = 0
+            heapq.heappush(self._heap, (n, key))
+            return
+        # Ищем ключ с минимальным счётчиком: записи в куче могут отставать от counts
+        while True:
+            count, victim = self._heap[0]
+            if counts[victim] == count:
+                break
+            heapq.heapreplace(self._heap, (counts[victim], victim))
+        heapq.heapreplace(self._heap, (count + n, key))
+        del counts[victim], self.errors[victim]
+        counts[key] = count + n
+        self.errors[key] = count
+
+    def error_bound(self) -> int:
+        return self.total // self.capacity
+
+    def counter(self) -> Counter:
+        return Counter(self.counts)
+
 def write_csv_split(grouped, prefix, max_rows):
+    with profiling.stage("write_csv") as st:
+        st.rows_in = st.rows_out = len(grouped)
+        _write_csv_split(grouped, prefix, max_rows)
+
+def _write_csv_split(grouped, prefix, max_rows):
     file_index = 1
     row_count = 0
     current_writer = None
@@ -56,8 +206,8 @@ def write_csv_split(grouped, prefix, max_rows):
         if row_count % max_rows == 0:
             if out_file:
                 out_file.close()
-            filename = f"{prefix}_{file_index}.csv"
-            out_file = open(filename, "w", encoding="utf-8", newline='')
+            filename = f"{prefix}_{file_index}.csv" + (f".{CSV_COMPRESSION}" if CSV_COMPRESSION else "")
+            out_file = open_output(filename)
             current_writer = csv.writer(out_file)
             current_writer.writerow(["Pattern", "Traffic Type", "Count"])
             file_index += 1
@@ -71,44 +221,115 @@ def write_csv_split(grouped, prefix, max_rows):
         out_file.close()
         logger.info(f"Всего файлов записано: {file_index - 1}")
 
-if __name__ == "__main__":
-    counter = Counter()
+def read_rows(path):
+    """Строки файла списками, первая — заголовок: CSV (в том числе сжатый) с разделителем SEP или лист .xlsx."""
+    if xlsx_io.is_xlsx(path):
+        yield from xlsx_io.iter_rows(path)
+        return
+    with open_text(path) as f:
+        yield from csv.reader(f, delimiter=SEP, quoting=csv.QUOTE_NONE)
 
-    with open(INPUT_FILE, encoding="utf-8") as f:
-        reader = csv.reader(f, delimiter=SEP, quoting=csv.QUOTE_NONE)
-        header = next(reader)
+def iter_messages(path, grouper):
+    """
+    Ключи (сообщение, тип трафика) по строкам файла: сообщение очищено и уже
+    сгруппировано grouper'ом, поэтому уникальные OTP-строки не доходят до счётчика.
+    """
+    reader = read_rows(path)
+    header = next(reader)
 
-        try:
-            msg_idx = header.index("message")
-            traffic_idx = header.index("traffic_type")
-        except ValueError:
-            raise Exception("Файл должен содержать колонки 'message' и 'traffic_type'")
+    try:
+        msg_idx = header.index(MSG_COL)
+        traffic_idx = header.index(TYPE_COL)
+    except ValueError:
+        raise Exception(f"Файл должен содержать колонки '{MSG_COL}' и '{TYPE_COL}'")
 
-        for row in reader:
-            if len(row) <= max(msg_idx, traffic_idx):
-                continue
+    for row in reader:
+        if len(row) <= max(msg_idx, traffic_idx):
+            continue
 
-            raw = row[msg_idx]
-            traffic = row[traffic_idx].strip() or "UNKNOWN"
-            msg = clean_message(raw)
+        raw = row[msg_idx]
+        traffic = row[traffic_idx].strip() or "UNKNOWN"
+        msg = clean_message(raw)
 
-            if len(msg) >= MIN_LEN:
-                counter[(msg, traffic)] += 1
+        if len(msg) >= MIN_LEN:
+            yield grouper.group(msg), traffic
 
-    grouped = group_patterns(counter)
+def count_messages(path, grouper=None):
+    """Точный подсчёт сгруппированных сообщений по паре (сообщение, тип трафика)."""
+    with profiling.stage("count") as st:
+        grouped = Counter(st.count_in(iter_messages(path, grouper or Grouper())))
+        st.rows_out = len(grouped)
+    return grouped
 
-    # Markdown вывод
-    with open(OUTPUT_MD, "w", encoding="utf-8") as md:
-        md.write("| # | Count | Traffic Type | Pattern |\n")
-        md.write("|:-:|------:|:-------------|:--------|\n")
-        for i, ((msg, traffic), count) in enumerate(grouped.most_common(TOP_N), start=1):
+def count_messages_approx(path, top_n=TOP_N, grouper=None):
+    """Приближённый подсчёт: SpaceSaving на SKETCH_FACTOR * top_n ячеек."""
+    sketch = SpaceSaving(SKETCH_FACTOR * top_n)
+    with profiling.stage("count_approx") as st:
+        for key in iter_messages(path, grouper or Grouper()):
+            sketch.add(key)
+        st.rows_in, st.rows_out = sketch.total, len(sketch.counts)
+    return sketch
+
+def log_group_counts(grouper):
+    for label, n in grouper.counts.items():
+        logger.info(f"Шаблон «{label}»: свёрнуто сообщений {n}")
+        # шаблоны проверяются одной альтернацией — время по веткам не разделить
+        if profiling.current is not None:
+            profiling.current.count("groups", label, n)
+
+def write_markdown(grouped, path, top_n, errors=None):
+    """errors — завышение счётчиков приближённого режима, выводится отдельной колонкой."""
+    with open(path, "w", encoding="utf-8") as md, profiling.stage("write_markdown") as st:
+        st.rows_in, st.rows_out = len(grouped), min(top_n, len(grouped))
+        if errors is None:
+            md.write("| # | Count | Traffic Type | Pattern |\n")
+            md.write("|:-:|------:|:-------------|:--------|\n")
+        else:
+            md.write("| # | Count | ± | Traffic Type | Pattern |\n")
+            md.write("|:-:|------:|--:|:-------------|:--------|\n")
+        for i, (key, count) in enumerate(grouped.most_common(top_n), start=1):
+            msg, traffic = key
             safe = msg.replace("|", "\\|")
-            md.write(f"| {i} | {count} | {traffic} | {safe} |\n")
+            err = "" if errors is None else f" {errors[key]} |"
+            md.write(f"| {i} | {count} |{err} {traffic} | {safe} |\n")
+
+def main(input_file=INPUT_FILE, output_md=OUTPUT_MD, csv_prefix=OUTPUT_CSV_PREFIX, approx=None,
+         groups_file=None):
+    approx = APPROX if approx is None else approx
+    groups_file = groups_file or GROUPS_FILE
+    grouper = Grouper(*load_groups(groups_file)) if groups_file else Grouper()
+    if approx:
+        sketch = count_messages_approx(input_file, TOP_N, grouper)
+        log_group_counts(grouper)
+        grouped = sketch.counter()
+        write_markdown(grouped, output_md, TOP_N, sketch.errors)
+        write_csv_split(Counter(dict(grouped.most_common(TOP_N))), csv_prefix, MAX_ROWS_PER_FILE)
+        print("Всего очищенных сообщений:", sketch.total)
+        print(f"Приближённый режим: {sketch.capacity} ячеек, счётчики завышены не более чем на {sketch.error_bound()}")
+        return
+
+    grouped = count_messages(input_file, grouper)
+    log_group_counts(grouper)
+
+    # Markdown вывод
+    write_markdown(grouped, output_md, TOP_N)
 
     # CSV с разбивкой
-    write_csv_split(grouped, OUTPUT_CSV_PREFIX, MAX_ROWS_PER_FILE)
+    write_csv_split(grouped, csv_prefix, MAX_ROWS_PER_FILE)
 
     # Статистика
-    print("Всего уникальных очищенных сообщений:", len(counter))
     print("Уникальных шаблонов после группировки:", len(grouped))
     print("After grouping: freq >= 10:", sum(1 for c in grouped.values() if c >= 10))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Топ сообщений по частоте")
+    parser.add_argument("--approx", action="store_true",
+                        help="приближённый топ с памятью O(TOP_N) (Space-Saving)")
+    parser.add_argument("--groups", help="JSON с правилами группировки")
+    parser.add_argument("--compress", choices=["gz", "bz2", "xz"], help="сжимать CSV-части")
+    parser.add_argument("--profile", help="записать JSON-отчёт инструментовки по стадиям")
+    parser.add_argument("--pstats", help="записать дамп cProfile")
+    args = parser.parse_args()
+    CSV_COMPRESSION = args.compress
+    with profiling.session(args.profile, args.pstats, "top_msgs_counter"):
+        main(approx=args.approx or None, groups_file=args.groups)
@@ -0,0 +1,368 @@
+import os
+import posixpath
+import re
+import tempfile
+import zipfile
+from array import array
+from datetime import datetime, timedelta
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import escape
+
+from pattern_utils import MemoCache
+
+# --- Потоковое чтение и запись .xlsx без сторонних библиотек ---
+# Лист читается через iterparse прямо из zip-архива: в памяти только текущая
+# строка. Общие строки (sharedStrings.xml) сбрасываются во временный файл,
+# в памяти — смещения и LRU-кэш частых значений. Запись идёт строка за
+# строкой в zip; строки хранятся inline, без таблицы общих строк.
+XLSX_SUFFIX = ".xlsx"
+EXCEL_MAX_ROWS = 1_048_576   # строк на лист, включая заголовок
+SST_CACHE_SIZE = 50_000      # общих строк в LRU-кэше чтения
+
+_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# Встроенные форматы дат/времени Excel (numFmtId)
+_DATE_FORMAT_IDS = set(range(14, 23)) | {45, 46, 47}
+_DATE_FORMAT_RX = re.compile(r'[dmyhs]', re.IGNORECASE)
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+# Символы, недопустимые в XML 1.0
+_XML_ILLEGAL_RX = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def is_xlsx(path) -> bool:
+    return str(path).lower().endswith(XLSX_SUFFIX)
+
+
+def _column_index(ref: str) -> int:
+    """'B7' → 1, 'AA3' → 26."""
+    n = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        n = n * 26 + (ord(ch.upper()) - 64)
+    return n - 1
+
+
+def _column_letter(i: int) -> str:
+    out = ""
+    i += 1
+    while i:
+        i, rem = divmod(i - 1, 26)
+        out = chr(65 + rem) + out
+    return out
+
+
+def _text(elem) -> str:
+    """Текст <si>/<is>: простой <t> или фрагменты <r><t> форматированной строки (без подсказок <rPh>)."""
+    t = elem.find(_NS + "t")
+    if t is not None:
+        return t.text or ""
+    return "".join(r.findtext(_NS + "t") or "" for r in elem.iter(_NS + "r"))
+
+
+class SharedStrings:
+    """
+    Таблица общих строк, сброшенная во временный файл: в памяти массив
+    смещений (8 байт на строку) и кэш последних обращений.
+    """
+
+    def __init__(self, archive: zipfile.ZipFile, name: str, cache_size=SST_CACHE_SIZE):
+        self._file = tempfile.TemporaryFile()
+        self.offsets = array("Q", [0])
+        if name in archive.namelist():
+            with archive.open(name) as src:
+                root = None
+                for event, elem in iterparse(src, events=("start", "end")):
+                    if root is None:
+                        root = elem
+                    elif event == "end" and elem.tag == _NS + "si":
+                        self._file.write(_text(elem).encode("utf-8"))
+                        self.offsets.append(self._file.tell())
+                        root.clear()  # разобранные <si> не копятся в дереве
+        self.get = MemoCache(self._load, cache_size)
+
+    def _load(self, idx) -> str:
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        self._file.seek(start)
+        return self._file.read(end - start).decode("utf-8")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def close(self):
+        self._file.close()
+
+
+def _date_styles(archive: zipfile.ZipFile) -> set:
+    """Номера стилей ячеек (атрибут s), отформатированных как дата/время."""
+    if "xl/styles.xml" not in archive.namelist():
+        return set()
+    custom, xfs = {}, []
+    with archive.open("xl/styles.xml") as src:
+        in_cell_xfs = False
+        for event, elem in iterparse(src, events=("start", "end")):
+            if elem.tag == _NS + "cellXfs":
+                in_cell_xfs = event == "start"
+            elif event == "end" and elem.tag == _NS + "numFmt":
+                code = re.sub(r'"[^"]*"|\[[^\]]*\]', "", elem.get("formatCode", ""))
+                custom[int(elem.get("numFmtId"))] = bool(_DATE_FORMAT_RX.search(code))
+            elif event == "end" and elem.tag == _NS + "xf" and in_cell_xfs:
+                xfs.append(int(elem.get("numFmtId", 0)))
+    return {i for i, fmt in enumerate(xfs) if fmt in _DATE_FORMAT_IDS or custom.get(fmt)}
+
+
+def _excel_date(value: str) -> str:
+    moment = _EXCEL_EPOCH + timedelta(days=float(value))
+    # округляем до секунды — в Excel время хранится дробью суток
+    moment = (moment + timedelta(microseconds=500_000)).replace(microsecond=0)
+    return moment.isoformat(sep=" ")
+
+
+def _sheet_paths(archive: zipfile.ZipFile, sheet=None) -> list:
+    """
+    Пути XML листа по имени (или первого листа) и его продолжений «<имя>_2»,
+    «<имя>_3» …, на которые XlsxWriter переносит строки сверх EXCEL_MAX_ROWS.
+    """
+    with archive.open("xl/workbook.xml") as src:
+        sheets = [(el.get("name"), el.get(_REL_NS + "id"))
+                  for _, el in iterparse(src) if el.tag == _NS + "sheet"]
+    if not sheets:
+        raise Exception("В книге нет листов")
+    ids = dict(sheets)
+    name = sheets[0][0] if sheet is None else sheet
+    if name not in ids:
+        raise Exception(f"Лист '{sheet}' не найден; есть: {[name for name, _ in sheets]}")
+    chain = [ids[name]]
+    while f"{name}_{len(chain) + 1}" in ids:
+        chain.append(ids[f"{name}_{len(chain) + 1}"])
+
+    with archive.open("xl/_rels/workbook.xml.rels") as src:
+        targets = {el.get("Id"): el.get("Target")
+                   for _, el in iterparse(src) if el.tag == _PKG_REL_NS + "Relationship"}
+    paths = []
+    for rel_id in chain:
+        target = targets[rel_id]
+        paths.append(target.lstrip("/") if target.startswith("/")
+                     else posixpath.normpath(posixpath.join("xl", target)))
+    return paths
+
+
+def _sheet_rows(src, strings, date_styles):
+    row, position, sheet_data = [], 0, None
+    for event, elem in iterparse(src, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == _NS + "sheetData":
+                sheet_data = elem
+            continue
+        if tag == _NS + "c":
+            ref = elem.get("r")
+            col = _column_index(ref) if ref else position
+            kind = elem.get("t", "n")
+            if kind == "inlineStr":
+                is_elem = elem.find(_NS + "is")
+                value = _text(is_elem) if is_elem is not None else ""
+            else:
+                v = elem.find(_NS + "v")
+                value = (v.text or "") if v is not None else ""
+                if kind == "s" and value:
+                    value = strings.get(int(value))
+                elif kind == "n" and value and int(elem.get("s", 0)) in date_styles:
+                    value = _excel_date(value)
+                elif kind == "b":
+                    value = "TRUE" if value == "1" else "FALSE"
+            if col > len(row):
+                row.extend([""] * (col - len(row)))
+            row.append(value)
+            position = col + 1
+        elif tag == _NS + "row":
+            if row:
+                yield row
+            row, position = [], 0
+            sheet_data.clear()  # в памяти только текущая строка
+
+
+def iter_rows(path, sheet=None):
+    """
+    Строки листа как списки строк (первая — заголовок, как у csv.reader),
+    затем строки его листов-продолжений без повторного заголовка.
+    Пустые ячейки и пропущенные столбцы — пустые строки, пустые строки листа пропускаются.
+    Даты отдаются в виде 'ГГГГ-ММ-ДД ЧЧ:ММ:СС'.
+    """
+    with zipfile.ZipFile(path) as archive:
+        strings = SharedStrings(archive, "xl/sharedStrings.xml")
+        date_styles = _date_styles(archive)
+        try:
+            header = None
+            for part in _sheet_paths(archive, sheet):
+                with archive.open(part) as src:
+                    rows = _sheet_rows(src, strings, date_styles)
+                    if header is None:
+                        header = next(rows, None)
+                        if header is not None:
+                            yield header
+                    else:
+                        first = next(rows, None)
+                        if first is not None and first != header:
+                            yield first
+                    yield from rows
+        finally:
+            strings.close()
+
+
+class DictReader:
+    """Строки листа словарями по заголовку — замена csv.DictReader для .xlsx."""
+
+    def __init__(self, path, sheet=None):
+        self._rows = iter_rows(path, sheet)
+        self.fieldnames = next(self._rows, None) or []
+        self.line_num = 1
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self._rows)
+        self.line_num += 1
+        width = len(self.fieldnames)
+        if len(row) < width:
+            row.extend([""] * (width - len(row)))
+        return dict(zip(self.fieldnames, row))
+
+    def close(self):
+        self._rows.close()
+
+
+def dict_rows(path, sheet=None):
+    """Строки листа словарями, с закрытием файла по окончании."""
+    reader = DictReader(path, sheet)
+    try:
+        yield from reader
+    finally:
+        reader.close()
+
+
+# ----------------------------------------------------------------------------
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '{sheets}</Types>'
+)
+_SHEET_TYPE = ('<Override PartName="/xl/worksheets/sheet{n}.xml" '
+               'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>')
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="xl/workbook.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>'
+)
+
+
+class XlsxWriter:
+    """
+    Потоковая запись книги: writerow() пишет строку в текущий лист, при
+    достижении max_rows строк открывается следующий лист с тем же
+    заголовком («Report», «Report_2», …). Числа пишутся числами, остальное —
+    inline-строками.
+    """
+
+    def __init__(self, path, header, sheet_name="Report", max_rows=EXCEL_MAX_ROWS):
+        self.path = path
+        self.header = list(header)
+        self.sheet_name = sheet_name
+        self.max_rows = max_rows
+        self._tmp = path + ".tmp"
+        self._zip = zipfile.ZipFile(self._tmp, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+        self._sheet = None
+        self.sheets = 0
+        self.rows = 0   # строк данных всего
+        self._row_in_sheet = 0
+
+    def _open_sheet(self):
+        self._close_sheet()
+        self.sheets += 1
+        self._sheet = self._zip.open(f"xl/worksheets/sheet{self.sheets}.xml", "w", force_zip64=True)
+        self._sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                          b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                          b'<sheetData>')
+        self._row_in_sheet = 0
+        self._write_row(self.header)
+
+    def _close_sheet(self):
+        if self._sheet is not None:
+            self._sheet.write(b'</sheetData></worksheet>')
+            self._sheet.close()
+            self._sheet = None
+
+    def _write_row(self, values):
+        self._row_in_sheet += 1
+        n = self._row_in_sheet
+        cells = []
+        for i, value in enumerate(values):
+            ref = f"{_column_letter(i)}{n}"
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                cells.append(f'<c r="{ref}"><v>{value}</v></c>')
+            elif value is not None and value != "":
+                text = escape(_XML_ILLEGAL_RX.sub("", str(value)))
+                cells.append(f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+        self._sheet.write(f'<row r="{n}">{"".join(cells)}</row>'.encode("utf-8"))
+
+    def writerow(self, values):
+        if self._sheet is None or self._row_in_sheet >= self.max_rows:
+            self._open_sheet()
+        self._write_row(values)
+        self.rows += 1
+
+    def writerows(self, rows):
+        for values in rows:
+            self.writerow(values)
+
+    def close(self):
+        if self._sheet is None:
+            self._open_sheet()   # пустой отчёт — лист с одним заголовком
+        self._close_sheet()
+        names = [self.sheet_name if i == 1 else f"{self.sheet_name}_{i}" for i in range(1, self.sheets + 1)]
+        self._zip.writestr("xl/workbook.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+            + "".join(f'<sheet name="{escape(name)}" sheetId="{i}" r:id="rId{i}"/>'
+                      for i, name in enumerate(names, start=1))
+            + '</sheets></workbook>'))
+        self._zip.writestr("xl/_rels/workbook.xml.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + "".join(f'<Relationship Id="rId{i}" Target="worksheets/sheet{i}.xml" '
+                      'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+                      for i in range(1, self.sheets + 1))
+            + '</Relationships>'))
+        self._zip.writestr("_rels/.rels", _ROOT_RELS)
+        self._zip.writestr("[Content_Types].xml", _CONTENT_TYPES.format(
+            sheets="".join(_SHEET_TYPE.format(n=i) for i in range(1, self.sheets + 1))))
+        self._zip.close()
+        os.replace(self._tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self._zip.close()
+            os.remove(self._tmp)
+
+
+def write_dicts(rows, columns, path, max_rows=EXCEL_MAX_ROWS) -> int:
+    """Пишет строки-словари (ключи columns) в книгу; возвращает число листов."""
+    with XlsxWriter(path, columns, max_rows=max_rows) as w:
+        for row in rows:
+            w.writerow([row[name] for name in columns])
+    return w.sheets